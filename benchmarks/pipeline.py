@@ -0,0 +1,104 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import write_synthetic_dump
+from votacoes_assembleia_da_republica.fetch_votes import parse_initiatives, parse_vote
+from votacoes_assembleia_da_republica.json_stream import iter_json_array_file
+from votacoes_assembleia_da_republica.state_storage import _compress_state, _decompress_state
+from votacoes_assembleia_da_republica.update_account import group_votes_by_result, render_vote
+
+SIZES = [1_000, 5_000, 10_000, 50_000]
+
+
+def measure(stage, *args) -> tuple[float, int, object]:
+    # timed without tracemalloc, which slows allocations down a lot, then run again to record the peak memory
+    start = time.perf_counter()
+    result = stage(*args)
+    elapsed = time.perf_counter() - start
+    del result
+
+    tracemalloc.start()
+    result = stage(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def stages(dump_path: str):
+    # (name, stage, input builder) in pipeline order, each stage runs on the previous stage's output
+    return [
+        ("parse_initiatives", lambda _: list(parse_initiatives(iter_json_array_file(dump_path)))),
+        ("parse_vote", lambda raw_votes: [parse_vote(raw_vote) for raw_vote in raw_votes]),
+        ("render_vote", lambda votes: ([render_vote(vote) for vote in votes], votes)[1]),
+        ("group_votes_by_result", lambda votes: (group_votes_by_result(votes), votes)[1]),
+        ("compress_state", lambda votes: _compress_state({vote["vote_id"]: "published" for vote in votes})),
+        ("decompress_state", _decompress_state),
+    ]
+
+
+def benchmark(size: int, directory: str) -> list[dict]:
+    dump_path = os.path.join(directory, f"Iniciativas{size}_json.txt")
+    write_synthetic_dump(dump_path, size)
+
+    results = []
+    value = None
+    items = size
+    for name, stage in stages(dump_path):
+        # the encoded state is a single string, it still holds one entry per vote
+        items = len(value) if isinstance(value, list) else items
+        elapsed, peak, value = measure(stage, value)
+        results.append({"initiatives": size, "stage": name, "items": items, "seconds": elapsed, "peak_memory_bytes": peak})
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list[int]) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        results = [result for size in sizes for result in benchmark(size, directory)]
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def print_results(report: dict, baseline: dict | None = None) -> None:
+    baseline_seconds = {(r["initiatives"], r["stage"]): r["seconds"] for r in baseline["results"]} if baseline else {}
+    print(f"{'initiatives':>11} {'stage':>22} {'items':>8} {'ms':>10} {'peak KiB':>10} {'vs base':>8}")
+    for r in report["results"]:
+        previous = baseline_seconds.get((r["initiatives"], r["stage"]))
+        ratio = f"{r['seconds'] / previous:>7.2f}x" if previous else ""
+        print(f"{r['initiatives']:>11} {r['stage']:>22} {r['items']:>8} {r['seconds'] * 1000:>10.1f} {r['peak_memory_bytes'] / 1024:>10.0f} {ratio:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES, help="Number of initiatives in each synthetic dump")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    report = run(args.sizes)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(report, baseline)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"results written to {args.output}")
@@ -0,0 +1,65 @@
+import base64
+import gzip
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from votacoes_assembleia_da_republica.state_storage import _compress_state, _decompress_state
+
+SIZES = [10_000, 25_000, 50_000, 100_000]
+
+
+def synthetic_state(size: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    state = {}
+    vote_id = 120_000
+    for _ in range(size):
+        vote_id += rng.choice([1, 1, 1, 2, 3, 7])
+        state[str(vote_id)] = rng.choices(["published", "errored", "skipped"], weights=[90, 2, 8])[0]
+    return state
+
+
+def legacy_compress(state: dict) -> str:
+    return base64.b64encode(gzip.compress(json.dumps(state).encode())).decode()
+
+
+def legacy_decompress(value: str) -> dict:
+    return json.loads(gzip.decompress(base64.b64decode(value, validate=True)))
+
+
+def measure(decode, encoded: str) -> tuple[float, int]:
+    start = time.perf_counter()
+    decode(encoded)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    decoded = decode(encoded)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del decoded
+    return elapsed, memory
+
+
+def benchmark(size: int) -> dict:
+    state = synthetic_state(size)
+    legacy = legacy_compress(state)
+    compact = _compress_state(state)
+    legacy_time, legacy_memory = measure(legacy_decompress, legacy)
+    compact_time, compact_memory = measure(_decompress_state, compact)
+    return {
+        "size": size,
+        "legacy": {"encoded_bytes": len(legacy), "decode_seconds": legacy_time, "memory_bytes": legacy_memory},
+        "compact": {"encoded_bytes": len(compact), "decode_seconds": compact_time, "memory_bytes": compact_memory},
+    }
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    print(f"{'votes':>8} {'format':>8} {'encoded':>10} {'decode ms':>10} {'memory':>10}")
+    for size in sizes:
+        result = benchmark(size)
+        for name in ("legacy", "compact"):
+            r = result[name]
+            print(f"{size:>8} {name:>8} {r['encoded_bytes']:>10} {r['decode_seconds'] * 1000:>10.1f} {r['memory_bytes']:>10}")
@@ -0,0 +1,84 @@
+import json
+import random
+from typing import Iterator
+
+PARTIES = ["PSD", "PS", "CH", "IL", "BE", "PCP", "L", "PAN", "CDS-PP", "JPP"]
+PHASES = ["Votação na generalidade", "Votação na especialidade", "Votação final global", "Votação Deliberação", "Requerimento"]
+INITIATIVE_TYPES = [("Projeto de Lei", "J"), ("Projeto de Resolução", "R"), ("Proposta de Lei", "P"), ("Inquérito Parlamentar", "I")]
+RESULTS = ["Aprovado", "Rejeitado", "Aprovado", "Rejeitado", "Prejudicado"]
+
+
+def synthetic_vote_detail(rng: random.Random) -> tuple[str | None, str | None]:
+    # (detalhe, unanime) in the shapes found in the real dumps
+    shape = rng.random()
+    if shape < 0.15:
+        return None, "unanime"
+    if shape < 0.2:
+        return None, None
+
+    parties = rng.sample(PARTIES, len(PARTIES))
+    cuts = sorted(rng.sample(range(1, len(parties)), 2))
+    sections = {"A Favor": parties[: cuts[0]], "Contra": parties[cuts[0] : cuts[1]], "Abstenção": parties[cuts[1] :]}
+    if rng.random() < 0.1:
+        sections["Ausência"] = [sections["Abstenção"].pop()] if len(sections["Abstenção"]) > 1 else []
+    return "<BR>".join(f"{name}:" + ", ".join(f"<I>{party}</I>" for party in members) for name, members in sections.items() if members), None
+
+
+def one_or_many(rng: random.Random, items: list):
+    # the dumps use a single object instead of a one element list about as often as not
+    if len(items) == 1 and rng.random() < 0.5:
+        return items[0]
+    return items
+
+
+def synthetic_initiative(rng: random.Random, number: int, vote_ids: Iterator[int]) -> dict:
+    initiative_type, initiative_type_code = rng.choice(INITIATIVE_TYPES)
+    authors = [{"GP": party} for party in rng.sample(PARTIES, rng.choice([0, 1, 1, 1, 2]))]
+
+    events = []
+    for _ in range(rng.choice([0, 1, 2, 3, 4])):
+        votes = []
+        for _ in range(rng.choice([0, 0, 1, 1, 2])):
+            detail, unanimous = synthetic_vote_detail(rng)
+            vote = {
+                "id": str(next(vote_ids)),
+                "resultado": rng.choice(RESULTS),
+                "reuniao": "8",
+                "tipoReuniao": "RP",
+                "detalhe": detail,
+                "data": f"2024-{rng.randint(4, 12):02}-{rng.randint(1, 28):02}",
+            }
+            if unanimous:
+                vote["unanime"] = unanimous
+            votes.append(vote)
+        events.append({"Fase": rng.choice(PHASES), "DataFase": "2024-04-19", "EvtId": "73", "Votacao": one_or_many(rng, votes) if votes else None})
+
+    return {
+        "IniDescTipo": initiative_type,
+        "IniTipo": initiative_type_code,
+        "IniTitulo": " ".join(
+            rng.choice(["Altera", "o", "Código", "do", "Imposto", "sobre", "Rendimento", "das", "Pessoas", "Singulares"]) for _ in range(rng.randint(5, 60))
+        ),
+        "IniLinkTexto": f"http://app.parlamento.pt/webutils/docs/doc.pdf?path={rng.getrandbits(512):0128x}&fich={number}.docx&Inline=true",
+        "IniAutorGruposParlamentares": one_or_many(rng, authors) if authors else None,
+        "IniEventos": one_or_many(rng, events) if events else None,
+        "IniNr": str(number),
+        "IniId": str(100_000 + number),
+    }
+
+
+def synthetic_initiatives(count: int, seed: int = 0) -> Iterator[dict]:
+    rng = random.Random(seed)
+    vote_ids = iter(range(120_000, 10**9))
+    for number in range(1, count + 1):
+        yield synthetic_initiative(rng, number, vote_ids)
+
+
+def write_synthetic_dump(path, count: int, seed: int = 0) -> None:
+    # written one initiative at a time, like the Iniciativas<legislature>_json.txt dumps
+    with open(path, "w") as dump:
+        dump.write("[")
+        for i, initiative in enumerate(synthetic_initiatives(count, seed)):
+            dump.write(",\n" if i else "\n")
+            dump.write(json.dumps(initiative, ensure_ascii=False))
+        dump.write("\n]")
@@ -1,25 +1,18 @@
-import os
-import sys
-from datetime import datetime, timezone, timedelta
+from votacoes_assembleia_da_republica.posted_statuses import parse_selection, select_statuses, selection_parser
+from votacoes_assembleia_da_republica.state_storage import StateStorage
+from votacoes_assembleia_da_republica.update_account import state_file_paths_for
 from dotenv import load_dotenv
-from mastodon import Mastodon
-
-since_minutes_ago = int(sys.argv[1] if len(sys.argv) > 1 else 1)
 
 load_dotenv()
-MASTODON_ACCESS_TOKEN = os.environ["MASTODON_ACCESS_TOKEN"]
-
-m = Mastodon(access_token=MASTODON_ACCESS_TOKEN, api_base_url="https://masto.pt")
-my_id = m.me().id
-since = datetime.now(timezone.utc) - timedelta(minutes=since_minutes_ago)
+args, selection = parse_selection(selection_parser("Count the statuses posted for the selected votes, from the ids kept in the state"))
 
-count = 0
-page = m.account_statuses(id=my_id, limit=40)
-while page:
-    matching = [s for s in page if s["created_at"] >= since]
-    count += len(matching)
-    if len(matching) < len(page):
-        break
-    page = m.fetch_next(page)
+total = 0
+for legislature, state_file_path in state_file_paths_for(args.legislatures).items():
+    # only read, never saved
+    state = StateStorage(legislature, file_path=state_file_path, use_github=args.github_state).__enter__()
+    state.posts.load_all()
+    vote_ids, status_ids = select_statuses(state.posts, **selection)
+    print(f"{legislature}: {len(status_ids)} statuses of {len(vote_ids)} votes")
+    total += len(status_ids)
 
-print(f"{count} statuses in the last {since_minutes_ago} minutes")
+print(f"{total} statuses")
@@ -1,8 +1,29 @@
+import argparse
 import json
-from votacoes_assembleia_da_republica.state_storage import _decompress_state
+from votacoes_assembleia_da_republica.fetch_votes import JSON_URIS
+from votacoes_assembleia_da_republica.state_storage import StateStorage, _decode_manifest, _decompress_state
+from dotenv import load_dotenv
+
+load_dotenv()
+parser = argparse.ArgumentParser(description="Decode the value of a STATE_<legislature> variable saved in state.json.gzip.b64 into state.json")
+parser.add_argument("legislature", nargs="?", choices=list(JSON_URIS), help="Legislature whose shards are read from GitHub when the value is a shard manifest")
+args = parser.parse_args()
 
 with open("state.json.gzip.b64", "r") as f:
-    state = _decompress_state(f.read())
+    value = f.read().strip()
+
+manifest = _decode_manifest(value)
+if manifest is None:
+    # a legacy state, all of it in the one variable
+    state = dict(_decompress_state(value))
+else:
+    # STATE_<legislature> only lists the shards, each one is kept in its own STATE_<legislature>_<n> variable
+    if args.legislature is None:
+        parser.error("state.json.gzip.b64 holds a shard manifest, pass its legislature to read the shards from GitHub")
+    storage = StateStorage(args.legislature, use_github=True)
+    state = {}
+    for key in manifest["shards"]:
+        state.update(storage.read_shard(key))
 
 with open("state.json", "w") as f:
     json.dump(state, f)
@@ -1,33 +1,18 @@
-import os
-import sys
-from datetime import datetime, timezone, timedelta
+from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+from votacoes_assembleia_da_republica.posted_statuses import delete_statuses, parse_selection, select_statuses, selection_parser
+from votacoes_assembleia_da_republica.state_storage import StateStorage
+from votacoes_assembleia_da_republica.update_account import state_file_paths_for
 from dotenv import load_dotenv
-from mastodon import Mastodon
-from time import sleep
-
-since_minutes_ago = int(sys.argv[1] if len(sys.argv) > 1 else 1)
 
 load_dotenv()
-MASTODON_ACCESS_TOKEN = os.environ["MASTODON_ACCESS_TOKEN"]
-
-m = Mastodon(access_token=MASTODON_ACCESS_TOKEN, api_base_url="https://masto.pt")
-my_id = m.me().id
-
-
-while True:
-    # input(f'Delete {len(statuses_to_delete)} statuses? ^C to cancel')
-    statuses_to_delete = [
-        s for s in m.account_statuses(id=my_id, limit=30) if s["created_at"] >= datetime.now(timezone.utc) - timedelta(minutes=since_minutes_ago)
-    ]
-    if not statuses_to_delete:
-        break
-
-    print(f"Deleting {len(statuses_to_delete)} statuses since {since_minutes_ago} minutes ago")
-    for status in statuses_to_delete:
-        id = status["id"]
-        print(f"deleting {id}")
-        m.status_delete(id)
+parser = selection_parser("Delete the statuses posted for the selected votes, from the ids kept in the state")
+parser.add_argument("--forget", action="store_true", help="Also drop the votes from the state, so the next run posts them again")
+args, selection = parse_selection(parser)
 
-    if len(statuses_to_delete) >= 30:
-        print("waiting for the rate limit to expire")
-        sleep(30 * 60)  # rate limits are 30 deletes per 30 minutes
+m = MastodonClient()
+for legislature, state_file_path in state_file_paths_for(args.legislatures).items():
+    with StateStorage(legislature, file_path=state_file_path, use_github=args.github_state) as state:
+        state.posts.load_all()
+        vote_ids, status_ids = select_statuses(state.posts, **selection)
+        print(f"deleting {len(status_ids)} statuses of {len(vote_ids)} votes for {legislature}")
+        delete_statuses(m, state, vote_ids, status_ids, forget_votes=args.forget)
@@ -0,0 +1,61 @@
+import random
+
+from votacoes_assembleia_da_republica.analytics import PartyMatrix, _count_masks, render_weekly_summary
+
+
+def vote(date, result, in_favour=(), against=(), abstained=(), vote_detail=None):
+    return {
+        "vote_id": date,
+        "result": result,
+        "date": date,
+        "vote_detail": vote_detail or {"in_favour": list(in_favour), "against": list(against), "abstained": list(abstained), "absent": []},
+    }
+
+
+VOTES = [
+    vote("2025-03-03", "Aprovado", in_favour=["PS", "L"], against=["CH"]),
+    vote("2025-03-04", "Rejeitado", in_favour=["PS"], against=["CH", "L"]),
+    vote("2025-03-05", "Aprovado", vote_detail="unanime"),
+    vote("2025-03-12", "Rejeitado", in_favour=["L"], against=["CH"], abstained=["PS"]),
+    vote("2025-03-13", "Aprovado", vote_detail="sem detalhes"),
+]
+
+
+def test_count_masks_matches_counting_bits_one_by_one():
+    rng = random.Random(0)
+    masks = [rng.getrandbits(300) for _ in range(11)]
+    counts = _count_masks(masks, (1 << 300) - 1)
+    for i in range(300):
+        expected = sum(mask >> i & 1 for mask in masks)
+        assert [k for k, count in enumerate(counts) if count >> i & 1] == [expected]
+
+
+def test_agreement_and_cohesion_only_count_votes_where_the_parties_were_present():
+    matrix = PartyMatrix(VOTES)
+    assert matrix.parties == ["CH", "L", "PS"]
+    assert matrix.agreement("PS", "L") == 2 / 4
+    assert matrix.agreement("CH", "L") == 2 / 4
+    assert matrix.cohesion(["CH", "L", "PS"]) == 1 / 4
+    assert matrix.agreement("PS", "L", matrix.window("2025-03-10", "2025-03-16")) == 0
+    assert matrix.agreement("PS", "L", matrix.window("2025-04-01")) is None
+
+
+def test_kingmakers_are_on_the_winning_side_of_a_one_party_margin():
+    matrix = PartyMatrix(VOTES)
+    assert matrix.kingmaker_counts() == {"CH": 2, "L": 2, "PS": 1}
+
+
+def test_rolling_windows_cover_every_vote():
+    matrix = PartyMatrix(VOTES)
+    assert matrix.rolling(matrix.vote_count, days=7, step=7) == [("2025-03-03", "2025-03-09", 3), ("2025-03-10", "2025-03-16", 2)]
+
+
+def test_weekly_summary():
+    matrix = PartyMatrix(VOTES)
+    summary = render_weekly_summary(matrix, "2025-03-09")
+    assert "(2025-03-03 a 2025-03-09)" in summary
+    assert "3 votações: 2 aprovadas, 1 rejeitadas" in summary
+    assert "Mais alinhados: CH/L 67%, L/PS 67%, CH/PS 33%" in summary
+    assert "Menos alinhados: CH/PS 33%, CH/L 67%, L/PS 67%" in summary
+    assert "Decisivos: L (2), CH (1), PS (1)" in summary
+    assert render_weekly_summary(matrix, "2025-05-01") is None
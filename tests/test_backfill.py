@@ -0,0 +1,150 @@
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from benchmarks.synthetic import write_synthetic_dump
+from votacoes_assembleia_da_republica import fetch_votes
+from votacoes_assembleia_da_republica.backfill import estimate_backfill, next_checkpoint, select_batch, spent_budget
+from votacoes_assembleia_da_republica.update_account import update
+
+NOW = datetime.datetime(2025, 3, 12, 12, tzinfo=datetime.timezone.utc)
+
+
+def vote(vote_id: int, date: str, result="Aprovado") -> dict:
+    return {"vote_id": str(vote_id), "date": date, "result": result}
+
+
+def test_select_batch_takes_the_oldest_votes_of_every_legislature_that_fit():
+    backlog = {"XVI": [vote(3, "2024-05-01"), vote(1, "2024-04-01", "Rejeitado")], "XVII": [vote(2, "2024-04-15"), vote(4, "2024-06-01")]}
+    # two threads and two votes
+    batch = select_batch(backlog, 4)
+    assert batch == {"XVI": [vote(1, "2024-04-01", "Rejeitado")], "XVII": [vote(2, "2024-04-15")]}
+    # the third vote starts a new thread, and doesn't fit in one status
+    assert select_batch(backlog, 5)["XVI"] == [vote(1, "2024-04-01", "Rejeitado")]
+    assert select_batch(backlog, 0) == {"XVI": [], "XVII": []}
+
+
+def test_checkpoints_only_count_the_batches_inside_the_posting_window(monkeypatch):
+    monkeypatch.setenv("MASTODON_POSTING_WINDOW_MINUTES", "180")
+    checkpoint = next_checkpoint(None, 500, 300, NOW - datetime.timedelta(hours=4))
+    checkpoint = next_checkpoint(checkpoint, 300, 200, NOW - datetime.timedelta(hours=1))
+    assert spent_budget([checkpoint, None], NOW) == 200
+    assert next_checkpoint(checkpoint, 200, 0, NOW) == {"remaining": 200, "batches": [[(NOW - datetime.timedelta(hours=1)).isoformat(), 200]]}
+    assert next_checkpoint(checkpoint, 0, 100, NOW) is None
+
+
+def test_estimate_backfill(monkeypatch):
+    monkeypatch.setenv("MASTODON_POSTING_WINDOW_MINUTES", "180")
+    # 298 votes a run
+    assert estimate_backfill(1000, datetime.timedelta(days=1), budget=300) == (4, datetime.timedelta(days=3))
+    # runs every 30 minutes wait for the window to pass
+    assert estimate_backfill(1000, datetime.timedelta(minutes=30), budget=300) == (19, datetime.timedelta(hours=9))
+    with pytest.raises(ValueError):
+        estimate_backfill(1000, datetime.timedelta(days=1), budget=2)
+
+
+class FakeMastodon(BaseHTTPRequestHandler):
+    # just enough of the Mastodon API for posting, plus the dump, served from localhost
+    dump = b""
+    statuses = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body, status=200) -> None:
+        encoded = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        if self.path == "/dump.json":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(self.dump)))
+            self.end_headers()
+            self.wfile.write(self.dump)
+        elif self.path.startswith("/api/v1/instance"):
+            self.send_json({"version": "4.3.0"})
+        elif self.path.startswith("/api/v1/accounts/verify_credentials"):
+            self.send_json({"id": "1", "acct": "votacoes"})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        with self.lock:
+            for status in self.statuses:
+                if status["idempotency_key"] == self.headers.get("Idempotency-Key"):
+                    return self.send_json(status)
+            status = {
+                "id": str((int(time.time() * 1000) << 16) + len(self.statuses)),
+                "idempotency_key": self.headers.get("Idempotency-Key"),
+                "in_reply_to_id": form.get("in_reply_to_id", [None])[0],
+                "account": {"id": "1"},
+            }
+            self.statuses.append(status)
+        self.send_json(status)
+
+
+@pytest.fixture
+def fake_mastodon(tmp_path):
+    dump_path = tmp_path / "dump.json"
+    write_synthetic_dump(dump_path, 1000)
+    FakeMastodon.dump = dump_path.read_bytes()
+    FakeMastodon.statuses = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMastodon)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_backfill_drains_thousands_of_votes_in_batches_within_the_posting_budget(fake_mastodon, tmp_path, monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "false")
+    monkeypatch.setenv("HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    monkeypatch.setenv("MASTODON_API_BASE_URL", fake_mastodon)
+    monkeypatch.setenv("MASTODON_ACCESS_TOKEN", "token")
+    monkeypatch.setenv("MASTODON_POSTING_BUDGET", "400")
+    # every run starts after the window of the last one has passed
+    monkeypatch.setenv("MASTODON_POSTING_WINDOW_MINUTES", "0.0001")
+    monkeypatch.setitem(fetch_votes.JSON_URIS, "XVII", f"{fake_mastodon}/dump.json")
+    state_file_path = tmp_path / "state.json"
+
+    # without --backfill the backlog looks like a lost state
+    with pytest.raises(AssertionError):
+        update("XVII", state_file_path)
+    assert FakeMastodon.statuses == []
+
+    update("XVII", state_file_path, backfill=True)
+    batches = [len(FakeMastodon.statuses)]
+    with open(f"{state_file_path}.meta.json", "r") as metadata_file:
+        assert json.load(metadata_file)["backfill"]["remaining"] > 1000
+
+    # the next runs resume from the checkpoint without --backfill
+    for _ in range(10):
+        time.sleep(0.01)
+        update("XVII", state_file_path)
+        batches.append(len(FakeMastodon.statuses) - sum(batches))
+        if not batches[-1]:
+            break
+
+    vote_ids = [status["idempotency_key"] for status in FakeMastodon.statuses if status["in_reply_to_id"] is not None]
+    assert len(vote_ids) == len(set(vote_ids)) > 1000
+    with open(state_file_path, "r") as state_file:
+        state = json.load(state_file)
+    assert set(vote_ids) == {vote_id for vote_id, vote_state in state.items() if vote_state == "published"}
+    assert all(vote_state == "published" for vote_state in state.values())
+    assert all(0 < batch <= 400 for batch in batches[:-1]) and batches[-1] == 0
+    runs, _ = estimate_backfill(len(vote_ids), datetime.timedelta(days=1), budget=400)
+    assert abs(len(batches) - 1 - runs) <= 1
+    with open(f"{state_file_path}.meta.json", "r") as metadata_file:
+        assert "backfill" not in json.load(metadata_file)
@@ -0,0 +1,23 @@
+from benchmarks.pipeline import benchmark
+from benchmarks.synthetic import synthetic_initiatives, write_synthetic_dump
+from votacoes_assembleia_da_republica.fetch_votes import parse_initiatives, parse_vote
+from votacoes_assembleia_da_republica.json_stream import iter_json_array_file
+
+
+def test_synthetic_dump_covers_the_shapes_of_the_real_dumps(tmp_path):
+    initiatives = list(synthetic_initiatives(200))
+    assert {type(i["IniEventos"]) for i in initiatives} == {type(None), dict, list}
+    assert {type(i["IniAutorGruposParlamentares"]) for i in initiatives} == {type(None), dict, list}
+
+    path = tmp_path / "Iniciativas_json.txt"
+    write_synthetic_dump(path, 200)
+    votes = [parse_vote(raw_vote) for raw_vote in parse_initiatives(iter_json_array_file(path))]
+    details = [vote["vote_detail"] for vote in votes]
+    assert {"unanime", "sem detalhes", "prejudicado"} <= {detail for detail in details if isinstance(detail, str)}
+    assert any(isinstance(detail, dict) for detail in details)
+
+
+def test_benchmark_reports_every_stage(tmp_path):
+    results = benchmark(50, str(tmp_path))
+    assert [r["stage"] for r in results] == ["parse_initiatives", "parse_vote", "render_vote", "group_votes_by_result", "compress_state", "decompress_state"]
+    assert all(r["seconds"] >= 0 and r["peak_memory_bytes"] > 0 for r in results)
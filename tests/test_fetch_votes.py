@@ -0,0 +1,73 @@
+import json
+
+from votacoes_assembleia_da_republica.fetch_votes import parse_initiatives, parse_vote
+from votacoes_assembleia_da_republica.models import Vote
+
+
+def initiative(nr: str, *vote_ids: str) -> dict:
+    return {
+        "IniDescTipo": "Projeto de Lei",
+        "IniTipo": "P",
+        "IniTitulo": f"Initiative {nr}",
+        "IniLinkTexto": "http://example.com",
+        "IniAutorGruposParlamentares": [{"GP": "PS"}],
+        "IniEventos": [
+            {"Fase": "Votação na generalidade", "Votacao": [{"id": i, "data": "2024-04-02", "resultado": "Aprovado", "detalhe": "unanime"} for i in vote_ids]}
+        ],
+        "IniNr": nr,
+    }
+
+
+def test_parse_initiatives_returns_every_vote_without_filters():
+    with open("tests/files/legislatures/multiple_approved_sorted.json") as legislature:
+        assert len(list(parse_initiatives(json.load(legislature)))) == 3
+
+
+def test_parse_initiatives_skips_votes_rejected_by_the_predicate():
+    raw_initiatives = [initiative("1", "10", "11"), initiative("2", "12")]
+    votes = parse_initiatives(raw_initiatives, is_new_vote=lambda vote_id: vote_id != "11")
+    assert [vote["vote_id"] for vote in votes] == ["10", "12"]
+
+
+def test_parse_initiatives_skips_initiatives_at_or_below_the_watermark_without_asking_the_predicate():
+    asked = []
+
+    def is_new_vote(vote_id):
+        asked.append(vote_id)
+        return True
+
+    raw_initiatives = [initiative("1", "10", "11"), initiative("2", "11", "13"), initiative("3", "14")]
+    votes = parse_initiatives(raw_initiatives, is_new_vote=is_new_vote, vote_id_watermark=12)
+    assert [vote["vote_id"] for vote in votes] == ["11", "13", "14"]
+    assert asked == ["11", "13", "14"]
+
+
+def test_parse_initiatives_never_skips_initiatives_with_non_numeric_vote_ids():
+    votes = parse_initiatives([initiative("1", "abc")], vote_id_watermark=1000)
+    assert [vote["vote_id"] for vote in votes] == ["abc"]
+
+
+def test_votes_of_an_initiative_share_one_record_of_it():
+    first, second = parse_initiatives([initiative("1", "10", "11")])
+    assert first.initiative is second.initiative
+    assert first["title"] is second["title"]
+
+
+def test_parsed_votes_read_like_dicts():
+    raw = initiative("1", "10")
+    raw["IniEventos"][0]["Votacao"][0]["detalhe"] = "A Favor: <I>PS</I><BR>Contra:<I>PSD</I>"
+    (vote,) = [parse_vote(raw_vote) for raw_vote in parse_initiatives([raw])]
+
+    assert vote == {
+        "vote_id": "10",
+        "result": "Aprovado",
+        "vote_detail": {"in_favour": ["PS"], "against": ["PSD"], "abstained": [], "absent": []},
+        "date": "2024-04-02",
+        "authors": ["PS"],
+        "initiative_type": "Projeto de Lei",
+        "title": "Initiative 1",
+        "phase": "Votação na generalidade",
+        "initiative_uri": "http://example.com",
+    }
+    assert Vote.from_mapping(dict(vote)) == vote
+    assert vote.vote_detail[0][0] is vote["authors"][0]  # party names are interned
@@ -0,0 +1,51 @@
+import pytest
+
+from votacoes_assembleia_da_republica.http_cache import cached_download, dump_fingerprint, file_fingerprint
+
+URL = "https://app.parlamento.pt/webutils/docs/doc.txt?fich=IniciativasXVII_json.txt"
+
+
+@pytest.fixture(autouse=True)
+def stub_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+
+
+def test_cached_download_writes_the_body_to_disk(requests_mock):
+    requests_mock.get(URL, text="[]", headers={"ETag": '"abc"'})
+    with open(cached_download(URL, "IniciativasXVII_json.txt")) as cached:
+        assert cached.read() == "[]"
+    assert requests_mock.last_request.headers["Accept-Encoding"] == "gzip"
+
+
+def test_cached_download_sends_conditional_headers_and_reuses_the_copy_on_304(requests_mock):
+    requests_mock.get(URL, [{"text": "[1]", "headers": {"ETag": '"abc"', "Last-Modified": "Mon, 13 Oct 2025 09:00:00 GMT"}}, {"status_code": 304}])
+    cached_download(URL, "IniciativasXVII_json.txt")
+    with open(cached_download(URL, "IniciativasXVII_json.txt")) as cached:
+        assert cached.read() == "[1]"
+    assert requests_mock.last_request.headers["If-None-Match"] == '"abc"'
+    assert requests_mock.last_request.headers["If-Modified-Since"] == "Mon, 13 Oct 2025 09:00:00 GMT"
+
+
+def test_cached_download_does_not_send_conditional_headers_without_a_cached_copy(requests_mock):
+    requests_mock.get(URL, text="[]")
+    cached_download(URL, "IniciativasXVII_json.txt")
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert "If-Modified-Since" not in requests_mock.last_request.headers
+
+
+def test_cached_download_keeps_the_previous_copy_if_the_download_fails(requests_mock):
+    requests_mock.get(URL, [{"text": "[1]"}, {"status_code": 500}])
+    path = cached_download(URL, "IniciativasXVII_json.txt")
+    with pytest.raises(Exception):
+        cached_download(URL, "IniciativasXVII_json.txt")
+    with open(path) as cached:
+        assert cached.read() == "[1]"
+
+
+def test_fingerprint_is_computed_while_downloading(requests_mock):
+    requests_mock.get(URL, content=b"[1, 2, 3]")
+    path = cached_download(URL, "IniciativasXVII_json.txt")
+
+    fingerprint = dump_fingerprint(path)
+    assert fingerprint.startswith("9:")
+    assert fingerprint == file_fingerprint(path)
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+import requests
+
+from votacoes_assembleia_da_republica import http_session
+from votacoes_assembleia_da_republica.http_session import request
+
+URL = "https://api.github.com/repos/owner/repo/actions/variables/STATE_XVII"
+
+
+@pytest.fixture(autouse=True)
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(http_session.time, "sleep", slept.append)
+    monkeypatch.setattr(http_session, "_rate_limit_resets", {})
+    return slept
+
+
+def test_request_returns_successful_responses_without_retrying(requests_mock, sleeps):
+    requests_mock.get(URL, json={"value": "{}"})
+    assert request("GET", URL).json() == {"value": "{}"}
+    assert requests_mock.call_count == 1
+    assert sleeps == []
+
+
+def test_request_retries_server_errors_with_exponential_backoff(requests_mock, sleeps):
+    requests_mock.get(URL, [{"status_code": 502}, {"status_code": 503}, {"json": {"value": "{}"}}])
+    assert request("GET", URL).status_code == 200
+    assert sleeps == [1, 2]
+
+
+def test_request_gives_up_after_the_maximum_number_of_retries(requests_mock, sleeps):
+    requests_mock.get(URL, status_code=500)
+    assert request("GET", URL, max_retries=2).status_code == 500
+    assert requests_mock.call_count == 3
+
+
+def test_request_does_not_retry_client_errors(requests_mock, sleeps):
+    requests_mock.get(URL, status_code=404)
+    assert request("GET", URL).status_code == 404
+    assert requests_mock.call_count == 1
+
+
+def test_request_honors_retry_after(requests_mock, sleeps):
+    requests_mock.get(URL, [{"status_code": 429, "headers": {"Retry-After": "7"}}, {"status_code": 200}])
+    assert request("GET", URL).status_code == 200
+    assert sleeps == [7]
+
+
+def test_request_waits_for_the_rate_limit_reset(requests_mock, sleeps):
+    reset = int(time.time()) + 10
+    requests_mock.get(URL, [{"status_code": 403, "headers": {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}}, {"status_code": 200}])
+    assert request("GET", URL).status_code == 200
+    assert 9 <= sleeps[0] <= 11
+
+
+def test_request_does_not_wait_for_resets_beyond_the_maximum_delay(requests_mock, sleeps):
+    reset = int(time.time()) + 3600
+    requests_mock.get(URL, status_code=403, headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)})
+    assert request("GET", URL).status_code == 403
+    assert requests_mock.call_count == 1
+
+
+def test_request_retries_secondary_rate_limits(requests_mock, sleeps):
+    requests_mock.get(URL, [{"status_code": 403, "text": "You have exceeded a secondary rate limit"}, {"status_code": 200}])
+    assert request("GET", URL).status_code == 200
+    assert sleeps == [60]
+
+
+def test_request_does_not_retry_permission_errors(requests_mock, sleeps):
+    requests_mock.get(URL, status_code=403, text="Resource not accessible by integration")
+    assert request("GET", URL).status_code == 403
+    assert requests_mock.call_count == 1
+
+
+def test_request_pauses_before_the_next_call_once_the_budget_is_exhausted(requests_mock, sleeps):
+    reset = int(time.time()) + 30
+    requests_mock.get(URL, [{"status_code": 200, "headers": {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}}, {"status_code": 200}])
+    request("GET", URL)
+    assert sleeps == []
+    request("GET", URL)
+    assert 28 <= sleeps[0] <= 30
+
+
+def test_request_retries_connection_errors(requests_mock, sleeps):
+    requests_mock.get(URL, [{"exc": requests.ConnectionError}, {"status_code": 200}])
+    assert request("GET", URL).status_code == 200
+    assert sleeps == [1]
+
+
+def test_request_sets_a_timeout(requests_mock):
+    requests_mock.get(URL, status_code=200)
+    request("GET", URL)
+    assert requests_mock.last_request.timeout == http_session.TIMEOUT
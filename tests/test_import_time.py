@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+# generous enough for a slow CI runner, an accidental import of something like mastodon or numpy still blows it
+IMPORT_BUDGET_SECONDS = 1.0
+DEFERRED_MODULES = ("mastodon", "bs4", "lxml", "dotenv", "sqlite3")
+
+
+def import_in_fresh_interpreter(module: str) -> tuple[set[str], float]:
+    code = f"import sys, time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)\nprint(' '.join(sys.modules))"
+    env = {**os.environ, "PYTHONPATH": os.getcwd()}
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env).stdout.splitlines()
+    return {name.split(".")[0] for name in output[1].split()}, float(output[0])
+
+
+def test_check_path_only_imports_the_stdlib_and_requests():
+    modules, _ = import_in_fresh_interpreter("votacoes_assembleia_da_republica.update_account")
+    assert "requests" in modules
+    assert not modules & set(DEFERRED_MODULES)
+
+
+def test_update_account_imports_within_budget():
+    _, seconds = import_in_fresh_interpreter("votacoes_assembleia_da_republica.update_account")
+    assert seconds < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,50 @@
+import json
+
+from votacoes_assembleia_da_republica.initiative_index import InitiativeIndex
+from votacoes_assembleia_da_republica.json_stream import iter_json_array_file
+from tests.test_fetch_votes import initiative
+
+
+def walk(index: InitiativeIndex, path, initiatives: list[dict]) -> list[str]:
+    path.write_text(json.dumps(initiatives))
+    return [i["IniNr"] for i in index.changed_initiatives(iter_json_array_file(path, with_text=True))]
+
+
+def test_only_new_and_changed_initiatives_are_walked_again(tmp_path):
+    dump = tmp_path / "dump.json"
+    index = InitiativeIndex(str(tmp_path / "index.json"))
+    assert walk(index, dump, [initiative("1", "10"), initiative("2", "20")]) == ["1", "2"]
+    index.save()
+
+    index = InitiativeIndex.load(str(tmp_path / "index.json"))
+    assert walk(index, dump, [initiative("1", "10"), initiative("2", "20", "21"), initiative("3", "30")]) == ["2", "3"]
+    assert index.changed_votes == []
+
+
+def test_votes_whose_result_or_detail_changed_are_reported(tmp_path):
+    dump = tmp_path / "dump.json"
+    index = InitiativeIndex(str(tmp_path / "index.json"))
+    walk(index, dump, [initiative("1", "10", "11")])
+    index.save()
+
+    changed = initiative("1", "10", "11")
+    changed["IniEventos"][0]["Votacao"][1]["resultado"] = "Rejeitado"
+    index = InitiativeIndex.load(str(tmp_path / "index.json"))
+    assert walk(index, dump, [changed]) == ["1"]
+    assert index.changed_votes == ["11"]
+
+
+def test_index_is_only_replaced_once_the_whole_dump_was_walked(tmp_path):
+    dump = tmp_path / "dump.json"
+    index = InitiativeIndex(str(tmp_path / "index.json"))
+    walk(index, dump, [initiative("1", "10"), initiative("2", "20")])
+    index.save()
+
+    dump.write_text(json.dumps([initiative("1", "10", "11"), initiative("2", "20", "21")]))
+    next(index.changed_initiatives(iter_json_array_file(dump, with_text=True)))
+    index.save()
+    assert set(InitiativeIndex.load(str(tmp_path / "index.json")).initiatives) == {"1", "2"}
+
+    assert walk(index, dump, [initiative("2", "20")]) == []
+    index.save()
+    assert set(InitiativeIndex.load(str(tmp_path / "index.json")).initiatives) == {"2"}
@@ -0,0 +1,71 @@
+import io
+import json
+import tracemalloc
+import types
+
+import pytest
+
+from votacoes_assembleia_da_republica.fetch_votes import parse_initiatives
+from votacoes_assembleia_da_republica.json_stream import iter_json_array, iter_json_array_file
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+@pytest.mark.parametrize(
+    "legislature",
+    ["empty_example.json", "minimal_example.json", "minimal_example_approved_and_rejected.json", "multiple_approved_sorted.json", "nil_ini_eventos.json"],
+)
+def test_iter_json_array_matches_json_load(legislature, chunk_size):
+    path = f"tests/files/legislatures/{legislature}"
+    with open(path) as legislature_file:
+        expected = json.load(legislature_file)
+    assert list(iter_json_array_file(path, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5])
+def test_iter_json_array_handles_tricky_elements(chunk_size):
+    elements = [{"a": "], [ , {"}, 12345, "x,y", [], None, -0.5e10, {"nested": [{"b": "ç"}]}]
+    text = "  [ " + " ,\n".join(json.dumps(e) for e in elements) + " ]  "
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == elements
+
+
+def test_iter_json_array_rejects_truncated_input():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"a": 1}, {"b"'), chunk_size=4))
+
+
+def test_iter_json_array_rejects_non_arrays():
+    with pytest.raises(ValueError, match="expected a JSON array"):
+        list(iter_json_array(io.StringIO('{"a": 1}')))
+
+
+def test_parse_initiatives_yields_votes_lazily():
+    with open("tests/files/legislatures/minimal_example.json") as legislature_file:
+        votes = parse_initiatives(json.load(legislature_file))
+    assert isinstance(votes, types.GeneratorType)
+    assert [vote["vote_id"] for vote in votes] == ["126496"]
+
+
+def test_streaming_memory_does_not_grow_with_the_dump(tmp_path):
+    initiative = {
+        "IniDescTipo": "Projeto de Lei",
+        "IniTipo": "P",
+        "IniTitulo": "A" * 500,
+        "IniLinkTexto": "http://example.com",
+        "IniAutorGruposParlamentares": [{"GP": "PS"}],
+        "IniEventos": [{"Fase": "Votação na generalidade", "Votacao": [{"id": "1", "data": "2024-04-02", "resultado": "Aprovado", "detalhe": "unanime"}]}],
+        "IniNr": "1",
+    }
+    path = tmp_path / "IniciativasXVII_json.txt"
+    path.write_text(json.dumps([initiative] * 5000))
+
+    tracemalloc.start()
+    count = sum(1 for _ in parse_initiatives(iter_json_array_file(path)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert count == 5000
+    assert peak < path.stat().st_size / 10
+
+
+def test_elements_can_come_with_their_json_text():
+    assert list(iter_json_array(io.StringIO('[{"a": [1, 2]} ,\n"b"]'), chunk_size=3, with_text=True)) == [({"a": [1, 2]}, '{"a": [1, 2]}'), ("b", '"b"')]
@@ -0,0 +1,125 @@
+import itertools
+import threading
+from urllib.parse import parse_qs
+
+import pytest
+
+from votacoes_assembleia_da_republica.mastodon_client import MastodonClient, RateLimitBudget, VoteThread
+
+
+@pytest.fixture(autouse=True)
+def stub_env(monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "false")
+    monkeypatch.setenv("MASTODON_API_BASE_URL", "https://masto.pt")
+    monkeypatch.setenv("MASTODON_POSTING_CONCURRENCY", "4")
+
+
+@pytest.fixture
+def mastodon_account():
+    return {"id": 1, "acct": "user@server.com"}
+
+
+@pytest.fixture
+def stub_mastodon_api(requests_mock, mastodon_account):
+    requests_mock.get("https://masto.pt/api/v1/instance", status_code=200)
+    requests_mock.get("https://masto.pt/api/v1/accounts/verify_credentials", status_code=200, json=mastodon_account)
+
+
+def test_budget_does_not_wait_while_there_is_budget_left():
+    slept = []
+    budget = RateLimitBudget(sleep=slept.append, clock=lambda: 1000)
+    budget.update(2, 1300)
+    budget.acquire()
+    budget.acquire()
+    assert slept == []
+
+
+def test_budget_waits_for_the_reset_once_it_is_spent():
+    slept = []
+    budget = RateLimitBudget(sleep=slept.append, clock=lambda: 1000)
+    budget.update(1, 1300)
+    budget.acquire()
+    budget.acquire()
+    assert slept == [300]
+
+
+def test_post_vote_threads_posts_threads_concurrently_keeping_the_order_of_replies(requests_mock, stub_mastodon_api, mastodon_account):
+    ids = itertools.count(1)
+    posted = []
+    lock = threading.Lock()
+
+    def post_status(request, context):
+        with lock:
+            status_id = next(ids)
+            posted.append((parse_qs(request.body)["status"][0], parse_qs(request.body).get("in_reply_to_id", [None])[0], status_id))
+        return {"id": status_id, "account": mastodon_account, "mentions": []}
+
+    requests_mock.post("https://masto.pt/api/v1/statuses", json=post_status)
+    vote_threads = [VoteThread(f"thread {t}", f"key {t}", [(f"{t}{i}", f"vote {t}{i}") for i in range(3)]) for t in "ab"]
+    published = []
+
+    m = MastodonClient()
+    workers = set()
+    post_vote = m.post_vote
+    # both threads have to be in flight at the same time, otherwise one worker could post them one after the other
+    both_started = threading.Barrier(2, timeout=5)
+
+    def recording_post_vote(*args, **kwargs):
+        worker = threading.current_thread().name
+        if worker not in workers:
+            workers.add(worker)
+            both_started.wait()
+        return post_vote(*args, **kwargs)
+
+    m.post_vote = recording_post_vote
+    m.post_vote_threads(vote_threads, on_posted=lambda vote_id, post: published.append(vote_id), on_error=None)
+
+    assert len(workers) == 2
+
+    thread_ids = {status: str(status_id) for status, _, status_id in posted if status.startswith("thread")}
+    for t in "ab":
+        replies = [(status, reply_to) for status, reply_to, _ in posted if status.startswith(f"vote {t}")]
+        assert replies == [(f"vote {t}{i}", thread_ids[f"thread {t}"]) for i in range(3)]
+    assert sorted(published) == ["a0", "a1", "a2", "b0", "b1", "b2"]
+
+
+def test_post_vote_threads_reports_failed_votes(requests_mock, stub_mastodon_api, mastodon_account):
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses",
+        [
+            {"json": {"id": 1, "account": mastodon_account, "mentions": []}},
+            {"status_code": 422},
+            {"json": {"id": 3, "account": mastodon_account, "mentions": []}},
+        ],
+    )
+    published, errored = [], []
+    MastodonClient().post_vote_threads(
+        [VoteThread("thread", "key", [("1", "vote 1"), ("2", "vote 2")])],
+        on_posted=lambda vote_id, post: published.append(vote_id),
+        on_error=lambda vote_id, error: errored.append(vote_id),
+    )
+    assert (published, errored) == (["2"], ["1"])
+
+
+def test_posting_pauses_and_resumes_when_the_instance_rate_limits(requests_mock, stub_mastodon_api, mastodon_account):
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses",
+        [
+            {"status_code": 429, "json": {"error": "Too many requests"}},
+            {
+                "json": {"id": 1, "account": mastodon_account, "mentions": []},
+                "headers": {"X-RateLimit-Limit": "300", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "2099-01-01T00:00:00.000Z"},
+            },
+            {"json": {"id": 2, "account": mastodon_account, "mentions": []}},
+        ],
+    )
+    m = MastodonClient()
+    slept = []
+    m.budget.sleep = slept.append
+    published = []
+
+    m.post_vote_threads([VoteThread("thread", "key", [("1", "vote 1")])], on_posted=lambda vote_id, post: published.append(post["id"]), on_error=None)
+
+    assert published == [2]
+    assert len(slept) == 2  # once after the 429, once before the reply because the budget was spent
+    assert 55 <= slept[0] <= 60
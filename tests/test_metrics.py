@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from votacoes_assembleia_da_republica import metrics
+from votacoes_assembleia_da_republica.http_session import request, session
+
+
+@pytest.fixture
+def enabled_metrics():
+    yield metrics.enable()
+    metrics.disable()
+
+
+def test_spans_are_a_shared_no_op_when_disabled():
+    assert metrics.span("parse_votes") is metrics.span("post_votes", legislature="XVII")
+    with metrics.span("parse_votes"):
+        pass
+    assert not session().hooks["response"]
+
+
+def test_spans_record_duration_labels_and_errors(enabled_metrics):
+    with metrics.span("parse_votes", legislature="XVII"):
+        pass
+    with pytest.raises(KeyError):
+        with metrics.span("post_votes"):
+            raise KeyError("vote")
+
+    parse, post = enabled_metrics.spans
+    assert parse["name"] == "parse_votes" and parse["legislature"] == "XVII" and parse["error"] is None and parse["seconds"] >= 0
+    assert post["name"] == "post_votes" and post["error"] == "KeyError"
+
+
+def test_http_responses_are_recorded(enabled_metrics, requests_mock, tmp_path):
+    requests_mock.get("https://api.github.com/repos/o/r/actions/variables/STATE_XVII", text="{}", headers={"Content-Length": "2"})
+    requests_mock.patch("https://api.github.com/repos/o/r/actions/variables/STATE_XVII", status_code=204)
+
+    request("GET", "https://api.github.com/repos/o/r/actions/variables/STATE_XVII")
+    request("PATCH", "https://api.github.com/repos/o/r/actions/variables/STATE_XVII", json={"value": "{}"})
+
+    path = tmp_path / "metrics.json"
+    metrics.write(path)
+    recorded = json.loads(path.read_text())["requests"]
+    assert [(r["method"], r["host"], r["status"], r["bytes"]) for r in recorded] == [("GET", "api.github.com", 200, 2), ("PATCH", "api.github.com", 204, None)]
+    assert recorded[0]["path"] == "/repos/o/r/actions/variables/STATE_XVII"
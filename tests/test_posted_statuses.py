@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+from votacoes_assembleia_da_republica.posted_statuses import delete_statuses, select_statuses, status_datetime
+from votacoes_assembleia_da_republica.state_storage import StateStorage
+
+
+def snowflake(timestamp: str, sequence: int = 0) -> int:
+    return int(datetime.datetime.fromisoformat(timestamp).timestamp() * 1000) << 16 | sequence
+
+
+@pytest.fixture(autouse=True)
+def stub_env(monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "false")
+    monkeypatch.setenv("MASTODON_API_BASE_URL", "https://masto.pt")
+
+
+@pytest.fixture
+def posts():
+    approved = snowflake("2025-03-10T09:00:00+00:00")
+    rejected = snowflake("2025-03-12T09:00:00+00:00")
+    return {
+        "1": (snowflake("2025-03-10T09:00:01+00:00"), approved, 101),
+        "2": (snowflake("2025-03-10T09:00:02+00:00"), approved, 102),
+        "3": (None, rejected, None),  # errored
+        "4": (snowflake("2025-03-12T09:00:02+00:00"), rejected, 104),
+    }
+
+
+def test_status_datetime_reads_the_snowflake_timestamp():
+    assert status_datetime(snowflake("2025-03-10T09:00:01+00:00", 42)) == datetime.datetime(2025, 3, 10, 9, 0, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_select_statuses_includes_threads_left_without_votes(posts):
+    vote_ids, status_ids = select_statuses(posts, since=datetime.datetime(2025, 3, 11, tzinfo=datetime.timezone.utc))
+    assert vote_ids == ["3", "4"]
+    assert status_ids == [posts["4"][0], posts["4"][1]]
+
+
+def test_select_statuses_keeps_threads_that_still_have_votes(posts):
+    vote_ids, status_ids = select_statuses(posts, vote_ids={"2"})
+    assert vote_ids == ["2"]
+    assert status_ids == [posts["2"][0]]
+
+    _, status_ids = select_statuses(posts, vote_ids={"1", "2"}, until=datetime.datetime(2025, 3, 11, tzinfo=datetime.timezone.utc))
+    assert status_ids == [posts["2"][0], posts["1"][0], posts["1"][1]]
+
+
+def test_delete_statuses_deletes_exact_ids_and_forgets_them(requests_mock, tmp_path, posts):
+    requests_mock.get("https://masto.pt/api/v1/instance", status_code=200)
+    requests_mock.get("https://masto.pt/api/v1/accounts/verify_credentials", json={"id": 1})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=[{"id": "900"}])
+    requests_mock.delete(f"https://masto.pt/api/v1/statuses/{posts['4'][0]}", json={})
+    requests_mock.delete(f"https://masto.pt/api/v1/statuses/{posts['4'][1]}", status_code=404, json={"error": "Record not found"})
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        for vote_id, (status_id, thread_id, content_hash) in posts.items():
+            state.mark_vote_published(vote_id, status_id, thread_id, content_hash)
+        vote_ids, status_ids = select_statuses(state.posts, vote_ids={"3", "4"})
+
+        assert delete_statuses(MastodonClient(), state, vote_ids, status_ids, forget_votes=True) == 1
+        assert state.last_post_id == "900"
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert sorted(state.state) == ["1", "2"]
+        assert dict(state.posts) == {"1": posts["1"], "2": posts["2"]}
+    assert [r.method for r in requests_mock.request_history].count("DELETE") == 2
+
+
+def test_select_statuses_skips_votes_without_statuses(posts):
+    posts["5"] = (None, None, 105)
+    vote_ids, _ = select_statuses(posts, since=datetime.datetime(2025, 3, 11, tzinfo=datetime.timezone.utc))
+    assert vote_ids == ["3", "4"]
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from votacoes_assembleia_da_republica.mastodon_client import MastodonClient, VoteThread
+from votacoes_assembleia_da_republica.publishers import JsonlPublisher, publisher_from_spec
+
+
+def read_jsonl(path) -> list[dict]:
+    with open(path, "r") as jsonl_file:
+        return [json.loads(line) for line in jsonl_file]
+
+
+def test_jsonl_publisher_writes_threads_and_their_replies(tmp_path):
+    posted = []
+    publisher = JsonlPublisher(tmp_path / "mirror.jsonl")
+    publisher.post_vote_threads([VoteThread("Aprovado", "key", [("1", "vote 1"), ("2", "vote 2")])], on_posted=lambda v, p: posted.append(v), on_error=None)
+
+    statuses = read_jsonl(tmp_path / "mirror.jsonl")
+    assert [status["status"] for status in statuses] == ["Aprovado", "vote 1", "vote 2"]
+    assert [status["in_reply_to_id"] for status in statuses] == [None, statuses[0]["id"], statuses[0]["id"]]
+    assert posted == ["1", "2"]
+
+
+def test_jsonl_publisher_does_not_write_an_idempotency_key_twice(tmp_path):
+    JsonlPublisher(tmp_path / "mirror.jsonl").post_vote_threads([VoteThread("Aprovado", "key", [("1", "vote 1")])], lambda v, p: None, None)
+    publisher = JsonlPublisher(tmp_path / "mirror.jsonl")
+    publisher.post_vote_threads([VoteThread("Aprovado", "key", [("1", "vote 1"), ("2", "vote 2")])], lambda v, p: None, None)
+
+    statuses = read_jsonl(tmp_path / "mirror.jsonl")
+    assert [status["idempotency_key"] for status in statuses] == ["key", "1", "2"]
+    assert statuses[2]["in_reply_to_id"] == statuses[0]["id"]
+
+
+def test_publisher_from_spec(tmp_path, monkeypatch):
+    monkeypatch.setenv("MASTODON_API_BASE_URL_BACKUP", "https://backup.pt")
+    jsonl = publisher_from_spec(f"jsonl:{tmp_path / 'mirror.jsonl'}")
+    assert isinstance(jsonl, JsonlPublisher) and jsonl.name == "jsonl"
+    assert publisher_from_spec(f"archive=jsonl:{tmp_path / 'mirror.jsonl'}").name == "archive"
+
+    backup = publisher_from_spec("backup=mastodon")
+    assert isinstance(backup, MastodonClient) and backup.name == "backup"
+    assert backup.api_base_url == "https://backup.pt"
+
+
+@pytest.mark.parametrize("spec", ["mastodon", "jsonl", "ftp:somewhere", "Backup=mastodon"])
+def test_publisher_from_spec_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        publisher_from_spec(spec)
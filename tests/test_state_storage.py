@@ -1,6 +1,12 @@
+import base64
+import gzip
 import json
+import random
 
-from votacoes_assembleia_da_republica.state_storage import _compress_state, _decompress_state
+import pytest
+
+from votacoes_assembleia_da_republica.state_storage import StateStorage, _compress_post_ids, _compress_state, _decompress_post_ids, _decompress_state
+from votacoes_assembleia_da_republica.vote_states import PostIds, VoteStates
 
 
 def test_compress_and_decompress_roundtrip():
@@ -16,3 +22,244 @@ def test_compressed_state_is_smaller_than_plain_json():
 def test_decompress_falls_back_to_plain_json():
     state = {"126496": "published"}
     assert _decompress_state(json.dumps(state)) == state
+
+
+def test_vote_id_watermark_is_the_highest_recorded_vote_id(tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text('{"126496": "published", "126516": "errored", "999": "skipped"}')
+    with StateStorage("XVII", file_path=state_file) as state:
+        assert state.vote_id_watermark == 126516
+
+
+def test_vote_id_watermark_is_none_for_an_empty_state(tmp_path):
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert state.vote_id_watermark is None
+
+
+def test_compress_state_uses_the_compact_format():
+    assert _compress_state({"126496": "published", "126516": "errored", "999": "skipped"}).startswith("v2:")
+
+
+def test_decompress_reads_the_legacy_gzip_format():
+    state = {"126496": "published", "126516": "errored"}
+    legacy = base64.b64encode(gzip.compress(json.dumps(state).encode())).decode()
+    assert _decompress_state(legacy) == state
+
+
+def test_compress_state_falls_back_to_gzip_for_ids_the_compact_format_cant_represent():
+    state = {"0126496": "published", "abc": "errored", "126516": "unknown", "1": "skipped"}
+    compressed = _compress_state(state)
+    assert not compressed.startswith("v2:")
+    assert _decompress_state(compressed) == state
+
+
+def test_compact_format_roundtrips_large_states():
+    rng = random.Random(1)
+    state = {str(126000 + i * rng.randint(1, 5)): rng.choice(["published", "errored", "skipped"]) for i in range(10_000)}
+    assert _decompress_state(_compress_state(state)) == state
+
+
+def test_vote_states_behave_like_a_dict():
+    vote_states = VoteStates({"20": "published", "10": "errored"})
+    vote_states["15"] = "skipped"
+    vote_states["10"] = "published"
+    vote_states["x"] = "published"
+    assert "15" in vote_states and "x" in vote_states and "16" not in vote_states and "010" not in vote_states
+    assert list(vote_states) == ["10", "15", "20", "x"]
+    del vote_states["15"]
+    assert dict(vote_states) == {"10": "published", "20": "published", "x": "published"}
+    assert vote_states.max_vote_id() == 20
+
+
+@pytest.fixture
+def github_env(monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "false")
+    monkeypatch.setenv("GH_VARIABLE_UPDATE_TOKEN", "gh_token")
+    monkeypatch.setenv("REPO_OWNER", "owner")
+    monkeypatch.setenv("REPO_PATH", "owner/repo")
+
+
+def variable(name: str, value: str) -> dict:
+    return {"name": name, "updated_at": "2025-09-16T09:12:30Z", "value": value}
+
+
+def test_sharded_state_only_reads_and_writes_the_shards_it_needs(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVII", file_path=tmp_path / "state.json", use_github=True)
+    requests_mock.get(storage.gh_variable_url, json=variable("STATE_XVII", '{"shards": ["11", "12"]}'))
+    requests_mock.get(storage.variable_url("STATE_XVII_11"), json=variable("STATE_XVII_11", _compress_state({"110000": "published"})))
+    requests_mock.get(storage.variable_url("STATE_XVII_12"), json=variable("STATE_XVII_12", _compress_state({"126496": "published"})))
+    requests_mock.patch(storage.variable_url("STATE_XVII_12"), status_code=204)
+
+    with storage as state:
+        assert state.vote_id_watermark == 126496
+        assert not state.is_new_vote("126496")
+        state.mark_vote_published("126516")
+
+    assert [(r.method, r.url.rsplit("/", 1)[-1]) for r in requests_mock.request_history] == [
+        ("GET", "STATE_XVII"),
+        ("GET", "STATE_XVII_12"),
+        ("PATCH", "STATE_XVII_12"),
+    ]
+    assert _decompress_state(requests_mock.last_request.json()["value"]) == {"126496": "published", "126516": "published"}
+
+
+def test_sharded_state_makes_no_writes_when_nothing_changed(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVII", file_path=tmp_path / "state.json", use_github=True)
+    requests_mock.get(storage.gh_variable_url, json=variable("STATE_XVII", '{"shards": ["12"]}'))
+    requests_mock.get(storage.variable_url("STATE_XVII_12"), json=variable("STATE_XVII_12", _compress_state({"126496": "published"})))
+
+    with storage as state:
+        state.skip_vote("126496")
+
+    assert all(r.method == "GET" for r in requests_mock.request_history)
+
+
+def test_sharded_state_creates_new_shards_and_updates_the_manifest(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVII", file_path=tmp_path / "state.json", use_github=True)
+    requests_mock.get(storage.gh_variable_url, json=variable("STATE_XVII", '{"shards": ["12"]}'))
+    requests_mock.get(storage.variable_url("STATE_XVII_12"), json=variable("STATE_XVII_12", _compress_state({"126496": "published"})))
+    requests_mock.post(storage.variables_url, status_code=201)
+    requests_mock.patch(storage.gh_variable_url, status_code=204)
+
+    with storage as state:
+        state.mark_vote_errored("130001")
+
+    created = [r.json() for r in requests_mock.request_history if r.method == "POST"]
+    assert [c["name"] for c in created] == ["STATE_XVII_13"]
+    assert _decompress_state(created[0]["value"]) == {"130001": "errored"}
+    assert requests_mock.last_request.json() == {"value": '{"shards": ["12", "13"]}'}
+
+
+def test_legacy_single_variable_state_is_migrated_to_shards(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVII", file_path=tmp_path / "state.json", use_github=True)
+    legacy = base64.b64encode(gzip.compress(json.dumps({"126496": "published", "130001": "skipped"}).encode())).decode()
+    requests_mock.get(storage.gh_variable_url, json=variable("STATE_XVII", legacy))
+    requests_mock.post(storage.variables_url, status_code=201)
+    requests_mock.patch(storage.gh_variable_url, status_code=204)
+
+    with storage as state:
+        assert not state.is_new_vote("130001")
+
+    created = {r.json()["name"]: _decompress_state(r.json()["value"]) for r in requests_mock.request_history if r.method == "POST"}
+    assert created == {"STATE_XVII_12": {"126496": "published"}, "STATE_XVII_13": {"130001": "skipped"}}
+    assert requests_mock.last_request.json() == {"value": '{"shards": ["12", "13"]}'}
+
+
+def test_missing_state_variable_is_created(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVIII", file_path=tmp_path / "state.json", use_github=True)
+    requests_mock.get(storage.gh_variable_url, status_code=404)
+    requests_mock.post(storage.variables_url, status_code=201)
+
+    with storage as state:
+        assert state.is_new_vote("1")
+
+    assert requests_mock.last_request.json() == {"name": "STATE_XVIII", "value": '{"shards": []}'}
+
+
+def test_changes_of_a_run_that_died_are_replayed_from_the_journal(tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text('{"126496": "published"}')
+
+    crashed = StateStorage("XVII", file_path=state_file).__enter__()
+    crashed.mark_vote_published("126516")
+    crashed.mark_vote_errored("126517")
+    crashed.skip_vote("126496")
+    crashed.set_last_post_id("115")
+    crashed.close_journal()
+    assert json.loads(state_file.read_text()) == {"126496": "published"}
+
+    with StateStorage("XVII", file_path=state_file) as state:
+        assert state.get_vote_state("126516") == "published"
+        assert state.get_vote_state("126517") == "errored"
+        assert state.last_post_id == "115"
+        assert state.vote_id_watermark == 126517
+
+    assert json.loads(state_file.read_text()) == {"126496": "published", "126516": "published", "126517": "errored"}
+    assert not state.has_journal()
+
+
+def test_a_torn_journal_line_is_dropped(tmp_path):
+    state_file = tmp_path / "state.json"
+    journal = tmp_path / "state.json.journal"
+    journal.write_text('{"vote_id": "1", "state": "published"}\n{"vote_id": "2", "sta')
+
+    crashed = StateStorage("XVII", file_path=state_file).__enter__()
+    assert journal.read_text() == '{"vote_id": "1", "state": "published"}\n'
+    crashed.mark_vote_published("3")
+    crashed.close_journal()
+
+    with StateStorage("XVII", file_path=state_file) as state:
+        assert dict(state.state) == {"1": "published", "3": "published"}
+
+
+def test_the_journal_is_kept_when_saving_fails(requests_mock, github_env, tmp_path):
+    storage = StateStorage("XVII", file_path=tmp_path / "state.json", use_github=True)
+    requests_mock.get(storage.gh_variable_url, json=variable("STATE_XVII", '{"shards": ["12"]}'))
+    requests_mock.get(storage.variable_url("STATE_XVII_12"), json=variable("STATE_XVII_12", _compress_state({"126496": "published"})))
+    requests_mock.patch(storage.variable_url("STATE_XVII_12"), status_code=500)
+
+    with pytest.raises(Exception):
+        with storage as state:
+            state.mark_vote_published("126516")
+
+    assert storage.has_journal()
+
+
+def test_post_ids_roundtrip_through_the_compact_format():
+    post_ids = PostIds(
+        {"126496": (114100000000000001, 114100000000000000, 3735928559), "126516": (None, 114100000000000000, None), "99": (114000000000000000, None, 7)}
+    )
+    compressed = _compress_post_ids(post_ids)
+    assert compressed.startswith("p2:")
+    assert _decompress_post_ids(compressed) == post_ids
+
+
+def test_post_ids_are_journaled_and_kept_next_to_the_local_state(tmp_path):
+    crashed = StateStorage("XVII", file_path=tmp_path / "state.json").__enter__()
+    crashed.mark_vote_published("126496", 11, 10, 5)
+    crashed.mark_vote_errored("126516", 10)
+    crashed.close_journal()
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert dict(state.posts) == {"126496": (11, 10, 5), "126516": (None, 10, None)}
+        state.mark_vote_edited("126496", 6)
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert dict(state.posts) == {"126496": (11, 10, 6), "126516": (None, 10, None)}
+
+
+def test_forgotten_votes_are_journaled_and_walked_again(tmp_path):
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        state.mark_vote_published("126496", 11, 10, 5)
+        state.mark_vote_published("126516", 12, 10, 5)
+        state.fetched_dump_fingerprint = "fingerprint"
+        state.mark_dump_processed()
+
+    crashed = StateStorage("XVII", file_path=tmp_path / "state.json").__enter__()
+    crashed.forget_post("126496", forget_vote=True)
+    crashed.close_journal()
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert dict(state.state) == {"126516": "published"}
+        assert dict(state.posts) == {"126516": (12, 10, 5)}
+        assert not state.is_dump_processed("fingerprint")
+        assert state.vote_id_watermark is None
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert state.vote_id_watermark is None
+        state.fetched_dump_fingerprint = "fingerprint"
+        state.mark_dump_processed()
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert state.vote_id_watermark == 126516
+
+
+def test_votes_published_without_a_status_are_not_edit_candidates(tmp_path):
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        state.mark_vote_published("126496", None, None, 5)
+        state.posts["126516"] = (None, None, 6)  # left by a debug run before hashes needed a status
+
+        assert "126496" not in state.posts
+        assert not state.is_edit_candidate("126496")
+        assert not state.is_edit_candidate("126516")
+        assert state.posted_content_hash("126516") is None
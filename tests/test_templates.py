@@ -0,0 +1,101 @@
+import os
+from string import Template
+
+import pytest
+
+from votacoes_assembleia_da_republica.templates import TemplateRegistry
+from votacoes_assembleia_da_republica.update_account import TOOT_MAX_LENGTH, render_vote, render_vote_detail
+
+
+def reference_render_vote(vote: dict) -> str:
+    # renders the whole toot and substitutes it again with a shorter title if it is too long
+    with open("vote_status.template") as toot_template_file:
+        toot_template = Template(toot_template_file.read())
+    values = {
+        "result": "🟢 Aprovado" if vote["result"] == "Aprovado" else "🔴 Rejeitado",
+        "date": vote["date"],
+        "type": vote["initiative_type"],
+        "authors": ", ".join(vote["authors"]),
+        "title": vote["title"],
+        "phase": vote["phase"],
+        "vote_detail": render_vote_detail(vote["vote_detail"]),
+        "initiative_uri": vote["initiative_uri"],
+    }
+    rendered = toot_template.substitute(values)
+    rendered_length = len(rendered) - len(vote["initiative_uri"]) + 23
+    if rendered_length <= TOOT_MAX_LENGTH:
+        return rendered
+    title_max_length = TOOT_MAX_LENGTH - (rendered_length - len(vote["title"])) - 3
+    return toot_template.substitute(values | {"title": f"{vote['title'][:title_max_length]}..."})
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    (tmp_path / "greeting.template").write_text("Olá $name, $$5 para ${name}")
+    (tmp_path / "toot.template").write_text("📝 $title\n🔗 $uri")
+    return tmp_path
+
+
+def test_registry_reads_each_template_once(template_dir):
+    registry = TemplateRegistry(template_dir, hot_reload=False)
+    assert registry.get("toot.template").substitute(title="t", uri="u") == "📝 t\n🔗 u"
+    (template_dir / "toot.template").write_text("changed")
+    assert registry.get("toot.template").substitute(title="t", uri="u") == "📝 t\n🔗 u"
+
+
+def test_registry_reloads_templates_whose_mtime_changed_when_hot_reload_is_enabled(template_dir):
+    registry = TemplateRegistry(template_dir, hot_reload=True)
+    registry.split("toot.template", "title")
+    path = template_dir / "toot.template"
+    path.write_text("$uri: $title!")
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert registry.get("toot.template").substitute(title="t", uri="u") == "u: t!"
+    before, after = registry.split("toot.template", "title")
+    assert (before.template, after.template) == ("$uri: ", "!")
+
+
+def test_registry_splits_templates_around_a_placeholder(template_dir):
+    before, after = TemplateRegistry(template_dir).split("toot.template", "title")
+    assert before.template == "📝 "
+    assert after.substitute(uri="u") == "\n🔗 u"
+
+
+def test_registry_refuses_to_split_on_repeated_placeholders(template_dir):
+    with pytest.raises(ValueError, match="exactly once"):
+        TemplateRegistry(template_dir).split("greeting.template", "name")
+
+
+def test_render_vote_does_not_read_templates_from_disk_once_loaded(monkeypatch, tmp_path):
+    vote = {
+        "vote_id": "1",
+        "result": "Aprovado",
+        "vote_detail": {"in_favour": ["PS"], "against": ["PSD"], "abstained": [], "absent": ["CH"]},
+        "date": "2024-04-10",
+        "authors": ["PS"],
+        "initiative_type": "Projeto de Lei",
+        "title": "Title",
+        "phase": "Votação na generalidade",
+        "initiative_uri": "http://example.com",
+    }
+    expected = render_vote(vote)
+    monkeypatch.chdir(tmp_path)
+    assert render_vote(vote) == expected
+
+
+@pytest.mark.parametrize("title_length", [0, 1, 100, 250, 300, 350, 400, 1000])
+@pytest.mark.parametrize(
+    "vote_detail", ["unanime", "prejudicado", "sem detalhes", {"in_favour": ["PS", "L"], "against": ["PSD"], "abstained": ["IL"], "absent": ["CH"]}]
+)
+def test_render_vote_matches_rendering_twice(title_length, vote_detail):
+    vote = {
+        "vote_id": "1",
+        "result": "Rejeitado",
+        "vote_detail": vote_detail,
+        "date": "2024-04-10",
+        "authors": ["author 1", "author 2"],
+        "initiative_type": "Projeto de Lei",
+        "title": "á" * title_length,
+        "phase": "Votação na generalidade",
+        "initiative_uri": "http://app.parlamento.pt/" + "a" * 200,
+    }
+    assert render_vote(vote) == reference_render_vote(vote)
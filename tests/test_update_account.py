@@ -1,17 +1,38 @@
+import datetime
+import json
+import threading
 import pytest
 from textwrap import dedent
 from urllib.parse import unquote_plus
-
-from votacoes_assembleia_da_republica.update_account import update, render_vote
+from zoneinfo import ZoneInfo
+
+from votacoes_assembleia_da_republica import update_account
+from votacoes_assembleia_da_republica.analytics import post_weekly_summary
+from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+from votacoes_assembleia_da_republica.update_account import (
+    count_new_votes,
+    flush_journals,
+    poll_interval,
+    poll_legislatures,
+    state_file_paths_for,
+    update,
+    update_legislatures,
+    render_vote,
+)
 from votacoes_assembleia_da_republica.fetch_votes import JSON_URIS
-from votacoes_assembleia_da_republica.state_storage import StateStorage, _decompress_state
+from votacoes_assembleia_da_republica.posted_statuses import delete_statuses, select_statuses
+from votacoes_assembleia_da_republica.state_storage import StateStorage, _decompress_post_ids, _decompress_state
+from votacoes_assembleia_da_republica.vote_store import VoteStore
 
 # --- Consolidated Fixtures ---
 
 
 @pytest.fixture(autouse=True)
-def stub_env(monkeypatch):
+def stub_env(monkeypatch, tmp_path):
     monkeypatch.setenv("DEBUG_MODE", "false")
+    monkeypatch.setenv("HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    monkeypatch.setenv("DEBUG_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("MASTODON_POSTING_CONCURRENCY", "1")
     monkeypatch.setenv("MASTODON_API_BASE_URL", "https://masto.pt")
     monkeypatch.setenv("GH_VARIABLE_UPDATE_TOKEN", "gh_token")
     monkeypatch.setenv("REPO_OWNER", "owner")
@@ -34,6 +55,7 @@ def stub_github_patch(requests_mock):
     requests_mock.patch(StateStorage("XVII").gh_variable_url, status_code=204)
     requests_mock.patch(StateStorage("XVI").last_post_id_variable_url, status_code=204)
     requests_mock.patch(StateStorage("XVII").last_post_id_variable_url, status_code=204)
+    requests_mock.post(StateStorage("XVII").variables_url, status_code=201)
 
 
 @pytest.fixture
@@ -67,9 +89,8 @@ def test_update_does_not_repost_votes_already_in_state(requests_mock, tmp_path):
     assert not any(r.url == "https://masto.pt/api/v1/statuses" for r in requests_mock.request_history)
 
 
-def test_update_aborts_if_too_many_new_votes_are_detected(requests_mock, tmp_path, monkeypatch):
-    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
-    initiatives = [
+def many_initiatives(count: int) -> list[dict]:
+    return [
         {
             "IniDescTipo": "Projeto de Lei",
             "IniTipo": "P",
@@ -79,9 +100,33 @@ def test_update_aborts_if_too_many_new_votes_are_detected(requests_mock, tmp_pat
             "IniEventos": [{"Fase": "Votação final global", "Votacao": [{"id": str(i), "data": "2024-04-02", "resultado": "Aprovado", "detalhe": "unanime"}]}],
             "IniNr": str(i),
         }
-        for i in range(101)
+        for i in range(count)
     ]
-    requests_mock.get(JSON_URIS["XVII"], json=initiatives)
+
+
+def test_update_aborts_if_too_many_new_votes_are_detected(requests_mock, tmp_path, monkeypatch):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    requests_mock.get(JSON_URIS["XVII"], json=many_initiatives(101))
+    with pytest.raises(AssertionError, match="state might have been lost"):
+        update("XVII", tmp_path / "state.json")
+
+
+def test_update_backfills_in_batches_and_refuses_a_backlog_that_grew_too_much(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    monkeypatch.setenv("MASTODON_POSTING_BUDGET", "51")
+    requests_mock.get(JSON_URIS["XVII"], json=many_initiatives(101))
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account})
+    update("XVII", tmp_path / "state.json", backfill=True)
+
+    # one thread and 50 votes, the oldest ones
+    assert len([r for r in requests_mock.request_history if r.method == "POST"]) == 51
+    with open(tmp_path / "state.json", "r") as state_file:
+        assert sorted(json.load(state_file), key=int) == [str(i) for i in range(50)]
+    with open(tmp_path / "state.json.meta.json", "r") as metadata_file:
+        metadata = json.load(metadata_file)
+    assert metadata["backfill"]["remaining"] == 51 and "dump_fingerprint" not in metadata
+
+    requests_mock.get(JSON_URIS["XVII"], json=many_initiatives(300))
     with pytest.raises(AssertionError, match="state might have been lost"):
         update("XVII", tmp_path / "state.json")
 
@@ -106,7 +151,73 @@ def test_update_doesnt_crash_if_there_are_no_votes(requests_mock, tmp_path):
         requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
     update("XVII", tmp_path / "state.json", use_github=True)
     assert requests_mock.called
-    assert requests_mock.call_count == 3  # GET to parliament + GET state + PATCH state
+    assert requests_mock.call_count == 4  # GET to parliament + GET state + GET last post id (read ahead of time) + PATCH state
+
+
+def test_update_with_vote_store_posts_new_votes_once(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+    vote_store_path = str(tmp_path / "votes.sqlite3")
+
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+    posted = [r for r in requests_mock.request_history if r.url == "https://masto.pt/api/v1/statuses"]
+    assert len(posted) == 5  # two threads and three votes
+
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+    assert len([r for r in requests_mock.request_history if r.url == "https://masto.pt/api/v1/statuses"]) == 5
+
+
+def test_count_new_votes_neither_posts_nor_saves_state(requests_mock, tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text('{"126496": "published"}')
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+
+    assert count_new_votes({"XVII": state_file}) == {"XVII": 3}
+    assert state_file.read_text() == '{"126496": "published"}'
+    assert all(request.hostname == "app.parlamento.pt" for request in requests_mock.request_history)
+
+
+def test_flush_journals_only_saves_legislatures_with_a_journal(requests_mock, tmp_path):
+    crashed = StateStorage("XVII", file_path=tmp_path / "state_XVII.json").__enter__()
+    crashed.mark_vote_published("126496")
+    crashed.close_journal()
+
+    flush_journals({"XVII": tmp_path / "state_XVII.json", "XVI": tmp_path / "state_XVI.json"})
+
+    assert json.loads((tmp_path / "state_XVII.json").read_text()) == {"126496": "published"}
+    assert not (tmp_path / "state_XVI.json").exists()
+    assert not requests_mock.request_history
+
+
+def test_update_skips_parsing_a_dump_it_already_processed(requests_mock, tmp_path, stub_mastodon_api, mastodon_account, monkeypatch):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+    update("XVII", tmp_path / "state.json")
+    assert json.loads((tmp_path / "state.json.meta.json").read_text())["dump_fingerprint"]
+
+    parsed = []
+    monkeypatch.setattr("votacoes_assembleia_da_republica.update_account.fetch_votes_for_legislature", lambda *args, **kwargs: parsed.append(args) or iter(()))
+    update("XVII", tmp_path / "state.json")
+    assert parsed == []
+
+    update("XVII", tmp_path / "state.json", force=True)
+    assert len(parsed) == 1
+
+
+def test_update_does_not_record_the_dump_when_it_aborts(requests_mock, tmp_path, monkeypatch, stub_mastodon_api):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    requests_mock.get(StateStorage("XVII").last_post_id_variable_url, status_code=200, json={"value": "1234"})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=[{"id": "9000999"}])
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+
+    with pytest.raises(AssertionError, match="Last post ID mismatch"):
+        update("XVII", tmp_path / "state.json", use_github=True)
+    manifest_patches = [r for r in requests_mock.request_history if r.url == StateStorage("XVII").gh_variable_url and r.method == "PATCH"]
+    assert all("dump_fingerprint" not in json.loads(r.json()["value"]) for r in manifest_patches)
 
 
 def test_render_vote_cuts_down_text_down_to_the_500_char_limit():
@@ -141,11 +252,15 @@ def test_update_still_tries_to_save_state_if_a_post_errors_out(requests_mock, tm
     update("XVII", state_file_path, use_github=True)
     assert requests_mock.called
     assert all(request.hostname in ["app.parlamento.pt", "masto.pt", "api.github.com"] for request in requests_mock.request_history)
-    assert requests_mock.call_count == 10
+    assert requests_mock.call_count == 12
 
-    for request in requests_mock.request_history:
-        if request.url == StateStorage("XVII").gh_variable_url and request.method == "PATCH":
-            assert _decompress_state(request.json()["value"]) == {"126516": "errored", "126496": "published"}
+    created_variables = [request.json() for request in requests_mock.request_history if request.url == StateStorage("XVII").variables_url]
+    assert [variable["name"] for variable in created_variables] == ["STATE_XVII_12", "POSTS_XVII_12"]
+    assert _decompress_state(created_variables[0]["value"]) == {"126516": "errored", "126496": "published"}
+    assert {vote_id: post[:2] for vote_id, post in _decompress_post_ids(created_variables[1]["value"]).items()} == {"126516": (None, 1), "126496": (126516, 2)}
+    manifest_patches = [r for r in requests_mock.request_history if r.url == StateStorage("XVII").gh_variable_url and r.method == "PATCH"]
+    assert [json.loads(r.json()["value"])["shards"] for r in manifest_patches] == [["12"]]
+    assert [json.loads(r.json()["value"])["post_shards"] for r in manifest_patches] == [["12"]]
 
 
 def test_update_doesnt_crash_in_debug_mode_when_last_post_id_is_stored(requests_mock, tmp_path, monkeypatch):
@@ -165,6 +280,37 @@ def test_update_makes_no_write_requests_when_debug_mode_is_enabled(requests_mock
     update("XVII", tmp_path / "state.json", use_github=True)
     assert requests_mock.called
     assert not any(r.method in ("POST", "PATCH") for r in requests_mock.request_history)
+    assert (tmp_path / "raw_initiatives.txt").exists() and (tmp_path / "formatted_initiatives.json").exists()
+
+
+def test_update_doesnt_trust_the_initiative_index_of_a_lost_state(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    requests_mock.get(JSON_URIS["XVII"], json=many_initiatives(101))
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+    update("XVII", tmp_path / "state.json")
+
+    (tmp_path / "state.json").unlink()
+    (tmp_path / "state.json.meta.json").unlink()
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    with pytest.raises(AssertionError, match="state might have been lost"):
+        update("XVII", tmp_path / "state.json")
+
+
+def test_update_keeps_no_initiative_index_in_debug_mode(requests_mock, tmp_path, monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "true")
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    update("XVII", tmp_path / "state.json", use_github=True)
+    assert not list((tmp_path / "http_cache").glob("*.index.json"))
+
+
+def test_update_keeps_no_post_ids_in_debug_mode(requests_mock, tmp_path, monkeypatch):
+    monkeypatch.setenv("DEBUG_MODE", "true")
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    update("XVII", tmp_path / "state.json")
+
+    with StateStorage("XVII", file_path=tmp_path / "state.json") as state:
+        assert dict(state.posts) == {}
 
 
 def test_update_creates_one_thread_if_there_are_only_votes_with_one_result(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
@@ -176,7 +322,7 @@ def test_update_creates_one_thread_if_there_are_only_votes_with_one_result(reque
     update("XVII", tmp_path / "state.json", use_github=True)
     assert requests_mock.called
     assert all(request.hostname in ["app.parlamento.pt", "masto.pt", "api.github.com"] for request in requests_mock.request_history)
-    assert requests_mock.call_count == 8
+    assert requests_mock.call_count == 10  # with the POSTS_XVII_12 variable holding the status ids
     status_requests = [request for request in requests_mock.request_history if request.url == "https://masto.pt/api/v1/statuses"]
     assert unquote_plus(status_requests[0].body) == dedent(
         """\
@@ -216,7 +362,7 @@ def test_update_creates_two_threads_if_there_both_approved_and_rejected_votes(re
     update("XVII", tmp_path / "state.json", use_github=True)
     assert requests_mock.called
     assert all(request.hostname in ["app.parlamento.pt", "masto.pt", "api.github.com"] for request in requests_mock.request_history)
-    assert requests_mock.call_count == 10
+    assert requests_mock.call_count == 12  # with the POSTS_XVII_12 variable holding the status ids
     status_requests = [request for request in requests_mock.request_history if request.url == "https://masto.pt/api/v1/statuses"]
     assert unquote_plus(status_requests[0].body) == dedent(
         """\
@@ -367,3 +513,437 @@ def test_update_posts_multiple_approved_and_rejected_votes_as_threaded_replies(r
     # Fifth post should be rejected reply with correct in_reply_to_id
     body = unquote_plus(status_requests[4].body)
     assert f"&in_reply_to_id={rejected_thread_id}" in body, f"Missing correct in_reply_to_id for rejected in: {body}"
+
+
+@pytest.mark.parametrize("with_vote_store", [False, True])
+def test_update_posts_forgotten_votes_again(requests_mock, tmp_path, stub_mastodon_api, mastodon_account, with_vote_store):
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=[{"id": "9001"}])
+    requests_mock.delete("https://masto.pt/api/v1/statuses/9001", json={})
+    state_file = tmp_path / "state.json"
+    vote_store_path = str(tmp_path / "votes.sqlite3") if with_vote_store else None
+    update("XVII", state_file, vote_store_path=vote_store_path)
+
+    with StateStorage("XVII", file_path=state_file) as state:
+        vote_ids, status_ids = select_statuses(state.posts, vote_ids={"200001"})
+        delete_statuses(MastodonClient(), state, vote_ids, status_ids, forget_votes=True)
+
+    requests_mock.reset_mock()
+    update("XVII", state_file, vote_store_path=vote_store_path)
+
+    status_requests = [r for r in requests_mock.request_history if r.url == "https://masto.pt/api/v1/statuses"]
+    # the approved thread start and the forgotten vote
+    assert len(status_requests) == 2
+    assert json.loads(state_file.read_text()) == {"200001": "published", "200002": "published", "200003": "published"}
+
+    requests_mock.reset_mock()
+    update("XVII", state_file, vote_store_path=vote_store_path)
+    assert not any(r.url == "https://masto.pt/api/v1/statuses" for r in requests_mock.request_history)
+
+
+def test_update_legislatures_posts_every_legislature_and_saves_each_state(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVI"], text=legislature.read())
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+
+    update_legislatures({"XVI": tmp_path / "state_XVI.json", "XVII": tmp_path / "state_XVII.json"}, use_github=True)
+
+    assert json.loads((tmp_path / "state_XVI.json").read_text()) == {"126496": "published"}
+    assert json.loads((tmp_path / "state_XVII.json").read_text()) == {"200001": "published", "200002": "published", "200003": "published"}
+    status_requests = [r for r in requests_mock.request_history if r.url == "https://masto.pt/api/v1/statuses"]
+    assert len(status_requests) == 1 + 1 + 2 + 3
+    last_post_id_patches = {r.url for r in requests_mock.request_history if "LAST_POST_ID" in r.url and r.method == "PATCH"}
+    assert last_post_id_patches == {StateStorage("XVI").last_post_id_variable_url, StateStorage("XVII").last_post_id_variable_url}
+
+
+def journaled_last_post_id(journal_path) -> str | None:
+    try:
+        entries = [json.loads(line) for line in journal_path.read_text().splitlines()]
+    except FileNotFoundError:
+        return None
+    return next((entry["last_post_id"] for entry in reversed(entries) if "last_post_id" in entry), None)
+
+
+def test_update_journals_the_last_post_id_of_every_legislature_after_each_post(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVI"], text=legislature.read())
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    # what a run killed right before each post would leave in the journals
+    journaled = []
+
+    def post_status(request, context):
+        journaled.append([journaled_last_post_id(tmp_path / f"state_{legislature}.json.journal") for legislature in ("XVI", "XVII")])
+        return {"id": 9001 + len(journaled), "account": mastodon_account, "mentions": []}
+
+    requests_mock.post("https://masto.pt/api/v1/statuses", json=post_status)
+    update_legislatures({"XVI": tmp_path / "state_XVI.json", "XVII": tmp_path / "state_XVII.json"})
+
+    # XVI's thread and vote, then XVII's approved thread and two votes and its rejected thread and vote
+    assert journaled == [[post_id, post_id] for post_id in (None, None, "9003", "9003", "9005", "9006", "9006")]
+
+
+def test_update_legislatures_still_posts_the_other_legislatures_if_one_fails_its_checks(
+    requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account
+):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    requests_mock.get(JSON_URIS["XVI"], json=many_initiatives(101))
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+
+    with pytest.raises(AssertionError, match="state might have been lost"):
+        update_legislatures({"XVI": tmp_path / "state_XVI.json", "XVII": tmp_path / "state_XVII.json"})
+
+    assert json.loads((tmp_path / "state_XVI.json").read_text()) == {}
+    assert json.loads((tmp_path / "state_XVII.json").read_text()) == {"126496": "published"}
+
+
+def test_update_caches_the_mastodon_account_id_in_the_state(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    requests_mock.get(StateStorage("XVII").last_post_id_variable_url, status_code=200, json={"value": "9000001"})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=[{"id": "9000001"}])
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9000001, "account": mastodon_account, "mentions": []})
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+
+    update("XVII", tmp_path / "state.json", use_github=True)
+
+    manifest = json.loads(
+        [r for r in requests_mock.request_history if r.url == StateStorage("XVII").gh_variable_url and r.method == "PATCH"][-1].json()["value"]
+    )
+    assert manifest["account_id"] == "1"
+
+    created_variables = {r.json()["name"]: r.json()["value"] for r in requests_mock.request_history if r.url == StateStorage("XVII").variables_url}
+    requests_mock.reset_mock()
+    requests_mock.get(StateStorage("XVII").gh_variable_url, json={"name": "STATE_XVII", "updated_at": "2025-09-16T09:12:30Z", "value": json.dumps(manifest)})
+    for name, value in created_variables.items():
+        requests_mock.get(StateStorage("XVII").variable_url(name), json={"name": name, "updated_at": "2025-09-16T09:12:30Z", "value": value})
+    requests_mock.patch(StateStorage("XVII").variable_url("STATE_XVII_12"), status_code=204)
+    requests_mock.patch(StateStorage("XVII").variable_url("POSTS_XVII_12"), status_code=204)
+    with open("tests/files/legislatures/minimal_example_approved_and_rejected.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    update("XVII", tmp_path / "state.json", use_github=True)
+
+    assert not any(r.url == "https://masto.pt/api/v1/accounts/verify_credentials" for r in requests_mock.request_history)
+    assert any(r.url.startswith("https://masto.pt/api/v1/accounts/1/statuses") for r in requests_mock.request_history)
+
+
+def test_update_issues_the_preflight_requests_concurrently(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    # requests_mock serializes requests, so the barrier sits right above it: the state, the stored last post id and the
+    # dump are only fetched once all three are in flight
+    all_in_flight = threading.Barrier(3, timeout=5)
+
+    def in_flight(fetch):
+        def wait_for_the_others(*args, **kwargs):
+            all_in_flight.wait()
+            return fetch(*args, **kwargs)
+
+        return wait_for_the_others
+
+    monkeypatch.setattr(StateStorage, "read_sharded_state", in_flight(StateStorage.read_sharded_state))
+    monkeypatch.setattr(StateStorage, "read_last_post_id", in_flight(StateStorage.read_last_post_id))
+    monkeypatch.setattr(update_account, "fetch_initiatives_for_legislature", in_flight(update_account.fetch_initiatives_for_legislature))
+    requests_mock.get(StateStorage("XVII").last_post_id_variable_url, json={"value": "9000001"})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=[{"id": "9000001"}])
+    with open("tests/files/legislatures/empty_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+
+    update("XVII", tmp_path / "state.json", use_github=True)
+
+    # nothing to post, so the account isn't looked up
+    assert not any(r.hostname == "masto.pt" for r in requests_mock.request_history)
+
+
+def test_update_looks_the_account_up_while_the_other_legislatures_are_collected(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    # XVII's dump is only downloaded once the account's latest post was looked up for XVI's new vote
+    looked_up = threading.Event()
+
+    def latest_post(request, context):
+        looked_up.set()
+        return [{"id": "9000001"}]
+
+    def fetch_after_the_lookup(fetch):
+        def fetch_initiatives(legislature):
+            if legislature == "XVII":
+                assert looked_up.wait(timeout=5)
+            return fetch(legislature)
+
+        return fetch_initiatives
+
+    # requests_mock serializes requests, so the download waits right above it
+    monkeypatch.setattr(update_account, "fetch_initiatives_for_legislature", fetch_after_the_lookup(update_account.fetch_initiatives_for_legislature))
+    requests_mock.get(StateStorage("XVI").last_post_id_variable_url, json={"value": "9000001"})
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=latest_post)
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9000002, "account": mastodon_account, "mentions": []})
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVI"], text=legislature.read())
+    requests_mock.get(JSON_URIS["XVII"], json=[])
+
+    update_legislatures({"XVI": tmp_path / "state_XVI.json", "XVII": tmp_path / "state_XVII.json"}, use_github=True)
+
+    assert json.loads((tmp_path / "state_XVI.json").read_text()) == {"126496": "published"}
+
+
+@pytest.mark.parametrize("with_vote_store", [False, True])
+def test_update_edits_the_toots_of_votes_that_changed_since_they_were_posted(requests_mock, tmp_path, stub_mastodon_api, mastodon_account, with_vote_store):
+    # editing needs Mastodon 3.5
+    requests_mock.get("https://masto.pt/api/v1/instance/", json={"version": "4.3.0"})
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        dump = legislature.read()
+    requests_mock.get(JSON_URIS["XVII"], text=dump.replace("<BR>Abstenção:<I>CH</I>", ""))
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    vote_store_path = str(tmp_path / "votes.sqlite3") if with_vote_store else None
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    # parlamento.pt adds the missing abstention
+    requests_mock.get(JSON_URIS["XVII"], text=dump)
+    requests_mock.put("https://masto.pt/api/v1/statuses/9002", json={"id": 9002, "account": mastodon_account})
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    edits = [r for r in requests_mock.request_history if r.method == "PUT"]
+    assert len(edits) == 1
+    assert "🤷 CH" in unquote_plus(edits[0].body)
+    assert len([r for r in requests_mock.request_history if r.method == "POST"]) == 2
+
+    # nothing changed since the edit
+    requests_mock.get(JSON_URIS["XVII"], text=dump + "\n")
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+    assert len([r for r in requests_mock.request_history if r.method == "PUT"]) == 1
+
+
+@pytest.mark.parametrize("with_vote_store", [False, True])
+def test_update_only_renders_again_the_posted_votes_whose_result_or_detail_changed(
+    requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account, with_vote_store
+):
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        initiatives = json.load(legislature)
+    requests_mock.get(JSON_URIS["XVII"], json=initiatives)
+    requests_mock.post("https://masto.pt/api/v1/statuses", json={"id": 9001, "account": mastodon_account, "mentions": []})
+    vote_store_path = str(tmp_path / "votes.sqlite3") if with_vote_store else None
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    rendered = []
+    monkeypatch.setattr(update_account, "render_vote", lambda vote: rendered.append(vote["vote_id"]) or render_vote(vote))
+    # every initiative changed, none of their votes did
+    for initiative in initiatives:
+        initiative["IniEpigrafe"] = "Epígrafe"
+    requests_mock.get(JSON_URIS["XVII"], json=initiatives)
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    assert rendered == []
+    assert not any(r.method == "PUT" for r in requests_mock.request_history)
+
+
+def test_update_with_vote_store_stores_votes_corrected_after_they_were_stored(requests_mock, tmp_path, monkeypatch):
+    # the vote is stored but skipped, not posted
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE", "2024-05-01")
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        dump = legislature.read()
+    requests_mock.get(JSON_URIS["XVII"], text=dump.replace("<BR>Abstenção:<I>CH</I>", ""))
+    vote_store_path = str(tmp_path / "votes.sqlite3")
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    requests_mock.get(JSON_URIS["XVII"], text=dump)
+    update("XVII", tmp_path / "state.json", vote_store_path=vote_store_path)
+
+    with VoteStore(vote_store_path) as store:
+        assert [vote["vote_id"] for vote in store.query(party="CH", position="abstained")] == ["126496"]
+    assert json.loads((tmp_path / "state.json").read_text()) == {"126496": "skipped"}
+
+
+def test_update_publishes_to_mirrors_and_keeps_their_state(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    update("XVII", tmp_path / "state.json", mirrors=[f"archive=jsonl:{tmp_path / 'mirror.jsonl'}"])
+
+    with open(tmp_path / "mirror.jsonl", "r") as jsonl_file:
+        statuses = [json.loads(line) for line in jsonl_file]
+    assert [status["idempotency_key"] for status in statuses[1:]] == ["126496"]
+    with open(tmp_path / "state.json.targets.json", "r") as targets_file:
+        assert json.load(targets_file) == {"archive": {"126496": "published"}}
+    with open(tmp_path / "state.json", "r") as state_file:
+        assert json.load(state_file) == {"126496": "published"}
+
+
+def test_update_still_posts_to_the_account_if_a_mirror_fails(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    # the mirror's directory doesn't exist
+    update("XVII", tmp_path / "state.json", mirrors=[f"jsonl:{tmp_path / 'missing' / 'mirror.jsonl'}"])
+
+    with open(tmp_path / "state.json", "r") as state_file:
+        assert json.load(state_file) == {"126496": "published"}
+    with open(tmp_path / "state.json.targets.json", "r") as targets_file:
+        assert json.load(targets_file) == {"jsonl": {"126496": "errored"}}
+
+
+def test_update_keeps_mirror_states_in_their_own_github_variables(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    update("XVII", tmp_path / "state.json", use_github=True, mirrors=[f"archive=jsonl:{tmp_path / 'mirror.jsonl'}"])
+
+    created_variables = {r.json()["name"]: r.json()["value"] for r in requests_mock.request_history if r.url == StateStorage("XVII").variables_url}
+    assert _decompress_state(created_variables["TARGET_STATE_XVII_ARCHIVE"]) == {"126496": "published"}
+    manifest_patches = [r for r in requests_mock.request_history if r.url == StateStorage("XVII").gh_variable_url and r.method == "PATCH"]
+    assert json.loads(manifest_patches[-1].json()["value"])["targets"] == ["archive"]
+
+
+class BlockingPublisher:
+    # a mirror that doesn't post anything until the account posted every legislature
+    name = "slow"
+
+    def __init__(self, account_done: threading.Event):
+        self.account_done = account_done
+        self.waited = []
+        self.posted = []
+
+    def post_vote_threads(self, vote_threads, on_posted, on_error):
+        self.waited.append(self.account_done.wait(timeout=5))
+        for vote_thread in vote_threads:
+            for vote_id, _ in vote_thread.rendered_votes:
+                self.posted.append(vote_id)
+                on_posted(vote_id, None)
+
+
+def test_a_slow_mirror_does_not_hold_up_the_account_across_legislatures(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVI"], text=legislature.read())
+    with open("tests/files/legislatures/multiple_approved_sorted.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    account_done = threading.Event()
+    account_posts = []
+
+    def post_status(request, context):
+        account_posts.append(request)
+        # both threads and the vote of XVI, then both threads and the three votes of XVII
+        if len(account_posts) == 2 + 2 + 3:
+            account_done.set()
+        return {"id": 9000 + len(account_posts), "account": mastodon_account, "mentions": []}
+
+    requests_mock.post("https://masto.pt/api/v1/statuses", json=post_status)
+    mirror = BlockingPublisher(account_done)
+    monkeypatch.setattr("votacoes_assembleia_da_republica.publishers.publisher_from_spec", lambda spec: mirror)
+
+    update_legislatures({"XVI": tmp_path / "state_XVI.json", "XVII": tmp_path / "state_XVII.json"}, mirrors=["slow=jsonl:unused.jsonl"])
+
+    # the mirror was still on XVI while the account posted XVII, and was waited on before the states were saved
+    assert mirror.waited == [True, True]
+    assert mirror.posted == ["126496", "200001", "200002", "200003"]
+    assert json.loads((tmp_path / "state_XVI.json.targets.json").read_text()) == {"slow": {"126496": "published"}}
+    assert json.loads((tmp_path / "state_XVII.json.targets.json").read_text()) == {
+        "slow": {"200001": "published", "200002": "published", "200003": "published"}
+    }
+
+
+class StopAfter(threading.Event):
+    # stops the daemon once it waited for the given number of polls, without sleeping
+    def __init__(self, polls: int):
+        super().__init__()
+        self.polls = polls
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        if len(self.waits) >= self.polls:
+            self.set()
+        return self.is_set()
+
+
+def test_poll_interval_adapts_to_the_time_of_day_and_the_last_change():
+    lisbon = ZoneInfo("Europe/Lisbon")
+    wednesday_noon = datetime.datetime(2025, 3, 12, 12, tzinfo=lisbon)
+    assert poll_interval(wednesday_noon, wednesday_noon - datetime.timedelta(minutes=2)) == 60
+    assert poll_interval(wednesday_noon, wednesday_noon - datetime.timedelta(minutes=20)) == 300
+    assert poll_interval(wednesday_noon, wednesday_noon - datetime.timedelta(hours=5)) == 900
+    assert poll_interval(wednesday_noon, None) == 900
+    assert poll_interval(datetime.datetime(2025, 3, 12, 23, tzinfo=lisbon), wednesday_noon) == 3600
+    assert poll_interval(datetime.datetime(2025, 3, 15, 12, tzinfo=lisbon), None) == 3600
+
+
+def test_poll_legislatures_posts_new_votes_once_and_only_saves_changed_state(requests_mock, tmp_path, stub_mastodon_api, mastodon_account, monkeypatch):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], [{"text": legislature.read(), "headers": {"ETag": '"v1"'}}, {"status_code": 304}])
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    saves = []
+    save = StateStorage.save
+    monkeypatch.setattr(StateStorage, "save", lambda state: saves.append(state.legislature) or save(state))
+
+    stop = StopAfter(polls=3)
+    poll_legislatures({"XVII": tmp_path / "state.json"}, stop=stop)
+
+    dump_requests = [r for r in requests_mock.request_history if r.hostname == "app.parlamento.pt"]
+    assert len(dump_requests) == 3
+    assert all(r.headers["If-None-Match"] == '"v1"' for r in dump_requests[1:])
+    assert len([r for r in requests_mock.request_history if r.method == "POST"]) == 2
+    # once after the poll that posted and once when the daemon stopped
+    assert saves == ["XVII", "XVII"]
+    assert len(stop.waits) == 3
+    with open(tmp_path / "state.json", "r") as state_file:
+        assert json.load(state_file) == {"126496": "published"}
+
+
+def test_poll_legislatures_keeps_polling_after_a_failed_poll(requests_mock, tmp_path, stub_mastodon_api, mastodon_account):
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], [{"status_code": 404}, {"text": legislature.read()}])
+    requests_mock.post(
+        "https://masto.pt/api/v1/statuses", [{"json": {"id": 9001, "account": mastodon_account}}, {"json": {"id": 9002, "account": mastodon_account}}]
+    )
+    poll_legislatures({"XVII": tmp_path / "state.json"}, stop=StopAfter(polls=2))
+
+    with open(tmp_path / "state.json", "r") as state_file:
+        assert json.load(state_file) == {"126496": "published"}
+
+
+def test_xvii_keeps_its_state_in_state_json():
+    assert state_file_paths_for(["XVI", "XVII"]) == {"XVI": "state_XVI.json", "XVII": "state.json"}
+    assert state_file_paths_for(["XVII"]) == {"XVII": "state.json"}
+    assert state_file_paths_for(["XVI"]) == {"XVI": "state_XVI.json"}
+
+
+def test_update_after_a_weekly_summary_passes_the_last_post_id_check(requests_mock, tmp_path, monkeypatch, stub_mastodon_api, mastodon_account):
+    monkeypatch.setenv("OVERRIDE_UNSAFE_STATE_CHECK", "false")
+    # the LAST_POST_ID variables and the account's timeline follow what was actually posted
+    last_post_ids = {legislature: "9000001" for legislature in JSON_URIS}
+    timeline = [{"id": "9000001"}]
+    for legislature in JSON_URIS:
+        url = StateStorage(legislature).last_post_id_variable_url
+        requests_mock.get(url, json=lambda request, context, legislature=legislature: {"value": last_post_ids[legislature]})
+        requests_mock.patch(
+            url, status_code=204, json=lambda request, context, legislature=legislature: last_post_ids.update({legislature: request.json()["value"]})
+        )
+    requests_mock.get("https://masto.pt/api/v1/accounts/1/statuses", json=lambda request, context: timeline[-1:])
+
+    def post_status(request, context):
+        timeline.append({"id": str(int(timeline[-1]["id"]) + 1), "account": mastodon_account})
+        return timeline[-1]
+
+    requests_mock.post("https://masto.pt/api/v1/statuses", json=post_status)
+    summary_id = post_weekly_summary(MastodonClient(), "resumo semanal", "2025-03-09", JSON_URIS, use_github=True)
+    assert summary_id == "9000002"
+    assert last_post_ids == {legislature: "9000002" for legislature in JSON_URIS}
+
+    with open("tests/files/legislatures/minimal_example.json", "r") as legislature:
+        requests_mock.get(JSON_URIS["XVII"], text=legislature.read())
+    update("XVII", tmp_path / "state.json", use_github=True)
+    assert json.loads((tmp_path / "state.json").read_text()) == {"126496": "published"}
+    assert last_post_ids["XVII"] == timeline[-1]["id"]
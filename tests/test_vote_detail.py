@@ -0,0 +1,112 @@
+import glob
+import json
+import random
+
+import pytest
+from bs4 import BeautifulSoup
+
+from votacoes_assembleia_da_republica.fetch_votes import _parse_vote_detail_sections, parse_initiatives, parse_vote
+
+PARTIES = ["PSD", "PS", "CH", "IL", "BE", "PCP", "L", "PAN", "CDS-PP", "JPP", "PEV", "Ninsc. Joana Cordeiro", "Deputado Não Inscrito"]
+SECTIONS = ["A Favor", "Contra", "Abstenção", "Ausência"]
+
+
+def reference_parse_vote_detail(vote_detail: str) -> dict[str, list[str]]:
+    # the BeautifulSoup based parser this module used to rely on
+    sections = dict(x.split(":") for x in vote_detail.split("<BR>"))
+
+    for k, v in sections.items():
+        ctext = BeautifulSoup(v, "lxml")
+        sections[k] = list(map(lambda s: s.strip(), ctext.get_text().strip().split(",")))
+
+    return {
+        "in_favour": sections.get("A Favor", []),
+        "against": sections.get("Contra", []),
+        "abstained": sections.get("Abstenção", []),
+        "absent": sections.get("Ausência", []),
+    }
+
+
+def parse_vote_detail(vote_detail: str) -> dict[str, list[str]]:
+    # the detail as parse_vote leaves it on a vote
+    raw_vote = {
+        "vote_id": "1",
+        "result": "Aprovado",
+        "vote_detail": vote_detail,
+        "date": "2024-04-19",
+        "phase": "Votação na generalidade",
+        "initiative_type": "Projeto de Lei",
+        "title": "Título",
+        "initiative_uri": "https://example.com",
+        "authors": ["PS"],
+    }
+    return parse_vote(raw_vote)["vote_detail"]
+
+
+def fixture_vote_details() -> list[str]:
+    details = set()
+    for path in glob.glob("tests/files/legislatures/*.json"):
+        with open(path) as legislature_file:
+            details.update(vote["vote_detail"] for vote in parse_initiatives(json.load(legislature_file)) if vote["vote_detail"] not in (None, "unanime"))
+    return sorted(details)
+
+
+def synthetic_vote_details(count: int) -> list[str]:
+    rng = random.Random(42)
+    party_formats = ["<I>{}</I>", "<I> {}</I>", "{}", " {} ", "<i>{}</i>", "<I>{}</I> "]
+    details = []
+    for _ in range(count):
+        sections = rng.sample(SECTIONS, rng.randint(1, len(SECTIONS)))
+        rendered_sections = []
+        for section in sections:
+            parties = rng.sample(PARTIES, rng.randint(0, 5))
+            separator = rng.choice([",", ", ", " , "])
+            rendered_parties = separator.join(rng.choice(party_formats).format(party) for party in parties)
+            rendered_sections.append(f"{section}:{rng.choice(['', ' '])}{rendered_parties}")
+        details.append("<BR>".join(rendered_sections))
+    return details
+
+
+@pytest.mark.parametrize("vote_detail", fixture_vote_details())
+def test_parse_vote_detail_matches_the_reference_parser_on_fixtures(vote_detail):
+    assert parse_vote_detail(vote_detail) == reference_parse_vote_detail(vote_detail)
+
+
+def test_parse_vote_detail_matches_the_reference_parser_on_synthetic_details():
+    for vote_detail in synthetic_vote_details(2000):
+        assert parse_vote_detail(vote_detail) == reference_parse_vote_detail(vote_detail), vote_detail
+
+
+@pytest.mark.parametrize(
+    "vote_detail",
+    [
+        "A Favor: <I>A &amp; B</I>,&nbsp;<I>C</I>",
+        "A Favor:<I>PS</I><!-- comment -->, <I>PSD</I>",
+        "A Favor:<I>PS</I>, <I><BR>Contra:",
+        "Contra:<I>PS</I><BR>Contra:<I>PSD</I>",
+    ],
+)
+def test_parse_vote_detail_matches_the_reference_parser_on_edge_cases(vote_detail):
+    assert parse_vote_detail(vote_detail) == reference_parse_vote_detail(vote_detail)
+
+
+def test_parse_vote_detail_returns_independent_lists():
+    vote_detail = "A Favor: <I>PS</I><BR>Contra:<I>PSD</I>"
+    parse_vote_detail(vote_detail)["in_favour"].append("CH")
+    assert parse_vote_detail(vote_detail)["in_favour"] == ["PS"]
+
+
+def test_parse_vote_detail_is_memoized():
+    _parse_vote_detail_sections.cache_clear()
+    for _ in range(100):
+        parse_vote_detail("A Favor: <I>PS</I><BR>Contra:<I>PSD</I>")
+    assert _parse_vote_detail_sections.cache_info().misses == 1
+
+
+def test_parse_vote_output_is_unchanged_on_fixtures():
+    for path in glob.glob("tests/files/legislatures/*.json"):
+        with open(path) as legislature_file:
+            for raw_vote in parse_initiatives(json.load(legislature_file)):
+                vote = parse_vote(raw_vote)
+                if isinstance(vote["vote_detail"], dict):
+                    assert vote["vote_detail"] == reference_parse_vote_detail(raw_vote["vote_detail"])
@@ -0,0 +1,66 @@
+import pytest
+
+from votacoes_assembleia_da_republica.fetch_votes import parse_initiatives, parse_vote
+from votacoes_assembleia_da_republica.json_stream import iter_json_array_file
+from votacoes_assembleia_da_republica.vote_store import VoteStore
+
+
+def vote(vote_id, result="Aprovado", date="2025-03-10", authors=("PS",), vote_detail="unanime"):
+    return {
+        "vote_id": vote_id,
+        "result": result,
+        "vote_detail": vote_detail,
+        "date": date,
+        "authors": list(authors),
+        "initiative_type": "Projeto de Lei",
+        "title": f"Vote {vote_id}",
+        "phase": "Votação final global",
+        "initiative_uri": "http://example.com",
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    with VoteStore(str(tmp_path / "votes.sqlite3")) as store:
+        yield store
+
+
+def test_stored_votes_read_back_like_parsed_votes(store):
+    votes = [parse_vote(raw_vote) for raw_vote in parse_initiatives(iter_json_array_file("tests/files/legislatures/multiple_approved_sorted.json"))]
+    assert store.upsert_votes("XVII", votes) == len(votes)
+    assert store.new_votes("XVII", []) == votes
+
+
+def test_upsert_replaces_votes_by_id(store):
+    store.upsert_votes("XVII", [vote("1", authors=["PS", "L"])])
+    store.upsert_votes("XVII", [vote("1", result="Rejeitado", authors=["CH"])])
+    assert store.new_votes("XVII", []) == [vote("1", result="Rejeitado", authors=["CH"])]
+
+
+def test_new_votes_are_the_stored_votes_missing_from_the_known_ids(store):
+    store.upsert_votes("XVI", [vote("1")])
+    store.upsert_votes("XVII", [vote("2"), vote("3"), vote("10")])
+    assert [v["vote_id"] for v in store.new_votes("XVII", ["2", "4"])] == ["3", "10"]
+    assert store.vote_id_range("XVII") == (2, 10)
+    assert store.vote_id_range("XVIII") == (None, None)
+
+
+def test_query_filters_by_result_author_date_and_party_position(store):
+    detail = {"in_favour": ["PS", "L"], "against": ["CH"], "abstained": ["PSD"], "absent": []}
+    store.upsert_votes(
+        "XVII",
+        [
+            vote("1", result="Rejeitado", date="2025-03-02", authors=["L"], vote_detail=detail),
+            vote("2", result="Rejeitado", date="2025-04-02", authors=["L"]),
+            vote("3", result="Aprovado", date="2025-03-05", authors=["L"]),
+            vote("4", result="Rejeitado", date="2025-03-31", authors=["PS", "L"]),
+        ],
+    )
+
+    march = store.query(result="Rejeitado", author="L", date_from="2025-03-01", date_to="2025-03-31")
+    assert [v["vote_id"] for v in march] == ["1", "4"]
+    assert march[0]["vote_detail"] == detail
+    assert [v["vote_id"] for v in store.query(party="CH", position="against")] == ["1"]
+    assert store.query(party="CH", position="in_favour") == []
+    with pytest.raises(ValueError):
+        store.query(party="CH", position="for")
@@ -0,0 +1,230 @@
+import datetime
+from bisect import bisect_left, bisect_right
+from itertools import combinations
+from operator import itemgetter
+from typing import TYPE_CHECKING, Callable, Iterable, TypeVar
+
+from votacoes_assembleia_da_republica.templates import templates
+
+if TYPE_CHECKING:
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+
+# absent isn't a position, a party that was absent simply isn't present in that vote
+POSITIONS = ("in_favour", "against", "abstained")
+SUMMARY_PAIRS = 3
+
+T = TypeVar("T")
+
+
+def _mask(indices: list[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _count_masks(masks: list[int], everything: int) -> list[int]:
+    # bit-sliced counter: masks[k] has bit i set when exactly k of the given masks have bit i set, for all votes at once
+    planes = []
+    for mask in masks:
+        carry = mask
+        for j, plane in enumerate(planes):
+            planes[j], carry = plane ^ carry, plane & carry
+        if carry:
+            planes.append(carry)
+
+    counts = []
+    for k in range(len(masks) + 1):
+        if k >> len(planes):
+            counts.append(0)
+            continue
+        selected = everything
+        for j, plane in enumerate(planes):
+            selected &= plane if k >> j & 1 else ~plane
+        counts.append(selected)
+    return counts
+
+
+class PartyMatrix:
+    # the party x vote position matrix of a set of votes, stored column-wise as one bitmask per (position, party) with
+    # bit i set when the party took that position in the i-th vote (votes are sorted by date). Every statistic is a
+    # handful of bitwise operations and popcounts over those masks, the same for 100 or 100k votes.
+
+    def __init__(self, votes: Iterable[dict]):
+        self.votes = sorted(votes, key=itemgetter("date"))
+        self.dates = [vote["date"] for vote in self.votes]
+        self.size = len(self.votes)
+        self.everything = (1 << self.size) - 1
+
+        indices = {position: {} for position in POSITIONS}
+        unanimous = []
+        approved = []
+        rejected = []
+        for i, vote in enumerate(self.votes):
+            if vote["result"] == "Aprovado":
+                approved.append(i)
+            elif vote["result"] == "Rejeitado":
+                rejected.append(i)
+            if vote["vote_detail"] == "unanime":
+                unanimous.append(i)
+            elif isinstance(vote["vote_detail"], dict):
+                for position in POSITIONS:
+                    for party in vote["vote_detail"][position]:
+                        indices[position].setdefault(party, []).append(i)
+
+        self.parties = sorted({party for by_party in indices.values() for party in by_party})
+        # unanimous votes don't list the parties, every known party voted in favour
+        unanimous_mask = _mask(unanimous, self.size)
+        self.positions = {
+            position: {party: _mask(indices[position].get(party, []), self.size) | (unanimous_mask if position == "in_favour" else 0) for party in self.parties}
+            for position in POSITIONS
+        }
+        self.present = {
+            party: self.positions["in_favour"][party] | self.positions["against"][party] | self.positions["abstained"][party] for party in self.parties
+        }
+        self.approved = _mask(approved, self.size)
+        self.rejected = _mask(rejected, self.size)
+
+    def window(self, date_from: str | None = None, date_to: str | None = None) -> int:
+        # votes between the two dates, both inclusive
+        start = 0 if date_from is None else bisect_left(self.dates, date_from)
+        end = self.size if date_to is None else bisect_right(self.dates, date_to)
+        return ((1 << end) - 1) ^ ((1 << start) - 1) if end > start else 0
+
+    def vote_count(self, window: int | None = None) -> int:
+        return (self.everything if window is None else window).bit_count()
+
+    def cohesion(self, parties: Iterable[str], window: int | None = None) -> float | None:
+        # share of the votes in which all the given parties were present that they all voted the same way
+        parties = list(parties)
+        present = self.everything if window is None else window
+        for party in parties:
+            present &= self.present[party]
+        if not present:
+            return None
+
+        together = 0
+        for position in POSITIONS:
+            same = present
+            for party in parties:
+                same &= self.positions[position][party]
+            together |= same
+        return together.bit_count() / present.bit_count()
+
+    def agreement(self, a: str, b: str, window: int | None = None) -> float | None:
+        return self.cohesion((a, b), window)
+
+    def agreement_rates(self, window: int | None = None) -> dict[tuple[str, str], float]:
+        rates = {}
+        for a, b in combinations(self.parties, 2):
+            rate = self.agreement(a, b, window)
+            if rate is not None:
+                rates[(a, b)] = rate
+        return rates
+
+    def kingmaker_counts(self, window: int | None = None) -> dict[str, int]:
+        # votes a party was on the winning side of by a margin of at most one party, so that switching sides would
+        # have tied or reversed the outcome. The dumps only list parties, so each party counts once regardless of seats.
+        in_favour = _count_masks(list(self.positions["in_favour"].values()), self.everything)
+        against = _count_masks(list(self.positions["against"].values()), self.everything)
+
+        close_approval = 0
+        close_rejection = 0
+        for k in range(len(self.parties) + 1):
+            for margin in (0, 1):
+                if k - margin >= 0:
+                    close_approval |= in_favour[k] & against[k - margin]
+                    close_rejection |= against[k] & in_favour[k - margin]
+
+        window = self.everything if window is None else window
+        close_approval &= self.approved & window
+        close_rejection &= self.rejected & window
+        return {
+            party: ((close_approval & self.positions["in_favour"][party]) | (close_rejection & self.positions["against"][party])).bit_count()
+            for party in self.parties
+        }
+
+    def rolling(self, metric: Callable[[int], T], days: int = 28, step: int = 7) -> list[tuple[str, str, T]]:
+        # metric evaluated over windows of `days` days, every `step` days up to the last vote
+        if not self.size:
+            return []
+        first = datetime.date.fromisoformat(self.dates[0])
+        last = datetime.date.fromisoformat(self.dates[-1])
+
+        results = []
+        end = first + datetime.timedelta(days=days - 1)
+        while True:
+            start = end - datetime.timedelta(days=days - 1)
+            results.append((start.isoformat(), end.isoformat(), metric(self.window(start.isoformat(), end.isoformat()))))
+            if end >= last:
+                return results
+            end += datetime.timedelta(days=step)
+
+
+def format_pairs(rates: list[tuple[tuple[str, str], float]]) -> str:
+    return ", ".join(f"{a}/{b} {rate:.0%}" for (a, b), rate in rates) or "-"
+
+
+def render_weekly_summary(matrix: PartyMatrix, date_to: str) -> str | None:
+    date_from = (datetime.date.fromisoformat(date_to) - datetime.timedelta(days=6)).isoformat()
+    window = matrix.window(date_from, date_to)
+    if not window:
+        return None
+
+    rates = matrix.agreement_rates(window).items()
+    closest = sorted(rates, key=lambda entry: (-entry[1], entry[0]))
+    furthest = sorted(rates, key=lambda entry: (entry[1], entry[0]))
+    kingmakers = sorted(((count, party) for party, count in matrix.kingmaker_counts(window).items() if count), key=lambda entry: (-entry[0], entry[1]))
+
+    return templates.get("weekly_summary.template").substitute(
+        date_start=date_from,
+        date_end=date_to,
+        votes=matrix.vote_count(window),
+        approved=(window & matrix.approved).bit_count(),
+        rejected=(window & matrix.rejected).bit_count(),
+        closest=format_pairs(closest[:SUMMARY_PAIRS]),
+        furthest=format_pairs(furthest[:SUMMARY_PAIRS]),
+        kingmakers=", ".join(f"{party} ({count})" for count, party in kingmakers[:SUMMARY_PAIRS]) or "-",
+    )
+
+
+def post_weekly_summary(m: "MastodonClient", summary: str, date: str, legislatures: Iterable[str], use_github=False) -> str | None:
+    # the summary becomes the account's latest post, which the next update checks every stored LAST_POST_ID against
+    from votacoes_assembleia_da_republica.state_storage import StateStorage
+
+    post = m.start_vote_thread(summary, idempotency_key=f"weekly-summary-{date}")
+    if post is None:
+        return None
+
+    post_id = str(post["id"])
+    if use_github:
+        for legislature in legislatures:
+            StateStorage(legislature, use_github=True).update_last_post_id_variable(post_id)
+    return post_id
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    from votacoes_assembleia_da_republica.fetch_votes import JSON_URIS
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+    from votacoes_assembleia_da_republica.vote_store import VoteStore
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vote-store", metavar="PATH", help="SQLite vote store written by update_account --vote-store")
+    parser.add_argument("--date", default=datetime.date.today().isoformat(), help="Last day of the week to summarize")
+    parser.add_argument("--github-state", action="store_true", help="Store the summary as the last post id of every legislature in GitHub variables")
+    args = parser.parse_args()
+
+    with VoteStore(args.vote_store) as store:
+        matrix = PartyMatrix(store.query(date_to=args.date))
+
+    summary = render_weekly_summary(matrix, args.date)
+    if summary is None:
+        print("no votes this week")
+    else:
+        post_weekly_summary(MastodonClient(), summary, args.date, JSON_URIS, use_github=args.github_state)
+        print("done")
@@ -0,0 +1,86 @@
+import datetime
+import os
+
+# more new votes than this in one run means the state was probably lost, unless a backfill was started
+MAX_NEW_VOTES = 100
+# Mastodon's default limit on creating statuses, 300 per account every 3 hours
+DEFAULT_POSTING_BUDGET = 300
+DEFAULT_POSTING_WINDOW_MINUTES = 180
+
+
+def posting_budget() -> int:
+    return int(os.getenv("MASTODON_POSTING_BUDGET", str(DEFAULT_POSTING_BUDGET)))
+
+
+def posting_window() -> datetime.timedelta:
+    return datetime.timedelta(minutes=float(os.getenv("MASTODON_POSTING_WINDOW_MINUTES", str(DEFAULT_POSTING_WINDOW_MINUTES))))
+
+
+def status_count(votes: list[dict]) -> int:
+    # every vote is a status, and so is the thread of each result they're posted under
+    return len(votes) + len({vote["result"] for vote in votes})
+
+
+def vote_order(vote: dict) -> tuple:
+    return vote["date"], int(vote["vote_id"]) if vote["vote_id"].isdigit() else 0, vote["vote_id"]
+
+
+def recent_batches(checkpoint: dict | None, now: datetime.datetime) -> list[list]:
+    # [posted at, statuses] of the batches still inside the instance's window
+    batches = (checkpoint or {}).get("batches", [])
+    return [batch for batch in batches if now - datetime.datetime.fromisoformat(batch[0]) < posting_window()]
+
+
+def spent_budget(checkpoints: list[dict | None], now: datetime.datetime) -> int:
+    return sum(statuses for checkpoint in checkpoints for _, statuses in recent_batches(checkpoint, now))
+
+
+def select_batch(backlog: dict[str, list[dict]], budget: int) -> dict[str, list[dict]]:
+    # the oldest votes of every legislature first, as many as fit in the budget once the threads they start are counted.
+    # The batch stops at the first vote that doesn't fit, so the next run picks up right after it.
+    batch = {legislature: [] for legislature in backlog}
+    started_threads = set()
+    for legislature, vote in sorted(((legislature, vote) for legislature, votes in backlog.items() for vote in votes), key=lambda item: vote_order(item[1])):
+        cost = 1 if (legislature, vote["result"]) in started_threads else 2
+        if cost > budget:
+            break
+        budget -= cost
+        started_threads.add((legislature, vote["result"]))
+        batch[legislature].append(vote)
+    return batch
+
+
+def next_checkpoint(checkpoint: dict | None, remaining: int, statuses: int, now: datetime.datetime) -> dict | None:
+    # what's left of the backlog and the batches that still count against the posting budget, gone once it's drained
+    if remaining == 0:
+        return None
+    batches = recent_batches(checkpoint, now)
+    if statuses:
+        batches.append([now.isoformat(), statuses])
+    return {"remaining": remaining, "batches": batches}
+
+
+def estimate_backfill(new_vote_count: int, run_interval: datetime.timedelta, budget: int | None = None, threads_per_batch=2) -> tuple[int, datetime.timedelta]:
+    # the runs a backlog takes and how long until the last one starts, replaying the checkpoints the runs would leave.
+    # Only the vote ids are known before parsing, every batch is assumed to start an Aprovado and a Rejeitado thread.
+    budget = posting_budget() if budget is None else budget
+    if budget <= threads_per_batch or run_interval <= datetime.timedelta(0):
+        raise ValueError(f"a backfill needs a posting budget of more than {threads_per_batch} statuses and runs some time apart")
+
+    start = now = datetime.datetime.now(datetime.timezone.utc)
+    checkpoint = None
+    remaining = new_vote_count
+    runs = 0
+    while remaining:
+        batch = min(max(budget - spent_budget([checkpoint], now) - threads_per_batch, 0), remaining)
+        remaining -= batch
+        checkpoint = next_checkpoint(checkpoint, remaining, batch + threads_per_batch if batch else 0, now)
+        runs += 1
+        if remaining:
+            now += run_interval
+    return runs, now - start
+
+
+def describe_estimate(new_vote_count: int, runs: int, duration: datetime.timedelta) -> str:
+    minutes = duration.total_seconds() / 60
+    return f"a backfill of {new_vote_count} votes takes {runs} runs, the last one starting in {minutes:.0f} minutes ({minutes / 60:.1f} hours)"
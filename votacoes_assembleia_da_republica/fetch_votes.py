@@ -1,7 +1,20 @@
 import os
+import re
 import json
-import requests
-from bs4 import BeautifulSoup
+import html
+import shutil
+import textwrap
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Mapping
+
+from votacoes_assembleia_da_republica import metrics
+from votacoes_assembleia_da_republica.http_cache import cached_download
+from votacoes_assembleia_da_republica.json_stream import iter_json_array_file
+from votacoes_assembleia_da_republica.models import VOTE_DETAIL_KEYS, Initiative, Vote, intern
+
+if TYPE_CHECKING:
+    from votacoes_assembleia_da_republica.initiative_index import InitiativeIndex
+    from votacoes_assembleia_da_republica.state_storage import StateStorage
 
 # full list https://www.parlamento.pt/Cidadania/Paginas/DAIniciativas.aspx
 JSON_URIS = {
@@ -14,57 +27,88 @@ def debug_mode():
     return os.getenv("DEBUG_MODE", "false").lower() == "true"
 
 
-def fetch_votes_for_legislature(legislature):
-    raw_initiatives = fetch_initiatives_for_legislature(legislature)
+def debug_output_dir() -> str:
+    return os.getenv("DEBUG_OUTPUT_DIR", ".")
+
+
+def write_debug_copies(initiatives_path: str) -> None:
+    shutil.copyfile(initiatives_path, os.path.join(debug_output_dir(), "raw_initiatives.txt"))
+    with open(os.path.join(debug_output_dir(), "formatted_initiatives.json"), "w") as debug_file:
+        debug_file.write("[")
+        for i, initiative in enumerate(iter_json_array_file(initiatives_path)):
+            debug_file.write(",\n" if i else "\n")
+            debug_file.write(textwrap.indent(json.dumps(initiative, indent=4), 4 * " "))
+        debug_file.write("\n]")
+
+
+def fetch_votes_for_legislature(
+    legislature,
+    state: "StateStorage | None" = None,
+    initiatives_path: str | None = None,
+    index: "InitiativeIndex | None" = None,
+    is_posted_vote: Callable[[str], bool] | None = None,
+) -> Iterator[Vote]:
+    initiatives_path = initiatives_path or fetch_initiatives_for_legislature(legislature)
 
     if debug_mode():
-        with open("raw_initiatives.txt", "w") as debug_file:
-            debug_file.write(raw_initiatives.text)
-        with open("formatted_initiatives.json", "w") as debug_file:
-            json.dump(raw_initiatives.json(), debug_file, indent=4)
+        write_debug_copies(initiatives_path)
 
     print("parsing votes")
     # {'Requerimento de adiamento de Votação (Generalidade)', 'Requerimento', 'Requerimento de adiamento de Votação', 'Requerimento dispensa do prazo previsto Artº 157 RAR', 'Votação final global', 'Requerimento avocação plenário', 'Votação na especialidade', 'Votação Deliberação', 'Votação do recurso da decisão do PAR', 'Confirmação do decreto', 'Votação na generalidade', 'Requerimento Baixa Comissão sem Votação (Generalidade)', 'Votação do parecer recurso de admissibilidade', 'Votação novo decreto'}
 
-    return parse_initiatives(raw_initiatives.json())
+    if index is None:
+        raw_initiatives = iter_json_array_file(initiatives_path)
+    else:
+        # initiatives that are the same as in the last processed dump are not walked at all
+        raw_initiatives = index.changed_initiatives(iter_json_array_file(initiatives_path, with_text=True))
+
+    if state is None:
+        return parse_initiatives(raw_initiatives)
+
+    # votes that are already in the state are skipped before anything is built for them, unless they were posted and
+    # might have changed since
+    return parse_initiatives(raw_initiatives, is_new_vote=state.is_new_vote, vote_id_watermark=state.vote_id_watermark, is_posted_vote=is_posted_vote)
+
+
+def fetch_initiatives_for_legislature(legislature) -> str:
+    with metrics.span("download_initiatives", legislature=legislature):
+        return cached_download(JSON_URIS[legislature], f"Iniciativas{legislature}_json.txt")
 
 
-def fetch_initiatives_for_legislature(legislature):
-    return requests.get(JSON_URIS[legislature])
+HTML_TAG = re.compile(r"<[!/?a-zA-Z][^>]*>")
+VOTE_DETAIL_SECTIONS = {"in_favour": "A Favor", "against": "Contra", "abstained": "Abstenção", "absent": "Ausência"}
 
 
-def parse_vote(raw_vote) -> str | dict[str, list[str]]:
-    if raw_vote["vote_detail"] == "unanime":
+@lru_cache(maxsize=4096)
+def _parse_vote_detail_sections(vote_detail: str) -> dict[str, tuple[str, ...]]:
+    # e.g. "A Favor: <I>IL</I>, <I> BE</I><BR>Contra:<I>PSD</I><BR>Abstenção:<I>CH</I>"
+    sections = {}
+    for section in vote_detail.split("<BR>"):
+        name, parties = section.split(":")
+        parties = html.unescape(HTML_TAG.sub("", parties))
+        sections[name] = tuple(intern(party.strip()) for party in parties.strip().split(","))
+
+    return sections
+
+
+def _vote_detail_positions(vote_detail: str) -> tuple[tuple[str, ...], ...]:
+    # the same breakdown repeats across many votes, so the parsing is cached and votes only hold references to the parties
+    sections = _parse_vote_detail_sections(vote_detail)
+    return tuple(sections.get(VOTE_DETAIL_SECTIONS[key], ()) for key in VOTE_DETAIL_KEYS)
+
+
+def parse_vote(raw_vote: Mapping) -> Vote:
+    raw_vote = raw_vote if isinstance(raw_vote, Vote) else Vote.from_mapping(raw_vote)
+    if raw_vote.vote_detail == "unanime":
         vote_detail = "unanime"
-    elif raw_vote["result"] == "Prejudicado":
+    elif raw_vote.result == "Prejudicado":
         vote_detail = "prejudicado"
-    elif raw_vote["vote_detail"] is None:
+    elif raw_vote.vote_detail is None:
         vote_detail = "sem detalhes"
     else:
-        sections = dict(x.split(":") for x in raw_vote["vote_detail"].split("<BR>"))
-
-        for k, v in sections.items():
-            ctext = BeautifulSoup(v, "lxml")
-            sections[k] = list(map(lambda s: s.strip(), ctext.get_text().strip().split(",")))
-
-        vote_detail = {
-            "in_favour": sections.get("A Favor", []),
-            "against": sections.get("Contra", []),
-            "abstained": sections.get("Abstenção", []),
-            "absent": sections.get("Ausência", []),
-        }
-
-    return {
-        "vote_id": raw_vote["vote_id"],
-        "result": raw_vote["result"],
-        "vote_detail": vote_detail,
-        "date": raw_vote["date"],
-        "authors": raw_vote["authors"],
-        "initiative_type": raw_vote["initiative_type"],
-        "title": raw_vote["title"],
-        "phase": raw_vote["phase"],
-        "initiative_uri": raw_vote["initiative_uri"],
-    }
+        vote_detail = _vote_detail_positions(raw_vote.vote_detail)
+
+    return raw_vote.with_vote_detail(vote_detail)
 
 
 def list_wrap(raw) -> list:
@@ -79,27 +123,55 @@ def parse_authorship(initiative) -> list[str]:
     return [author["GP"] for author in authors]
 
 
-def parse_initiatives(raw_initiatives) -> list[dict]:
-    votes = []
+def raw_votes_of(events: list) -> Iterator[dict]:
+    for event in events:
+        if event["Votacao"]:
+            yield from list_wrap(event["Votacao"])
+
+
+def predates_watermark(events: list, vote_id_watermark: int) -> bool:
+    # vote ids are handed out sequentially, so an initiative whose votes are all at or below the watermark has nothing new
+    return all(raw_vote["id"].isdigit() and int(raw_vote["id"]) <= vote_id_watermark for raw_vote in raw_votes_of(events))
+
+
+def parse_initiatives(
+    raw_initiatives: Iterable[dict],
+    is_new_vote: Callable[[str], bool] | None = None,
+    vote_id_watermark: int | None = None,
+    is_posted_vote: Callable[[str], bool] | None = None,
+) -> Iterator[Vote]:
     for initiative in raw_initiatives:
-        for event in list_wrap(initiative["IniEventos"] or []):  # initiatives might not have events, or have one event as an object instead of a list
+        events = list_wrap(initiative["IniEventos"] or [])  # initiatives might not have events, or have one event as an object instead of a list
+        if vote_id_watermark is not None and predates_watermark(events, vote_id_watermark):
+            if is_posted_vote is None or not any(is_posted_vote(raw_vote["id"]) for raw_vote in raw_votes_of(events)):
+                continue
+
+        # every vote of the initiative shares one record of it
+        shared_initiative = None
+        for event in events:
             if event["Votacao"]:
                 for raw_vote in list_wrap(event["Votacao"]):
+                    if is_new_vote is not None and not is_new_vote(raw_vote["id"]):
+                        if is_posted_vote is None or not is_posted_vote(raw_vote["id"]):
+                            continue
+
                     try:
-                        vote = {
-                            "vote_id": raw_vote["id"],
-                            "initiative_type": initiative["IniDescTipo"],
-                            "initiative_type_code": initiative["IniTipo"],
-                            "title": initiative["IniTitulo"],
-                            "initiative_uri": initiative["IniLinkTexto"],
-                            "authors": parse_authorship(initiative),
-                            "phase": event["Fase"],
-                            "date": raw_vote["data"],
-                            "result": raw_vote["resultado"],
-                            "vote_detail": raw_vote["detalhe"] or raw_vote.get("unanime"),
-                        }
-
-                        votes.append(vote)
+                        if shared_initiative is None:
+                            shared_initiative = Initiative(
+                                initiative["IniDescTipo"],
+                                initiative["IniTipo"],
+                                initiative["IniTitulo"],
+                                initiative["IniLinkTexto"],
+                                parse_authorship(initiative),
+                            )
+                        vote = Vote(
+                            raw_vote["id"],
+                            raw_vote["resultado"],
+                            raw_vote["detalhe"] or raw_vote.get("unanime"),
+                            raw_vote["data"],
+                            event["Fase"],
+                            shared_initiative,
+                        )
                     except Exception as e:
                         import pprint
 
@@ -108,4 +180,4 @@ def parse_initiatives(raw_initiatives) -> list[dict]:
                         raise e
                         exit()
 
-    return votes
+                    yield vote
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+from votacoes_assembleia_da_republica.http_session import session
+
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = (10, 120)  # (connect, read) seconds
+
+
+def cache_dir() -> str:
+    return os.getenv("HTTP_CACHE_DIR", ".cache/http")
+
+
+def _read_metadata(metadata_path: str) -> dict:
+    try:
+        with open(metadata_path, "r") as metadata_file:
+            return json.load(metadata_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_metadata(metadata_path: str, metadata: dict) -> None:
+    with open(metadata_path, "w") as metadata_file:
+        json.dump(metadata, metadata_file)
+
+
+def _fingerprint(size: int, hasher) -> str:
+    return f"{size}:{hasher.hexdigest()}"
+
+
+def file_fingerprint(path: str) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    size = 0
+    with open(path, "rb") as body_file:
+        while chunk := body_file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+            size += len(chunk)
+    return _fingerprint(size, hasher)
+
+
+def dump_fingerprint(body_path: str) -> str:
+    # size and hash of the body, computed while it was downloaded. Bodies cached before fingerprints existed are hashed once.
+    metadata_path = f"{body_path}.meta.json"
+    metadata = _read_metadata(metadata_path)
+    if not metadata.get("fingerprint"):
+        metadata["fingerprint"] = file_fingerprint(body_path)
+        _write_metadata(metadata_path, metadata)
+    return metadata["fingerprint"]
+
+
+def conditional_headers(metadata: dict) -> dict:
+    headers = {"Accept-Encoding": "gzip"}
+    if metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+    return headers
+
+
+def cached_download(url: str, name: str) -> str:
+    os.makedirs(cache_dir(), exist_ok=True)
+    body_path = os.path.join(cache_dir(), name)
+    metadata_path = f"{body_path}.meta.json"
+    metadata = _read_metadata(metadata_path) if os.path.exists(body_path) else {}
+
+    with session().get(url, headers=conditional_headers(metadata), stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 304:
+            print(f"{name} not modified, using cached copy")
+            return body_path
+
+        response.raise_for_status()
+
+        # write to a temporary file first so an interrupted download never replaces a good cached copy
+        partial_path = f"{body_path}.part"
+        hasher = hashlib.blake2b(digest_size=16)
+        size = 0
+        with open(partial_path, "wb") as body_file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                body_file.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+        os.replace(partial_path, body_path)
+
+        _write_metadata(
+            metadata_path,
+            {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"), "fingerprint": _fingerprint(size, hasher)},
+        )
+
+    return body_path
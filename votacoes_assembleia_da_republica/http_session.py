@@ -0,0 +1,98 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+POOL_CONNECTIONS = 4  # parlamento.pt, api.github.com and the Mastodon instance
+POOL_MAXSIZE = 16
+
+TIMEOUT = (5, 30)  # (connect, read) seconds
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1
+MAX_DELAY_SECONDS = 120
+
+_session = None
+_session_lock = threading.Lock()
+_rate_limit_resets = {}
+
+
+def session() -> requests.Session:
+    # one pooled keep-alive session shared by every client and thread in the process
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def backoff_delay(attempt: int) -> float:
+    return BACKOFF_SECONDS * 2**attempt
+
+
+def rate_limit_delay(response: requests.Response) -> float | None:
+    if "Retry-After" in response.headers:
+        try:
+            return max(float(response.headers["Retry-After"]), 0)
+        except ValueError:
+            return None
+    if response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+        return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+    return None
+
+
+def retry_delay(response: requests.Response, attempt: int) -> float | None:
+    if response.status_code >= 500:
+        return rate_limit_delay(response) or backoff_delay(attempt)
+
+    if response.status_code in (403, 429):
+        delay = rate_limit_delay(response)
+        if delay is not None:
+            return delay
+        # GitHub's secondary rate limits don't always come with headers, see
+        # https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api#exceeding-the-rate-limit
+        if response.status_code == 429 or "secondary rate limit" in response.text.lower():
+            return max(backoff_delay(attempt), 60)
+
+    return None
+
+
+def wait_for_rate_limit(host: str) -> None:
+    reset = _rate_limit_resets.get(host)
+    if reset is not None and reset > time.time():
+        delay = min(reset - time.time(), MAX_DELAY_SECONDS)
+        print(f"rate limit for {host} exhausted, waiting {delay:.0f}s")
+        time.sleep(delay)
+
+
+def record_rate_limit(host: str, response: requests.Response) -> None:
+    if response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+        _rate_limit_resets[host] = float(response.headers["X-RateLimit-Reset"])
+    else:
+        _rate_limit_resets.pop(host, None)
+
+
+def request(method: str, url: str, timeout=TIMEOUT, max_retries=MAX_RETRIES, **kwargs) -> requests.Response:
+    # retries connection errors, 5xx and rate limited responses with bounded exponential backoff, honoring
+    # Retry-After and X-RateLimit-Reset. Other responses, including errors, are returned as they are.
+    host = urlsplit(url).hostname
+    for attempt in range(max_retries + 1):
+        wait_for_rate_limit(host)
+        try:
+            response = session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{method} {url} failed ({e}), retrying in {delay:.0f}s")
+        else:
+            record_rate_limit(host, response)
+            delay = retry_delay(response, attempt)
+            if delay is None or delay > MAX_DELAY_SECONDS or attempt == max_retries:
+                return response
+            print(f"{method} {url} returned {response.status_code}, retrying in {delay:.0f}s")
+
+        time.sleep(delay)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+from typing import Iterable, Iterator
+
+from votacoes_assembleia_da_republica.fetch_votes import list_wrap, raw_votes_of
+
+DIGEST_SIZE = 8
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def initiative_key(initiative: dict) -> str:
+    return initiative.get("IniId") or initiative["IniNr"]
+
+
+def vote_digest(raw_vote: dict) -> str:
+    return _digest(f"{raw_vote['resultado']}\0{raw_vote['detalhe'] or raw_vote.get('unanime') or ''}")
+
+
+class InitiativeIndex:
+    # hash of every initiative of the last processed dump, keyed by IniId (IniNr when there is no id), plus a hash of
+    # the result and detail of every vote seen. Initiatives whose JSON is byte for byte the same as last time are not
+    # walked again, and votes whose result or detail changed since they were seen are reported in changed_votes.
+    # dump_fingerprint is the processed dump of the state it was built against, see load_initiative_index.
+
+    def __init__(self, path: str, initiatives: dict[str, str] | None = None, votes: dict[str, str] | None = None, dump_fingerprint: str | None = None):
+        self.path = path
+        self.initiatives = initiatives or {}
+        self.votes = votes or {}
+        self.dump_fingerprint = dump_fingerprint
+        self.changed_votes = []
+        self._next_initiatives = None
+
+    @classmethod
+    def load(cls, path: str) -> "InitiativeIndex":
+        try:
+            with open(path, "r") as index_file:
+                index = json.load(index_file)
+            return cls(path, index["initiatives"], index["votes"], index.get("dump_fingerprint"))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return cls(path)
+
+    def save(self) -> None:
+        if self._next_initiatives is not None:
+            self.initiatives = self._next_initiatives
+            self._next_initiatives = None
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "w") as index_file:
+            json.dump({"initiatives": self.initiatives, "votes": self.votes, "dump_fingerprint": self.dump_fingerprint}, index_file)
+        os.replace(partial_path, self.path)
+
+    def changed_initiatives(self, initiatives_with_text: Iterable[tuple[dict, str]]) -> Iterator[dict]:
+        # the index is only updated in memory, save() once the votes of the changed initiatives were handled
+        seen_initiatives = {}
+        self.changed_votes = []
+        for initiative, text in initiatives_with_text:
+            key = initiative_key(initiative)
+            digest = _digest(text)
+            seen_initiatives[key] = digest
+            if self.initiatives.get(key) == digest:
+                continue
+
+            for raw_vote in raw_votes_of(list_wrap(initiative["IniEventos"] or [])):
+                previous = self.votes.get(raw_vote["id"])
+                self.votes[raw_vote["id"]] = vote_digest(raw_vote)
+                if previous is not None and previous != self.votes[raw_vote["id"]]:
+                    self.changed_votes.append(raw_vote["id"])
+            yield initiative
+
+        # initiatives that are gone from the dump are dropped, but only once the whole dump was walked
+        self._next_initiatives = seen_initiatives
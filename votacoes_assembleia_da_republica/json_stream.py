@@ -0,0 +1,72 @@
+import json
+from typing import Iterator, TextIO
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]"
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(json_file: TextIO, chunk_size: int = CHUNK_SIZE, with_text: bool = False) -> Iterator:
+    # yields the elements of a top-level JSON array one at a time, only keeping the element being decoded in memory.
+    # with_text yields (element, the element's JSON text) instead
+    buffer = ""
+    position = 0
+    eof = False
+    expecting_start = True
+
+    def read_more() -> bool:
+        nonlocal buffer, position, eof
+        chunk = json_file.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if eof or not read_more():
+                raise ValueError("unexpected end of JSON array")
+            continue
+
+        if expecting_start:
+            if buffer[position] != "[":
+                raise ValueError("expected a JSON array")
+            position += 1
+            expecting_start = False
+            continue
+
+        if buffer[position] == "]":
+            return
+        if buffer[position] == ",":
+            position += 1
+            continue
+
+        try:
+            element, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof or not read_more():
+                raise
+            continue
+
+        # a number might have been cut short by the chunk boundary, only trust it once it is followed by a delimiter
+        if end == len(buffer) or buffer[end] not in DELIMITERS:
+            if not eof and read_more():
+                continue
+            if end != len(buffer):
+                raise ValueError("unexpected data after JSON array element")
+
+        if with_text:
+            element = (element, buffer[position:end])
+        position = end
+        yield element
+
+
+def iter_json_array_file(path: str, chunk_size: int = CHUNK_SIZE, with_text: bool = False) -> Iterator:
+    with open(path, "r", encoding="utf-8-sig") as json_file:
+        yield from iter_json_array(json_file, chunk_size, with_text)
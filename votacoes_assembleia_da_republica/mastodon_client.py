@@ -1,11 +1,77 @@
 import os
-from mastodon import Mastodon
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+from mastodon import Mastodon, MastodonError, MastodonNotFoundError, MastodonRatelimitError
+
+from votacoes_assembleia_da_republica.http_session import session
+
+MAX_RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_FALLBACK_SECONDS = 60
+
+
+class RateLimitBudget:
+    # token bucket refilled from the instance's X-RateLimit-Remaining/X-RateLimit-Reset headers: once the remaining
+    # budget is spent every caller waits for the reset instead of running into 429s
+    def __init__(self, sleep=time.sleep, clock=time.time):
+        self.remaining = None
+        self.reset = None
+        self.lock = threading.Lock()
+        self.sleep = sleep
+        self.clock = clock
+
+    def acquire(self) -> None:
+        with self.lock:
+            if self.remaining is not None and self.remaining <= 0:
+                delay = (self.reset or 0) - self.clock()
+                if delay > 0:
+                    print(f"posting budget exhausted, waiting {delay:.0f}s for the rate limit to reset")
+                    self.sleep(delay)
+                self.remaining = None
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def update(self, remaining: int | None, reset: float | None) -> None:
+        with self.lock:
+            self.remaining = remaining
+            self.reset = reset
+
+
+@dataclass
+class VoteThread:
+    rendered_thread: str
+    idempotency_key: str
+    rendered_votes: list[tuple[str, str]] = field(default_factory=list)  # (vote_id, rendered vote)
+    post: dict | None = None  # the thread's first status, once posted
 
 
 class MastodonClient:
-    def __init__(self) -> None:
+    def __init__(self, account_id: str | None = None, name: str = "mastodon") -> None:
+        # mirrors are named, and read their own instance and token from the environment
+        self.name = name
+        self.budget = RateLimitBudget()
+        # cached in the state, saves a round trip to look it up on every run
+        self.account_id = account_id
         if not self.debug_mode:
-            self.client = Mastodon(access_token=self.access_token, api_base_url=self.api_base_url)
+            self.client = Mastodon(access_token=self.access_token, api_base_url=self.api_base_url, session=session(), ratelimit_method="throw")
+
+    def _call(self, method, *args, **kwargs):
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            self.budget.acquire()
+            try:
+                result = method(*args, **kwargs)
+            except MastodonRatelimitError:
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                # the budget was spent by someone else, e.g. another client on the same account
+                reset = self.client.ratelimit_reset
+                self.budget.update(0, reset if reset > time.time() else time.time() + RATE_LIMIT_FALLBACK_SECONDS)
+                continue
+
+            self.budget.update(self.client.ratelimit_remaining, self.client.ratelimit_reset)
+            return result
 
     def start_vote_thread(self, rendered_thread: str, idempotency_key=None) -> dict:
         if self.debug_mode:
@@ -14,13 +80,14 @@ class MastodonClient:
             print("--------------------")
             return
 
-        return self.client.status_post(rendered_thread, idempotency_key=idempotency_key, language="pt")
+        return self._call(self.client.status_post, rendered_thread, idempotency_key=idempotency_key, language="pt")
 
     def latest_post_id(self) -> str | None:
         if self.debug_mode:
             return "debug_mode"
-        me = self.client.me()
-        statuses = self.client.account_statuses(me["id"], limit=1)
+        if self.account_id is None:
+            self.account_id = str(self.client.me()["id"])
+        statuses = self.client.account_statuses(self.account_id, limit=1)
         if not statuses:
             return None
         return str(statuses[0]["id"])
@@ -32,15 +99,70 @@ class MastodonClient:
             print("--------------------")
             return
 
-        return self.client.status_post(rendered_vote, in_reply_to_id=reply_to.id, visibility="unlisted", idempotency_key=idempotency_key, language="pt")
+        return self._call(
+            self.client.status_post, rendered_vote, in_reply_to_id=reply_to.id, visibility="unlisted", idempotency_key=idempotency_key, language="pt"
+        )
+
+    def edit_status(self, status_id: int, rendered_status: str) -> dict:
+        if self.debug_mode:
+            print(f"would edit status {status_id}:")
+            print(rendered_status)
+            print("--------------------")
+            return
+
+        return self._call(self.client.status_update, status_id, status=rendered_status)
+
+    def delete_status(self, status_id: int) -> bool:
+        # paced by the same budget as posting, deletes have a much smaller one (30 every 30 minutes on most instances)
+        if self.debug_mode:
+            print(f"would delete status {status_id}")
+            return True
+        try:
+            self._call(self.client.status_delete, status_id)
+        except MastodonNotFoundError:
+            return False
+        return True
+
+    def post_vote_threads(
+        self, vote_threads: list[VoteThread], on_posted: Callable[[str, dict | None], None], on_error: Callable[[str, MastodonError], None]
+    ) -> None:
+        # threads are independent of each other and get posted concurrently, the replies inside a thread stay in order.
+        # The callbacks are serialized so callers don't need to be thread safe.
+        callback_lock = threading.Lock()
+
+        def post_thread(vote_thread: VoteThread) -> None:
+            result_thread = vote_thread.post = self.start_vote_thread(vote_thread.rendered_thread, idempotency_key=vote_thread.idempotency_key)
+            for vote_id, rendered_vote in vote_thread.rendered_votes:
+                try:
+                    post = self.post_vote(rendered_vote, reply_to=result_thread, idempotency_key=vote_id)
+                except MastodonError as e:
+                    with callback_lock:
+                        on_error(vote_id, e)
+                else:
+                    with callback_lock:
+                        on_posted(vote_id, post)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.posting_concurrency, len(vote_threads)))) as pool:
+            futures = [pool.submit(post_thread, vote_thread) for vote_thread in vote_threads]
+
+        for future in futures:
+            future.result()
+
+    @property
+    def env_suffix(self):
+        return "" if self.name == "mastodon" else f"_{self.name.upper()}"
 
     @property
     def api_base_url(self):
-        return os.getenv("MASTODON_API_BASE_URL", "https://masto.pt")
+        return os.getenv(f"MASTODON_API_BASE_URL{self.env_suffix}", "https://masto.pt")
 
     @property
     def access_token(self):
-        return os.getenv("MASTODON_ACCESS_TOKEN")
+        return os.getenv(f"MASTODON_ACCESS_TOKEN{self.env_suffix}")
+
+    @property
+    def posting_concurrency(self):
+        return int(os.getenv("MASTODON_POSTING_CONCURRENCY", "4"))
 
     @property
     def debug_mode(self):
@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+
+from votacoes_assembleia_da_republica.http_session import session
+
+_metrics = None
+_disabled_span = nullcontext()
+
+
+class Metrics:
+    # timed spans around the stages of a run plus one entry per HTTP response of the shared session
+    def __init__(self):
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # start is relative to when metrics were enabled
+            entry = {"name": name, **labels, "thread": threading.current_thread().name}
+            entry.update(start=round(start - self.origin, 6), seconds=round(time.perf_counter() - start, 6), error=error)
+            with self.lock:
+                self.spans.append(entry)
+
+    def record_response(self, response, *args, **kwargs):
+        url = urlsplit(response.request.url)
+        content_length = response.headers.get("Content-Length")
+        entry = {
+            "method": response.request.method,
+            "host": url.hostname,
+            "path": url.path,
+            "status": response.status_code,
+            # time until the response headers were parsed, streamed bodies are timed by the span around them
+            "seconds": round(response.elapsed.total_seconds(), 6),
+            "bytes": int(content_length) if content_length and content_length.isdigit() else None,
+        }
+        with self.lock:
+            self.requests.append(entry)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "seconds": round(time.time() - self.started_at, 6),
+                "spans": list(self.spans),
+                "requests": list(self.requests),
+            }
+
+
+def enable() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+        session().hooks["response"].append(_metrics.record_response)
+    return _metrics
+
+
+def disable() -> None:
+    global _metrics
+    if _metrics is not None:
+        session().hooks["response"].remove(_metrics.record_response)
+        _metrics = None
+
+
+def span(name: str, **labels):
+    # a shared no-op context manager when metrics are disabled, so spans cost next to nothing in normal runs
+    if _metrics is None:
+        return _disabled_span
+    return _metrics.span(name, **labels)
+
+
+def write(path: str) -> None:
+    if _metrics is None:
+        return
+    with open(path, "w") as metrics_file:
+        json.dump(_metrics.to_dict(), metrics_file, indent=2)
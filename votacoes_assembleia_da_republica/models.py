@@ -0,0 +1,87 @@
+import sys
+from collections.abc import Mapping
+from typing import Iterator
+
+# position keys of a parsed vote detail, in the order they are kept in Vote.vote_detail
+VOTE_DETAIL_KEYS = ("in_favour", "against", "abstained", "absent")
+
+
+def intern(value: str | None) -> str | None:
+    # results, phases, types, dates and party names repeat across thousands of votes, one copy of each is enough
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Initiative:
+    __slots__ = ("type", "type_code", "title", "uri", "authors")
+
+    def __init__(self, type: str, type_code: str, title: str, uri: str, authors: list[str]):
+        self.type = intern(type)
+        self.type_code = intern(type_code)
+        self.title = title
+        self.uri = uri
+        self.authors = tuple([intern(author) for author in authors])
+
+    def __repr__(self) -> str:
+        return f"Initiative({self.type!r}, {self.title!r})"
+
+
+class Vote(Mapping):
+    # one vote of an initiative, sharing the initiative's title, uri, type and authors with its other votes instead of
+    # copying them. vote_detail is the raw detalhe as found in the dump, one of "unanime", "prejudicado" or
+    # "sem detalhes", or once parsed a tuple of party tuples in VOTE_DETAIL_KEYS order.
+    #
+    # It reads like the dicts votes used to be, vote["title"], dict(vote) and comparing with a dict all work.
+
+    __slots__ = ("vote_id", "result", "vote_detail", "date", "phase", "initiative")
+
+    def __init__(self, vote_id: str, result: str, vote_detail, date: str, phase: str, initiative: Initiative):
+        self.vote_id = vote_id
+        self.result = intern(result)
+        self.vote_detail = vote_detail
+        self.date = intern(date)
+        self.phase = intern(phase)
+        self.initiative = initiative
+
+    @classmethod
+    def from_mapping(cls, vote: Mapping) -> "Vote":
+        initiative = Initiative(vote["initiative_type"], vote.get("initiative_type_code"), vote["title"], vote["initiative_uri"], vote["authors"])
+        vote_detail = vote["vote_detail"]
+        if isinstance(vote_detail, Mapping):
+            vote_detail = tuple(tuple(intern(party) for party in vote_detail[key]) for key in VOTE_DETAIL_KEYS)
+        return cls(vote["vote_id"], vote["result"], vote_detail, vote["date"], vote["phase"], initiative)
+
+    def with_vote_detail(self, vote_detail) -> "Vote":
+        return Vote(self.vote_id, self.result, vote_detail, self.date, self.phase, self.initiative)
+
+    def _vote_detail(self):
+        if isinstance(self.vote_detail, tuple):
+            return {key: list(parties) for key, parties in zip(VOTE_DETAIL_KEYS, self.vote_detail)}
+        return self.vote_detail
+
+    _FIELDS = {
+        "vote_id": lambda vote: vote.vote_id,
+        "result": lambda vote: vote.result,
+        "vote_detail": _vote_detail,
+        "date": lambda vote: vote.date,
+        "authors": lambda vote: list(vote.initiative.authors),
+        "initiative_type": lambda vote: vote.initiative.type,
+        "title": lambda vote: vote.initiative.title,
+        "phase": lambda vote: vote.phase,
+        "initiative_uri": lambda vote: vote.initiative.uri,
+    }
+
+    def __getitem__(self, key: str):
+        try:
+            field = Vote._FIELDS[key]
+        except (KeyError, TypeError):
+            raise KeyError(key) from None
+        return field(self)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(Vote._FIELDS)
+
+    def __len__(self) -> int:
+        return len(Vote._FIELDS)
+
+    def __repr__(self) -> str:
+        return f"Vote({dict(self)!r})"
@@ -0,0 +1,93 @@
+import argparse
+import datetime
+from collections.abc import Collection, Mapping
+from typing import TYPE_CHECKING
+
+from votacoes_assembleia_da_republica.fetch_votes import JSON_URIS
+
+if TYPE_CHECKING:
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+    from votacoes_assembleia_da_republica.state_storage import StateStorage
+
+
+def status_datetime(status_id: int) -> datetime.datetime:
+    # Mastodon ids are snowflakes, the milliseconds since the epoch shifted 16 bits to the left
+    return datetime.datetime.fromtimestamp((status_id >> 16) / 1000, tz=datetime.timezone.utc)
+
+
+def select_statuses(
+    posts: Mapping[str, tuple[int | None, int | None, int | None]],
+    vote_ids: Collection[str] | None = None,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+) -> tuple[list[str], list[int]]:
+    # the votes matching every given filter and the ids of their statuses, newest first, followed by the threads that
+    # have no votes left once those are gone
+    selected_vote_ids = []
+    status_ids = []
+    for vote_id, (status_id, thread_id, _) in posts.items():
+        if vote_ids is not None and vote_id not in vote_ids:
+            continue
+        if status_id is None and thread_id is None:
+            # nothing was posted for it, e.g. by a debug run
+            continue
+        posted_at = status_datetime(status_id or thread_id)
+        if (since is not None and posted_at < since) or (until is not None and posted_at > until):
+            continue
+        selected_vote_ids.append(vote_id)
+        if status_id is not None:
+            status_ids.append(status_id)
+
+    selected = set(selected_vote_ids)
+    kept_threads = {thread_id for vote_id, (_, thread_id, _) in posts.items() if vote_id not in selected}
+    thread_ids = {posts[vote_id][1] for vote_id in selected_vote_ids} - kept_threads - {None}
+    return selected_vote_ids, sorted(status_ids, reverse=True) + sorted(thread_ids, reverse=True)
+
+
+def delete_statuses(m: "MastodonClient", state: "StateStorage", vote_ids: list[str], status_ids: list[int], forget_votes=False) -> int:
+    # pacing is left to the client's rate limit budget, which follows the instance's X-RateLimit headers
+    deleted = 0
+    for status_id in status_ids:
+        if m.delete_status(status_id):
+            deleted += 1
+            print(f"deleted {status_id}")
+        else:
+            print(f"{status_id} was already deleted")
+
+    for vote_id in vote_ids:
+        state.forget_post(vote_id, forget_vote=forget_votes)
+
+    # the stored last post id may have been one of them, the next run checks the state against the account's latest post
+    if deleted:
+        latest_post_id = m.latest_post_id()
+        if latest_post_id not in (None, "debug_mode"):
+            state.set_last_post_id(latest_post_id)
+    return deleted
+
+
+def selection_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("since_minutes_ago", nargs="?", type=int, help="Only statuses posted in the last N minutes")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="Only statuses posted at or after this ISO date")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="Only statuses posted at or before this ISO date")
+    parser.add_argument("--vote-ids", nargs="+", help="Only the statuses of these votes")
+    parser.add_argument("--legislatures", nargs="+", choices=list(JSON_URIS), help="Only the statuses of these legislatures")
+    parser.add_argument("--github-state", action="store_true", help="Read the posted status ids from GitHub variables instead of the local state")
+    return parser
+
+
+def parse_selection(parser: argparse.ArgumentParser) -> tuple[argparse.Namespace, dict]:
+    args = parser.parse_args()
+    if args.since_minutes_ago is None and args.since is None and args.until is None and args.vote_ids is None and args.legislatures is None:
+        parser.error("select the statuses by time, vote ids or legislatures")
+    args.legislatures = args.legislatures or list(JSON_URIS)
+
+    since = args.since
+    if args.since_minutes_ago is not None:
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=args.since_minutes_ago)
+    selection = {
+        "vote_ids": None if args.vote_ids is None else set(args.vote_ids),
+        "since": since if since is None or since.tzinfo else since.replace(tzinfo=datetime.timezone.utc),
+        "until": args.until if args.until is None or args.until.tzinfo else args.until.replace(tzinfo=datetime.timezone.utc),
+    }
+    return args, selection
@@ -0,0 +1,89 @@
+import datetime
+import json
+import re
+import threading
+from typing import TYPE_CHECKING, Callable, Protocol
+
+if TYPE_CHECKING:
+    from votacoes_assembleia_da_republica.mastodon_client import VoteThread
+
+PRIMARY = "mastodon"
+TARGET_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+class Publisher(Protocol):
+    # somewhere the rendered threads and votes get posted to. The primary account is the MastodonClient named
+    # "mastodon", every other publisher is a mirror with its own state, rate limits and failures.
+    name: str
+
+    def post_vote_threads(
+        self, vote_threads: list["VoteThread"], on_posted: Callable[[str, dict | None], None], on_error: Callable[[str, Exception], None]
+    ) -> None: ...
+
+
+class JsonlPublisher:
+    # appends every status as one JSON line instead of posting it, a local mirror of the account that is easy to diff
+    # or replay. Idempotency keys already in the file are not written again.
+
+    def __init__(self, path: str, name: str = "jsonl"):
+        self.name = name
+        self.path = path
+        self.lock = threading.Lock()
+        self.posted = {}
+        try:
+            with open(path, "r") as jsonl_file:
+                for line in jsonl_file:
+                    if line.strip():
+                        status = json.loads(line)
+                        self.posted[status["idempotency_key"]] = status
+        except FileNotFoundError:
+            pass
+
+    def post(self, rendered_status: str, idempotency_key: str, in_reply_to_id: str | None = None) -> dict:
+        with self.lock:
+            if idempotency_key in self.posted:
+                return self.posted[idempotency_key]
+
+            status = {
+                "id": str(len(self.posted) + 1),
+                "idempotency_key": idempotency_key,
+                "in_reply_to_id": in_reply_to_id,
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "status": rendered_status,
+            }
+            with open(self.path, "a") as jsonl_file:
+                jsonl_file.write(json.dumps(status, ensure_ascii=False) + "\n")
+            self.posted[idempotency_key] = status
+            return status
+
+    def post_vote_threads(
+        self, vote_threads: list["VoteThread"], on_posted: Callable[[str, dict | None], None], on_error: Callable[[str, Exception], None]
+    ) -> None:
+        for vote_thread in vote_threads:
+            vote_thread.post = self.post(vote_thread.rendered_thread, vote_thread.idempotency_key)
+            for vote_id, rendered_vote in vote_thread.rendered_votes:
+                try:
+                    post = self.post(rendered_vote, vote_id, vote_thread.post["id"])
+                except OSError as e:
+                    on_error(vote_id, e)
+                else:
+                    on_posted(vote_id, post)
+
+
+def publisher_from_spec(spec: str) -> Publisher:
+    # [name=]jsonl:PATH or [name=]mastodon, a mastodon mirror reads MASTODON_API_BASE_URL_<NAME> and MASTODON_ACCESS_TOKEN_<NAME>
+    name, _, target = spec.rpartition("=")
+    kind, _, argument = target.partition(":")
+    name = name or kind
+    if not TARGET_NAME.match(name):
+        raise ValueError(f"invalid publisher name {name!r}, use lowercase letters, digits and underscores")
+    if name == PRIMARY:
+        raise ValueError(f"{PRIMARY!r} is the primary account, name the mirror with name={target}")
+
+    if kind == "jsonl" and argument:
+        return JsonlPublisher(argument, name=name)
+    if kind == "mastodon":
+        from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+
+        return MastodonClient(name=name)
+    raise ValueError(f"unknown publisher {spec!r}, expected [name=]jsonl:PATH or name=mastodon")
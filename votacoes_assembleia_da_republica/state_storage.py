@@ -2,18 +2,71 @@ import base64
 import gzip
 import json
 import os
-import requests
+import threading
+from functools import cached_property
+from collections.abc import Mapping
+from typing import Callable, Iterable
+
+from votacoes_assembleia_da_republica import metrics
+from votacoes_assembleia_da_republica.http_session import request
+from votacoes_assembleia_da_republica.vote_states import (
+    FORMAT_PREFIX,
+    POST_IDS_FORMAT_PREFIXES,
+    PostIds,
+    ShardedPostIds,
+    ShardedVoteStates,
+    VoteStates,
+    decode_post_ids,
+    decode_vote_states,
+    encode_post_ids,
+    encode_vote_states,
+)
 
 
 def _compress_state(state: dict) -> str:
-    return base64.b64encode(gzip.compress(json.dumps(state).encode())).decode()
+    vote_states = state if isinstance(state, VoteStates) else VoteStates(state)
+    if vote_states.is_compact():
+        return encode_vote_states(vote_states)
+
+    # ids or statuses the compact format can't represent fall back to gzipped JSON
+    return base64.b64encode(gzip.compress(json.dumps(dict(state)).encode())).decode()
+
 
+def _decompress_state(value: str) -> VoteStates:
+    if value.startswith(FORMAT_PREFIX):
+        return decode_vote_states(value)
 
-def _decompress_state(value: str) -> dict:
     try:
-        return json.loads(gzip.decompress(base64.b64decode(value, validate=True)))
+        return VoteStates(json.loads(gzip.decompress(base64.b64decode(value, validate=True))))
     except Exception:
-        return json.loads(value)
+        return VoteStates(json.loads(value))
+
+
+def _compress_post_ids(post_ids: PostIds) -> str:
+    if post_ids.is_compact():
+        return encode_post_ids(post_ids)
+    return base64.b64encode(gzip.compress(json.dumps(post_ids).encode())).decode()
+
+
+def _decompress_post_ids(value: str) -> PostIds:
+    if value.startswith(POST_IDS_FORMAT_PREFIXES):
+        return decode_post_ids(value)
+    return PostIds({vote_id: tuple(post) for vote_id, post in json.loads(gzip.decompress(base64.b64decode(value))).items()})
+
+
+def _encode_manifest(shards: Iterable[str], metadata: dict | None = None) -> str:
+    return json.dumps({"shards": sorted(shards), **(metadata or {})})
+
+
+def _decode_manifest(value: str) -> dict | None:
+    # STATE_<legislature> used to hold the whole state, it now lists the shards the state is split into
+    try:
+        manifest = json.loads(value)
+    except ValueError:
+        return None
+    if isinstance(manifest, dict) and isinstance(manifest.get("shards"), list):
+        return manifest
+    return None
 
 
 class StateStorage:
@@ -22,46 +75,287 @@ class StateStorage:
         self.file_path = file_path
         self.use_github = use_github
         self.last_post_id = None
+        self.vote_id_watermark = None
+        self.manifest_exists = False
+        self.manifest_changed = False
+        # fingerprint of the last dump whose votes were all handled, and of the one fetched in this run
+        self.dump_fingerprint = None
+        self.fetched_dump_fingerprint = None
+        self.fetched_initiative_index = None
+        self.account_id = None
+        # what's left of a backlog posted in batches over several runs, see backfill.py
+        self.backfill = None
+        self.backfilling = False
+        # votes were forgotten since the last processed dump, so they are looked for in every initiative again
+        self.votes_forgotten = False
+        self.posts = ShardedPostIds()
+        # (vote_id, rendered vote) of the posted votes whose toot changed, found while collecting the new votes
+        self.changed_votes = []
+        # vote states of every mirror the votes are also published to, by publisher name
+        self.target_states = {}
+        self.known_targets = set()
+        self.dirty_targets = set()
+        self.journal = None
+        self.journal_lock = threading.Lock()
 
     def __enter__(self):
-        if self.use_github:
-            self.state = self.read_repo_variable(self.legislature)
-        else:
-            try:
-                with open(self.file_path, "r") as state_file:
-                    self.state = json.load(state_file)
-            except FileNotFoundError:
-                self.state = {}
+        with metrics.span("load_state", legislature=self.legislature):
+            if self.use_github:
+                self.state = self.read_sharded_state()
+            else:
+                self.posts = self.read_local_posts()
+                self.target_states = self.read_local_target_states()
+                self.known_targets = set(self.target_states)
+                try:
+                    with open(self.file_path, "r") as state_file:
+                        self.state = ShardedVoteStates.from_vote_states(json.load(state_file))
+                except FileNotFoundError:
+                    self.state = ShardedVoteStates()
+                local_metadata = self.read_local_metadata()
+                self.dump_fingerprint = local_metadata.get("dump_fingerprint")
+                self.account_id = local_metadata.get("account_id")
+                self.backfill = local_metadata.get("backfill")
+                self.votes_forgotten = local_metadata.get("votes_forgotten", False)
+
+            # changes made by a run that died before saving them
+            self.replay_journal()
+            # a backfill posts the oldest votes first, not in id order, and forgotten votes are below the highest id, so
+            # until they are posted every initiative is walked
+            self.vote_id_watermark = self.state.max_vote_id() if self.backfill is None and not self.votes_forgotten else None
 
         return self
 
     def __exit__(self, *args):
-        with open(self.file_path, "w") as state_file:
-            json.dump(self.state, state_file)
+        self.save()
+
+    def has_unsaved_changes(self) -> bool:
+        # every vote change is journaled, and everything else kept in the manifest marks it changed
+        return self.journal is not None or self.manifest_changed
+
+    def save(self) -> None:
+        with metrics.span("save_state", legislature=self.legislature):
+            # with GitHub state only the shards that were read end up in the local copy
+            partial_path = f"{self.file_path}.part"
+            with open(partial_path, "w") as state_file:
+                json.dump(dict(self.state), state_file)
+            os.replace(partial_path, self.file_path)
+            if self.posts.dirty_shards:
+                with open(self.local_posts_path, "w") as posts_file:
+                    json.dump(dict(self.posts), posts_file)
+            if self.dirty_targets:
+                with open(self.local_target_states_path, "w") as targets_file:
+                    json.dump({name: dict(target_state) for name, target_state in self.target_states.items()}, targets_file)
+            if self.metadata or os.path.exists(self.local_metadata_path):
+                with open(self.local_metadata_path, "w") as metadata_file:
+                    json.dump(self.metadata, metadata_file)
+
+            if self.use_github and not self.debug_mode:
+                self.write_sharded_state()
+                if self.last_post_id is not None:
+                    self.update_last_post_id_variable(self.last_post_id)
+
+            # everything in the journal is in the snapshot now. If saving failed the journal is kept for the next run.
+            self.close_journal()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.manifest_changed = False
+
+    def replay_journal(self) -> int:
+        try:
+            with open(self.journal_path, "rb") as journal_file:
+                lines = journal_file.readlines()
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        valid_length = 0
+        for line in lines:
+            try:
+                entry = json.loads(line) if line.endswith(b"\n") else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                # a line whose write was interrupted, only ever the last one
+                break
+            if "target" in entry:
+                self.target_state(entry["target"])[entry["vote_id"]] = entry["state"]
+                self.dirty_targets.add(entry["target"])
+            elif "forget" in entry:
+                self.apply_forget_post(entry["vote_id"], entry["forget"])
+            elif "vote_id" in entry:
+                self.state[entry["vote_id"]] = entry["state"]
+                if "status_id" in entry or "thread_id" in entry:
+                    self.posts[entry["vote_id"]] = (entry.get("status_id"), entry.get("thread_id"), entry.get("content_hash"))
+            elif "last_post_id" in entry:
+                self.last_post_id = entry["last_post_id"]
+            replayed += 1
+            valid_length += len(line)
+
+        # later entries must not be appended to a torn line
+        os.truncate(self.journal_path, valid_length)
+        print(f"replayed {replayed} journal entries for {self.legislature}")
+        return replayed
+
+    def write_journal(self, entry: dict) -> None:
+        # one line per change, on disk before the change is applied, so a run that dies while posting loses nothing
+        line = json.dumps(entry) + "\n"
+        with self.journal_lock:
+            if self.journal is None:
+                self.journal = open(self.journal_path, "a")
+            self.journal.write(line)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def close_journal(self) -> None:
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def has_journal(self) -> bool:
+        return os.path.exists(self.journal_path)
+
+    def read_sharded_state(self) -> ShardedVoteStates:
+        value = self.read_repo_variable(self.state_variable_name)
+        self.manifest_exists = value is not None
+        manifest = _decode_manifest(value) if value is not None else {"shards": []}
+        self.posts = ShardedPostIds(known_shards=(manifest or {}).get("post_shards", []), load_shard=self.read_post_shard)
+        self.known_targets = set((manifest or {}).get("targets", []))
+
+        if manifest is None:
+            # legacy single variable state, it gets split into shards when saved
+            self.manifest_changed = True
+            state = ShardedVoteStates.from_vote_states(_decompress_state(value))
+            state.known_shards.clear()
+            state.mark_all_dirty()
+            return state
+
+        self.dump_fingerprint = manifest.get("dump_fingerprint")
+        self.account_id = manifest.get("account_id")
+        self.backfill = manifest.get("backfill")
+        self.votes_forgotten = manifest.get("votes_forgotten", False)
+        return ShardedVoteStates(known_shards=manifest["shards"], load_shard=self.read_shard)
+
+    def read_local_posts(self) -> ShardedPostIds:
+        try:
+            with open(self.local_posts_path, "r") as posts_file:
+                return ShardedPostIds.from_vote_states({vote_id: tuple(post) for vote_id, post in json.load(posts_file).items()})
+        except FileNotFoundError:
+            return ShardedPostIds()
+
+    def read_local_target_states(self) -> dict[str, VoteStates]:
+        try:
+            with open(self.local_target_states_path, "r") as targets_file:
+                return {name: VoteStates(target_state) for name, target_state in json.load(targets_file).items()}
+        except FileNotFoundError:
+            return {}
+
+    def target_state(self, name: str) -> VoteStates:
+        if name not in self.target_states:
+            value = self.read_repo_variable(self.target_variable_name(name)) if self.use_github and name in self.known_targets else None
+            self.target_states[name] = VoteStates() if value is None else _decompress_state(value)
+        return self.target_states[name]
+
+    def write_target_states(self) -> None:
+        for name in sorted(self.dirty_targets):
+            value = _compress_state(self.target_states[name])
+            if name in self.known_targets:
+                self.update_repo_variable(self.target_variable_name(name), value)
+            else:
+                self.create_repo_variable(self.target_variable_name(name), value)
+                self.known_targets.add(name)
+                self.manifest_changed = True
+        self.dirty_targets.clear()
+
+    def read_local_metadata(self) -> dict:
+        try:
+            with open(self.local_metadata_path, "r") as metadata_file:
+                return json.load(metadata_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def read_shard(self, key: str) -> VoteStates:
+        value = self.read_repo_variable(self.shard_variable_name(key))
+        return VoteStates() if value is None else _decompress_state(value)
+
+    def read_post_shard(self, key: str) -> PostIds:
+        value = self.read_repo_variable(self.post_shard_variable_name(key))
+        return PostIds() if value is None else _decompress_post_ids(value)
+
+    def write_shards(self, shards: ShardedVoteStates, variable_name: Callable[[str], str], compress: Callable[[Mapping], str]) -> None:
+        for key in sorted(shards.dirty_shards):
+            name = variable_name(key)
+            value = compress(shards.shard(key))
+            if key in shards.known_shards:
+                self.update_repo_variable(name, value)
+            else:
+                self.create_repo_variable(name, value)
+                shards.known_shards.add(key)
+                self.manifest_changed = True
+        shards.dirty_shards.clear()
 
-        if self.use_github and not self.debug_mode:
-            self.update_repo_variable(self.state)
-            if self.last_post_id is not None:
-                self.update_last_post_id_variable(self.last_post_id)
+    def write_sharded_state(self) -> None:
+        self.write_shards(self.state, self.shard_variable_name, _compress_state)
+        self.write_shards(self.posts, self.post_shard_variable_name, _compress_post_ids)
+        self.write_target_states()
+
+        if self.manifest_changed or not self.manifest_exists:
+            metadata = dict(self.metadata)
+            if self.posts.known_shards:
+                metadata["post_shards"] = sorted(self.posts.known_shards)
+            if self.known_targets:
+                metadata["targets"] = sorted(self.known_targets)
+            manifest = _encode_manifest(self.state.known_shards, metadata)
+            if self.manifest_exists:
+                self.update_repo_variable(self.state_variable_name, manifest)
+            else:
+                self.create_repo_variable(self.state_variable_name, manifest)
+                self.manifest_exists = True
+            self.manifest_changed = False
+
+    def is_dump_processed(self, fingerprint: str) -> bool:
+        return fingerprint == self.dump_fingerprint
+
+    def mark_dump_processed(self) -> None:
+        # only once every new vote of the fetched dump was posted or skipped, otherwise a failed run would hide them. A debug
+        # run saves no state, so it keeps no index either.
+        if self.fetched_initiative_index is not None and not self.debug_mode:
+            self.fetched_initiative_index.dump_fingerprint = self.fetched_dump_fingerprint
+            self.fetched_initiative_index.save()
+        if self.fetched_dump_fingerprint is not None and self.fetched_dump_fingerprint != self.dump_fingerprint:
+            self.dump_fingerprint = self.fetched_dump_fingerprint
+            self.manifest_changed = True
+        if self.fetched_dump_fingerprint is not None and self.votes_forgotten:
+            self.votes_forgotten = False
+            self.manifest_changed = True
+
+    def set_account_id(self, account_id: str) -> None:
+        if account_id != self.account_id:
+            self.account_id = account_id
+            self.manifest_changed = True
+
+    def set_backfill(self, checkpoint: dict | None) -> None:
+        if checkpoint != self.backfill:
+            self.backfill = checkpoint
+            self.manifest_changed = True
 
     def set_last_post_id(self, post_id: str) -> None:
+        self.write_journal({"last_post_id": post_id})
         self.last_post_id = post_id
 
     def read_last_post_id(self) -> str | None:
         if not self.use_github:
             return None
         url = self.last_post_id_variable_url
-        headers = {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {self.gh_token}"}
-        response = requests.get(url, headers=headers)
+        response = request("GET", url, headers=self.gh_headers)
         if response.status_code == 404:
             return None
         return response.json()["value"]
 
     def update_last_post_id_variable(self, post_id: str) -> None:
         url = self.last_post_id_variable_url
-        headers = {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {self.gh_token}"}
         try:
-            response = requests.patch(url, headers=headers, json={"value": post_id})
+            response = request("PATCH", url, headers=self.gh_headers, json={"value": post_id})
             if response.status_code not in (201, 204):
                 print(f"Error updating last post ID variable: {response.status_code} - {response.text}")
                 response.raise_for_status()
@@ -69,15 +363,64 @@ class StateStorage:
             print(f"Error saving last post ID: {e}")
             raise e
 
-    def mark_vote_published(self, vote_id: str) -> None:
-        self.state[vote_id] = "published"
+    def set_vote_state(
+        self, vote_id: str, vote_state: str, status_id: int | None = None, thread_id: int | None = None, content_hash: int | None = None
+    ) -> None:
+        entry = {"vote_id": vote_id, "state": vote_state}
+        if status_id is None:
+            # only a status that exists can be edited, debug runs post none
+            content_hash = None
+        post = (status_id, thread_id, content_hash)
+        if any(post):
+            entry.update(status_id=status_id, thread_id=thread_id, content_hash=content_hash)
+        self.write_journal(entry)
+        self.state[vote_id] = vote_state
+        if any(post):
+            self.posts[vote_id] = post
+
+    def mark_vote_published(self, vote_id: str, status_id: int | None = None, thread_id: int | None = None, content_hash: int | None = None) -> None:
+        self.set_vote_state(vote_id, "published", status_id, thread_id, content_hash)
+
+    def mark_vote_errored(self, vote_id: str, thread_id: int | None = None) -> None:
+        self.set_vote_state(vote_id, "errored", thread_id=thread_id)
+
+    def mark_target_vote(self, name: str, vote_id: str, vote_state: str) -> None:
+        self.write_journal({"target": name, "vote_id": vote_id, "state": vote_state})
+        self.target_state(name)[vote_id] = vote_state
+        self.dirty_targets.add(name)
+
+    def mark_vote_edited(self, vote_id: str, content_hash: int) -> None:
+        status_id, thread_id, _ = self.posts[vote_id]
+        self.set_vote_state(vote_id, "published", status_id, thread_id, content_hash)
+
+    def is_edit_candidate(self, vote_id: str) -> bool:
+        # only toots posted with a hash of their content can be told apart from a changed vote
+        return self.posted_content_hash(vote_id) is not None
 
-    def mark_vote_errored(self, vote_id: str) -> None:
-        self.state[vote_id] = "errored"
+    def posted_content_hash(self, vote_id: str) -> int | None:
+        # entries without a status id (left by debug runs) have nothing to edit
+        post = self.posts.get(vote_id)
+        return None if post is None or post[0] is None else post[2]
+
+    def forget_post(self, vote_id: str, forget_vote=False) -> None:
+        # its toots were deleted. A forgotten vote is new again and gets posted by the next run.
+        self.write_journal({"vote_id": vote_id, "forget": forget_vote})
+        self.apply_forget_post(vote_id, forget_vote)
+
+    def apply_forget_post(self, vote_id: str, forget_vote: bool) -> None:
+        if vote_id in self.posts:
+            del self.posts[vote_id]
+        if forget_vote and vote_id in self.state:
+            del self.state[vote_id]
+            # neither an unchanged dump nor the vote id watermark may hide it from the next run
+            self.dump_fingerprint = None
+            self.vote_id_watermark = None
+            self.votes_forgotten = True
+            self.manifest_changed = True
 
     def skip_vote(self, vote_id: str) -> None:
         if vote_id not in self.state:
-            self.state[vote_id] = "skipped"
+            self.set_vote_state(vote_id, "skipped")
 
     def is_new_vote(self, vote_id: str) -> bool:
         return vote_id not in self.state
@@ -85,43 +428,105 @@ class StateStorage:
     def get_vote_state(self, vote_id: str) -> str:
         return self.state[vote_id]
 
-    def variable_url(self, legislature: str) -> str:
-        return f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/actions/variables/STATE_{legislature}"
+    def variable_url(self, name: str) -> str:
+        return f"{self.variables_url}/{name}"
+
+    def shard_variable_name(self, key: str) -> str:
+        return f"{self.state_variable_name}_{key}"
+
+    def target_variable_name(self, name: str) -> str:
+        return f"TARGET_STATE_{self.legislature}_{name.upper()}"
+
+    def post_shard_variable_name(self, key: str) -> str:
+        return f"POSTS_{self.legislature}_{key}"
 
-    def read_repo_variable(self, legislature: str) -> dict:
-        url = self.variable_url(legislature)
-        headers = {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {self.gh_token}"}
-        response = requests.get(url, headers=headers).json()
+    def read_repo_variable(self, name: str) -> str | None:
+        response = request("GET", self.variable_url(name), headers=self.gh_headers)
+        if response.status_code == 404:
+            print(f"Variable {name} does not exist yet")
+            return None
 
+        response = response.json()
         print(f"Read variable {response['name']} updated at: {response['updated_at']}")
-        return _decompress_state(response["value"])
+        return response["value"]
+
+    def create_repo_variable(self, name: str, value: str) -> None:
+        try:
+            response = request("POST", self.variables_url, headers=self.gh_headers, json={"name": name, "value": value})
+
+            if response.status_code == 409:
+                # left behind by a run that stopped before updating the manifest
+                return self.update_repo_variable(name, value)
 
-    def update_repo_variable(self, state: dict) -> None:
-        url = self.variable_url(self.legislature)
-        headers = {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {self.gh_token}"}
+            if response.status_code not in (201, 204):
+                print(f"Error creating variable {name}: {response.status_code} - {response.text}")
+                response.raise_for_status()
+        except Exception as e:
+            print(f"Error saving data: {e}")
+            raise e
 
+    def update_repo_variable(self, name: str, value: str) -> None:
         try:
-            response = requests.patch(url, headers=headers, json={"value": _compress_state(state)})
+            response = request("PATCH", self.variable_url(name), headers=self.gh_headers, json={"value": value})
 
             if response.status_code not in (201, 204):
-                print(f"Error updating variable: {response.status_code} - {response.text}")
+                print(f"Error updating variable {name}: {response.status_code} - {response.text}")
                 response.raise_for_status()
         except Exception as e:
             print(f"Error saving data: {e}")
             raise e
 
+    @property
+    def metadata(self) -> dict:
+        # kept next to the shards in the manifest, or in the sidecar file with local state
+        metadata = {
+            "dump_fingerprint": self.dump_fingerprint,
+            "account_id": self.account_id,
+            "backfill": self.backfill,
+            "votes_forgotten": self.votes_forgotten or None,
+        }
+        return {key: value for key, value in metadata.items() if value is not None}
+
+    @property
+    def journal_path(self):
+        return f"{self.file_path}.journal"
+
+    @property
+    def local_target_states_path(self):
+        return f"{self.file_path}.targets.json"
+
+    @property
+    def local_posts_path(self):
+        return f"{self.file_path}.posts.json"
+
+    @property
+    def local_metadata_path(self):
+        return f"{self.file_path}.meta.json"
+
+    @property
+    def state_variable_name(self):
+        return f"STATE_{self.legislature}"
+
+    @property
+    def variables_url(self):
+        return f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/actions/variables"
+
     @property
     def last_post_id_variable_url(self):
         return f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/actions/variables/LAST_POST_ID_{self.legislature}"
 
     @property
     def gh_variable_url(self):
-        return f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/actions/variables/STATE_{self.legislature}"
+        return self.variable_url(self.state_variable_name)
 
     @property
     def debug_mode(self):
         return os.environ.get("DEBUG_MODE", "false").lower() == "true"
 
+    @cached_property
+    def gh_headers(self):
+        return {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {self.gh_token}"}
+
     @property
     def gh_token(self):
         return os.environ.get("GH_VARIABLE_UPDATE_TOKEN")
@@ -0,0 +1,51 @@
+import os
+from string import Template
+
+
+class TemplateRegistry:
+    def __init__(self, directory=".", hot_reload=None):
+        self.directory = directory
+        self._hot_reload = hot_reload
+        self._templates = {}
+        self._splits = {}
+
+    def get(self, name: str) -> Template:
+        path = os.path.join(self.directory, name)
+        cached = self._templates.get(name)
+
+        if cached is not None and not self.hot_reload:
+            return cached[1]
+
+        mtime = os.stat(path).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "r") as template_file:
+            template = Template(template_file.read())
+
+        self._templates[name] = (mtime, template)
+        self._splits = {key: split for key, split in self._splits.items() if key[0] != name}
+        return template
+
+    def split(self, name: str, placeholder: str) -> tuple[Template, Template]:
+        # splits a template around its only occurrence of placeholder, so the text on either side can be rendered
+        # (and measured) before deciding what goes in its place
+        template = self.get(name)
+        key = (name, placeholder)
+        if key not in self._splits:
+            occurrences = [m for m in template.pattern.finditer(template.template) if placeholder in (m.group("named"), m.group("braced"))]
+            if len(occurrences) != 1:
+                raise ValueError(f"{name} must contain ${placeholder} exactly once")
+            start, end = occurrences[0].span()
+            self._splits[key] = (Template(template.template[:start]), Template(template.template[end:]))
+
+        return self._splits[key]
+
+    @property
+    def hot_reload(self):
+        if self._hot_reload is not None:
+            return self._hot_reload
+        return os.getenv("TEMPLATE_HOT_RELOAD", "false").lower() == "true"
+
+
+templates = TemplateRegistry()
@@ -1,82 +1,87 @@
 import os
 import datetime
 import hashlib
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import replace
 from operator import itemgetter
-from string import Template
-from mastodon import MastodonError
+from typing import TYPE_CHECKING, Callable, Iterable
+from zoneinfo import ZoneInfo
 
+from votacoes_assembleia_da_republica import metrics
+from votacoes_assembleia_da_republica.backfill import MAX_NEW_VOTES, next_checkpoint, posting_budget, select_batch, spent_budget, status_count
 from votacoes_assembleia_da_republica.state_storage import StateStorage
-from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
-from votacoes_assembleia_da_republica.fetch_votes import fetch_votes_for_legislature, parse_vote
+from votacoes_assembleia_da_republica.fetch_votes import JSON_URIS, fetch_initiatives_for_legislature, fetch_votes_for_legislature, parse_vote
+from votacoes_assembleia_da_republica.http_cache import dump_fingerprint
+from votacoes_assembleia_da_republica.templates import templates
+
+# most runs end without new votes, the Mastodon client and the vote store are only imported once they are needed
+if TYPE_CHECKING:
+    from votacoes_assembleia_da_republica.initiative_index import InitiativeIndex
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient, VoteThread
+    from votacoes_assembleia_da_republica.publishers import Publisher
+    from votacoes_assembleia_da_republica.vote_store import VoteStore
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
     load_dotenv()
 
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
 TOOT_MAX_LENGTH = 500
+PARLIAMENT_TIMEZONE = "Europe/Lisbon"
+LEGACY_STATE_LEGISLATURE = "XVII"
 
 
 def render_thread(result: str, sorted_new_votes: list[dict]) -> str:
     date_start = sorted_new_votes[0]["date"]
     date_end = sorted_new_votes[-1]["date"]
 
-    with open("vote_thread.template", "r") as thread_template_file:
-        thread_template = Template(thread_template_file.read())
-
-        return thread_template.substitute(result="🟢 Aprovadas" if result == "Aprovado" else "🔴 Rejeitadas", date_start=date_start, date_end=date_end)
-
+    return templates.get("vote_thread.template").substitute(
+        result="🟢 Aprovadas" if result == "Aprovado" else "🔴 Rejeitadas", date_start=date_start, date_end=date_end
+    )
 
-def render_vote(vote: dict) -> str:
-    with open("vote_status.template", "r") as toot_template_file:
-        toot_template = Template(toot_template_file.read())
-
-        vote_detail = vote["vote_detail"]
-        if vote_detail == "unanime":
-            rendered_vote_detail = "🤝 Unânime"
-        elif vote_detail == "prejudicado":
-            rendered_vote_detail = "⚪ Prejudicado"
-        elif vote_detail == "sem detalhes":
-            rendered_vote_detail = ""
-        else:
-            with open("vote_detail.template", "r") as vote_detail_template_file:
-                vote_detail_template = Template(vote_detail_template_file.read())
-                rendered_vote_detail = vote_detail_template.substitute(
-                    in_favour=", ".join(vote_detail["in_favour"]),
-                    against=", ".join(vote_detail["against"]),
-                    abstained=", ".join(vote_detail["abstained"] + vote_detail["absent"]),
-                )
 
-        rendered = toot_template.substitute(
-            result="🟢 Aprovado" if vote["result"] == "Aprovado" else "🔴 Rejeitado",
-            date=vote["date"],
-            type=vote["initiative_type"],
-            authors=", ".join(vote["authors"]),
-            title=vote["title"],
-            phase=vote["phase"],
-            vote_detail=rendered_vote_detail,
-            initiative_uri=vote["initiative_uri"],
-        )
+def render_vote_detail(vote_detail) -> str:
+    if vote_detail == "unanime":
+        return "🤝 Unânime"
+    elif vote_detail == "prejudicado":
+        return "⚪ Prejudicado"
+    elif vote_detail == "sem detalhes":
+        return ""
 
-        # Mastodon always counts urls as 23 characters
-        rendered_length = len(rendered) - len(vote["initiative_uri"]) + 23
+    return templates.get("vote_detail.template").substitute(
+        in_favour=", ".join(vote_detail["in_favour"]),
+        against=", ".join(vote_detail["against"]),
+        abstained=", ".join(vote_detail["abstained"] + vote_detail["absent"]),
+    )
 
-        if rendered_length <= TOOT_MAX_LENGTH:
-            return rendered
 
-        rest_of_text = rendered_length - len(vote["title"])
+def render_vote(vote: dict) -> str:
+    # the text around the title is rendered once, which is enough to know how much of the title fits in the toot
+    before_title, after_title = templates.split("vote_status.template", "title")
+    values = {
+        "result": "🟢 Aprovado" if vote["result"] == "Aprovado" else "🔴 Rejeitado",
+        "date": vote["date"],
+        "type": vote["initiative_type"],
+        "authors": ", ".join(vote["authors"]),
+        "phase": vote["phase"],
+        "vote_detail": render_vote_detail(vote["vote_detail"]),
+        "initiative_uri": vote["initiative_uri"],
+    }
+    prefix = before_title.substitute(values)
+    suffix = after_title.substitute(values)
+    title = vote["title"]
+
+    # Mastodon always counts urls as 23 characters
+    rendered_length = len(prefix) + len(title) + len(suffix) - len(vote["initiative_uri"]) + 23
+
+    if rendered_length > TOOT_MAX_LENGTH:
+        rest_of_text = rendered_length - len(title)
         title_max_length = TOOT_MAX_LENGTH - rest_of_text - 3
+        title = f"{title[:title_max_length]}..."
 
-        return toot_template.substitute(
-            result="🟢 Aprovado" if vote["result"] == "Aprovado" else "🔴 Rejeitado",
-            date=vote["date"],
-            type=vote["initiative_type"],
-            authors=", ".join(vote["authors"]),
-            title=f"{vote['title'][:title_max_length]}...",
-            phase=vote["phase"],
-            vote_detail=rendered_vote_detail,
-            initiative_uri=vote["initiative_uri"],
-        )
+    return f"{prefix}{title}{suffix}"
 
 
 def group_votes_by_result(votes: list[dict]) -> dict[str, list[dict]]:
@@ -90,75 +95,584 @@ def group_votes_by_result(votes: list[dict]) -> dict[str, list[dict]]:
     return votes_by_result
 
 
-def update(legislature: str, state_file_path="state.json", use_github=False):
-    OVERRIDE_UNSAFE_STATE_CHECK = os.environ.get("OVERRIDE_UNSAFE_STATE_CHECK", "false").lower() == "true"
-    OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE = os.environ.get("OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE", datetime.date.today().isoformat())
+def override_unsafe_state_check() -> bool:
+    return os.environ.get("OVERRIDE_UNSAFE_STATE_CHECK", "false").lower() == "true"
 
-    with StateStorage(legislature, file_path=state_file_path, use_github=use_github) as state:
-        print("fetching votes")
-        raw_votes = fetch_votes_for_legislature(legislature)
-
-        new_votes = [parse_vote(raw_vote) for raw_vote in raw_votes if state.is_new_vote(raw_vote["vote_id"])]
-
-        if not new_votes:
-            print("no new votes")
-            return
 
-        if len(new_votes) > 100 and not OVERRIDE_UNSAFE_STATE_CHECK:
-            raise AssertionError(f"Found {len(new_votes)} new votes, state might have been lost, aborting.")
+def content_hash(rendered_vote: str) -> int:
+    # 0 stands for no hash in the state
+    return int.from_bytes(hashlib.blake2b(rendered_vote.encode(), digest_size=4).digest(), "little") or 1
 
-        if OVERRIDE_UNSAFE_STATE_CHECK:
-            print(f"Found {len(new_votes)} new votes, overriding check and allowing the ones after: {OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE}")
-            for expired_vote in new_votes:
-                if expired_vote["date"] <= OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE:
-                    state.skip_vote(expired_vote["vote_id"])
 
-            new_votes = [vote for vote in new_votes if vote["date"] > OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE]
+def find_changed_votes(state: StateStorage, votes: Iterable[dict]) -> list[tuple[str, str]]:
+    # posted votes whose toot would now read differently, e.g. a detail that was still missing when it was posted
+    changed_votes = []
+    for vote in votes:
+        posted_content_hash = state.posted_content_hash(vote["vote_id"])
+        if posted_content_hash is not None:
+            rendered_vote = render_vote(vote)
+            if content_hash(rendered_vote) != posted_content_hash:
+                changed_votes.append((vote["vote_id"], rendered_vote))
+    return changed_votes
+
+
+def edit_candidates(state: StateStorage, index: "InitiativeIndex", force=False) -> Callable[[str], bool]:
+    # a posted toot can only read differently once the vote's result or detail changed since it was seen, so only those
+    # are rendered again. --force checks every posted vote of the walked initiatives.
+    if force:
+        return state.is_edit_candidate
+    return lambda vote_id: vote_id in index.changed_votes and state.is_edit_candidate(vote_id)
+
+
+def ingest_new_votes(legislature: str, state: StateStorage, store: "VoteStore", initiatives_path: str, force=False) -> list[dict]:
+    # every vote of the new and changed initiatives is parsed and upserted, so a result or detail corrected after it was
+    # stored is picked up too. The ones the state doesn't know about come out of an anti-join.
+    # the store keeps its own index, the one of the state may have seen initiatives whose votes never made it into the store,
+    # and a store that was lost starts over from the whole dump
+    index = load_initiative_index(initiatives_path, state, "store-index")
+    if force or store.max_vote_id(legislature) is None:
+        index.initiatives.clear()
+    raw_votes = fetch_votes_for_legislature(legislature, initiatives_path=initiatives_path, index=index)
+    with metrics.span("parse_votes", legislature=legislature):
+        parsed_votes = [parse_vote(raw_vote) for raw_vote in raw_votes]
+    store.upsert_votes(legislature, parsed_votes)
+    is_edit_candidate = edit_candidates(state, index, force)
+    state.changed_votes = find_changed_votes(state, [vote for vote in parsed_votes if is_edit_candidate(vote["vote_id"])])
+    state.fetched_initiative_index = index
+
+    low, high = store.vote_id_range(legislature)
+    known_vote_ids = state.state.vote_ids_between(low, high) if low is not None else iter(state.state)
+    with metrics.span("new_votes", legislature=legislature):
+        return store.new_votes(legislature, known_vote_ids)
+
+
+def load_initiative_index(initiatives_path: str, state: StateStorage, name="index") -> "InitiativeIndex":
+    from votacoes_assembleia_da_republica.initiative_index import InitiativeIndex
+
+    index = InitiativeIndex.load(f"{initiatives_path}.{name}.json")
+    if index.dump_fingerprint is None or index.dump_fingerprint != state.dump_fingerprint:
+        # built against another state, e.g. one that was lost since, or that forgot votes: its unchanged initiatives may
+        # hold votes this state never handled
+        index.initiatives.clear()
+    return index
+
+
+def collect_new_votes(
+    legislature: str, state: StateStorage, store: "VoteStore | None" = None, force=False, initiatives_path: str | None = None, backfill=False
+) -> list[dict]:
+    OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE = os.environ.get("OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE", datetime.date.today().isoformat())
 
-        print("posting votes")
-        m = MastodonClient()
+    # left over from the last poll when the state is kept between them
+    state.changed_votes = []
+    state.fetched_initiative_index = None
+    state.backfilling = False
+
+    if initiatives_path is None:
+        print(f"fetching votes for {legislature}")
+        initiatives_path = fetch_initiatives_for_legislature(legislature)
+    state.fetched_dump_fingerprint = dump_fingerprint(initiatives_path)
+    if not force and state.is_dump_processed(state.fetched_dump_fingerprint):
+        print(f"dump for {legislature} is the same as in the last run, nothing to parse")
+        return []
+
+    if store is not None:
+        new_votes = ingest_new_votes(legislature, state, store, initiatives_path, force)
+    else:
+        index = load_initiative_index(initiatives_path, state)
+        if force:
+            index.initiatives.clear()
+        is_edit_candidate = edit_candidates(state, index, force)
+        raw_votes = fetch_votes_for_legislature(legislature, state, initiatives_path, index, is_posted_vote=is_edit_candidate)
+        # the dump is decoded while it's walked, so this covers both
+        with metrics.span("parse_votes", legislature=legislature):
+            parsed_votes = [parse_vote(raw_vote) for raw_vote in raw_votes]
+        new_votes = [vote for vote in parsed_votes if state.is_new_vote(vote["vote_id"])]
+        state.changed_votes = find_changed_votes(state, [vote for vote in parsed_votes if is_edit_candidate(vote["vote_id"])])
+        state.fetched_initiative_index = index
+
+    if state.fetched_initiative_index.changed_votes:
+        print(f"votes whose result or detail changed since they were seen in {legislature}: {', '.join(state.fetched_initiative_index.changed_votes)}")
+    if state.changed_votes:
+        print(f"votes that changed since they were posted in {legislature}: {', '.join(vote_id for vote_id, _ in state.changed_votes)}")
+
+    if not new_votes:
+        print(f"no new votes for {legislature}")
+        # nothing left of a backlog either
+        state.set_backfill(None)
+        return []
+
+    # a backfill that was started goes on in the next runs, as long as the backlog didn't grow by more than a run's worth
+    resuming_backfill = state.backfill is not None and len(new_votes) <= state.backfill["remaining"] + MAX_NEW_VOTES
+    if len(new_votes) > MAX_NEW_VOTES and not override_unsafe_state_check() and not backfill and not resuming_backfill:
+        raise AssertionError(f"Found {len(new_votes)} new votes, state might have been lost, aborting. Pass --backfill to post them in batches.")
+    if not override_unsafe_state_check() and ((backfill and len(new_votes) > MAX_NEW_VOTES) or resuming_backfill):
+        print(f"Found {len(new_votes)} new votes, backfilling them in batches")
+        state.backfilling = True
+        return new_votes
+
+    if override_unsafe_state_check():
+        print(f"Found {len(new_votes)} new votes, overriding check and allowing the ones after: {OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE}")
+        for expired_vote in new_votes:
+            if expired_vote["date"] <= OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE:
+                state.skip_vote(expired_vote["vote_id"])
+
+        new_votes = [vote for vote in new_votes if vote["date"] > OVERRIDE_UNSAFE_STATE_SKIP_POSTS_BEFORE_ISO_DATE]
+
+    return new_votes
+
+
+def fetch_latest_post_id(stored_last_post_ids: list[str], account_id: str | None) -> tuple["MastodonClient | None", str | None]:
+    # the account's latest post is only needed to vouch for a stored last post id
+    if not stored_last_post_ids or override_unsafe_state_check():
+        return None, None
+
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+
+    with metrics.span("fetch_latest_post_id"):
+        m = MastodonClient(account_id=account_id)
+        return m, m.latest_post_id()
+
+
+def check_last_post_id(stored_last_post_ids: list[str], actual_last_post_id: str | None) -> None:
+    # every legislature stores the id of the account's latest post, so any of them can vouch for the state being fresh
+    if not stored_last_post_ids or override_unsafe_state_check():
+        return
+
+    if actual_last_post_id != "debug_mode" and actual_last_post_id not in stored_last_post_ids:
+        raise AssertionError(
+            f"Last post ID mismatch: stored={', '.join(stored_last_post_ids)}, actual={actual_last_post_id}. State may be stale, aborting to avoid duplicate posts."
+        )
 
-        stored_last_post_id = state.read_last_post_id()
-        if stored_last_post_id is not None and not OVERRIDE_UNSAFE_STATE_CHECK:
-            actual_last_post_id = m.latest_post_id()
-            if actual_last_post_id != "debug_mode" and actual_last_post_id != stored_last_post_id:
-                raise AssertionError(
-                    f"Last post ID mismatch: stored={stored_last_post_id}, actual={actual_last_post_id}. State may be stale, aborting to avoid duplicate posts."
-                )
 
+def mirror_new_votes(mirror: "Publisher", state: StateStorage, vote_threads: list["VoteThread"]) -> None:
+    # a mirror keeps its own published/errored states, and failing or falling behind never holds up the primary account
+    def on_posted(vote_id: str, post: dict | None) -> None:
+        state.mark_target_vote(mirror.name, vote_id, "published")
+
+    def on_error(vote_id: str, error: Exception) -> None:
+        print(f"error mirroring vote {vote_id} to {mirror.name}: {error}")
+        state.mark_target_vote(mirror.name, vote_id, "errored")
+
+    try:
+        with metrics.span("post_votes", legislature=state.legislature, votes=sum(len(t.rendered_votes) for t in vote_threads), target=mirror.name):
+            mirror.post_vote_threads(vote_threads, on_posted=on_posted, on_error=on_error)
+    except Exception as e:
+        print(f"error mirroring to {mirror.name}: {e}")
+        for vote_thread in vote_threads:
+            for vote_id, _ in vote_thread.rendered_votes:
+                if vote_id not in state.target_state(mirror.name):
+                    state.mark_target_vote(mirror.name, vote_id, "errored")
+
+
+def post_new_votes(
+    m: "MastodonClient",
+    state: StateStorage,
+    new_votes: list[dict],
+    mirrors: list[tuple["Publisher", Executor]] = (),
+    on_post_id: Callable[[str], None] | None = None,
+) -> None:
+    from votacoes_assembleia_da_republica.mastodon_client import VoteThread
+
+    with metrics.span("render_votes", legislature=state.legislature, votes=len(new_votes)):
         new_votes_by_result = group_votes_by_result(new_votes)
 
-        last_post_id = None
+        vote_threads = []
         for result in sorted(new_votes_by_result):
             new_votes_for_result = new_votes_by_result[result]
             print(f"starting a thread for result {result}")
             new_votes_for_result.sort(key=itemgetter("date"))
 
             idempotency_key = hashlib.md5(",".join(sorted(v["vote_id"] for v in new_votes_for_result)).encode()).hexdigest()
-            result_thread = m.start_vote_thread(render_thread(result, new_votes_for_result), idempotency_key=idempotency_key)
-
-            for new_vote_for_result in new_votes_for_result:
-                vote_id = new_vote_for_result["vote_id"]
-
-                print(f"posting vote {new_vote_for_result}")
+            vote_threads.append(
+                VoteThread(
+                    render_thread(result, new_votes_for_result),
+                    idempotency_key,
+                    [(new_vote_for_result["vote_id"], render_vote(new_vote_for_result)) for new_vote_for_result in new_votes_for_result],
+                )
+            )
+
+    vote_threads_by_vote_id = {vote_id: vote_thread for vote_thread in vote_threads for vote_id, _ in vote_thread.rendered_votes}
+    rendered_votes = {vote_id: rendered_vote for vote_thread in vote_threads for vote_id, rendered_vote in vote_thread.rendered_votes}
+
+    def thread_id(vote_id: str) -> int | None:
+        post = vote_threads_by_vote_id[vote_id].post
+        return None if post is None else int(post["id"])
+
+    def on_posted(vote_id: str, post: dict | None) -> None:
+        print(f"posted vote {vote_id}")
+        state.mark_vote_published(vote_id, None if post is None else int(post["id"]), thread_id(vote_id), content_hash(rendered_votes[vote_id]))
+        if post is not None and on_post_id is not None:
+            on_post_id(str(post["id"]))
+
+    def on_error(vote_id: str, error: Exception) -> None:
+        print(f"error posting vote {vote_id}: {error}")
+        state.mark_vote_errored(vote_id, thread_id(vote_id))
+
+    # every publisher posts its own copy of the threads at the same time, with its own rate limits. Mirrors are queued on
+    # their own executor and not waited on here, so the account goes on with the next legislature meanwhile.
+    for mirror, mirror_pool in mirrors:
+        # loaded up front, the mirrors' callbacks run on their own threads
+        state.target_state(mirror.name)
+        mirror_pool.submit(mirror_new_votes, mirror, state, [replace(vote_thread, post=None) for vote_thread in vote_threads])
+    with metrics.span("post_votes", legislature=state.legislature, votes=len(new_votes)):
+        m.post_vote_threads(vote_threads, on_posted=on_posted, on_error=on_error)
+
+
+def edit_changed_votes(m: "MastodonClient", state: StateStorage) -> bool:
+    # one status edit per changed vote, the threads and their replies stay as they are
+    edited_all = True
+    with metrics.span("edit_votes", legislature=state.legislature, votes=len(state.changed_votes)):
+        for vote_id, rendered_vote in state.changed_votes:
+            try:
+                m.edit_status(state.posts[vote_id][0], rendered_vote)
+            except Exception as e:
+                print(f"error editing vote {vote_id}: {e}")
+                edited_all = False
+            else:
+                print(f"edited vote {vote_id}")
+                state.mark_vote_edited(vote_id, content_hash(rendered_vote))
+    return edited_all
+
+
+def new_mastodon_client(states: list[StateStorage]) -> "MastodonClient":
+    from votacoes_assembleia_da_republica.mastodon_client import MastodonClient
+
+    return MastodonClient(account_id=next((state.account_id for state in states if state.account_id), None))
+
+
+def take_backfill_batch(states: list[StateStorage], new_votes_by_legislature: dict[str, list[dict]]) -> dict[str, list[dict]]:
+    # a backlog is posted oldest first, as much of it as the posting budget left in the instance's window allows, and
+    # the rest is checkpointed in the state for the next runs
+    now = datetime.datetime.now(datetime.timezone.utc)
+    budget = posting_budget() - spent_budget([state.backfill for state in states], now)
+    budget -= sum(status_count(new_votes_by_legislature[state.legislature]) for state in states if not state.backfilling)
+    backlog = {state.legislature: new_votes_by_legislature[state.legislature] for state in states if state.backfilling}
+    batch = select_batch(backlog, max(budget, 0))
+
+    for state in states:
+        if state.backfilling:
+            votes = batch[state.legislature]
+            remaining = len(backlog[state.legislature]) - len(votes)
+            print(f"backfilling {state.legislature}: posting {len(votes)} votes, {remaining} left for the next runs")
+            state.set_backfill(next_checkpoint(state.backfill, remaining, status_count(votes), now))
+    return {**new_votes_by_legislature, **batch}
+
+
+def publish_collected(
+    legislatures: list[str],
+    states: list[StateStorage],
+    collected: list[tuple[list[dict], Exception | None]],
+    preflight: Callable[[], tuple[list[str], "MastodonClient | None", str | None]],
+    m: "MastodonClient | None" = None,
+    mirrors: list[str] = (),
+) -> "MastodonClient | None":
+    # posts the new votes and edits the changed ones of every legislature, the preflight is only waited on to post
+    new_votes_by_legislature = {legislature: new_votes for legislature, (new_votes, _) in zip(legislatures, collected)}
+    errors = [error for _, error in collected if error is not None]
+    if any(state.backfilling for state in states):
+        new_votes_by_legislature = take_backfill_batch(states, new_votes_by_legislature)
+
+    # one worker per mirror, so each posts the legislatures in order without holding up the account or the other mirrors.
+    # They are only waited on once the account posted and edited everything, before the states are saved.
+    mirror_pools = []
+    try:
+        if not any(new_votes_by_legislature.values()):
+            print("no new votes")
+        else:
+            print("posting votes")
+            stored_last_post_ids, preflight_client, actual_last_post_id = preflight()
+            check_last_post_id(stored_last_post_ids, actual_last_post_id)
+            m = m or preflight_client or new_mastodon_client(states)
+
+            from votacoes_assembleia_da_republica.publishers import publisher_from_spec
+
+            mirror_pools = [(publisher_from_spec(mirror), ThreadPoolExecutor(max_workers=1)) for mirror in mirrors]
+            last_post_id = None
+
+            def journal_last_post_id(post_id: str) -> None:
+                # journaled for every legislature right after each post, so the votes of a run that is killed while
+                # posting are saved along with the account's latest post. Threads are posted concurrently, the newest
+                # post is the one with the highest id.
+                nonlocal last_post_id
+                if last_post_id is None or (len(post_id), post_id) > (len(last_post_id), last_post_id):
+                    last_post_id = post_id
+                    for state in states:
+                        state.set_last_post_id(post_id)
+
+            for legislature, state in zip(legislatures, states):
+                if new_votes_by_legislature[legislature]:
+                    print(f"posting votes for {legislature}")
+                    post_new_votes(m, state, new_votes_by_legislature[legislature], mirror_pools, journal_last_post_id)
+
+        edit_failed = set()
+        if any(state.changed_votes for state in states):
+            m = m or new_mastodon_client(states)
+            for legislature, state in zip(legislatures, states):
+                if state.changed_votes:
+                    print(f"editing {len(state.changed_votes)} changed votes for {legislature}")
+                    if not edit_changed_votes(m, state):
+                        edit_failed.add(legislature)
+    finally:
+        for _, mirror_pool in mirror_pools:
+            mirror_pool.shutdown(wait=True)
+
+    if m is not None and m.account_id is not None:
+        for state in states:
+            state.set_account_id(m.account_id)
+
+    for legislature, state, (_, error) in zip(legislatures, states, collected):
+        # a dump whose edits failed, or with a backlog left, is walked again by the next run, which picks them up
+        if error is None and legislature not in edit_failed and state.backfill is None:
+            state.mark_dump_processed()
+
+    if errors:
+        raise errors[0]
+    return m
+
+
+def update_legislatures(
+    state_file_paths: dict[str, str], use_github=False, max_workers=4, vote_store_path: str | None = None, force=False, mirrors: list[str] = (), backfill=False
+):
+    # fetching, parsing and loading/saving state run concurrently per legislature, posting stays serialized
+    legislatures = list(state_file_paths)
+    states = [StateStorage(legislature, file_path=state_file_paths[legislature], use_github=use_github) for legislature in legislatures]
+
+    def collect(legislature: str, entering: Future, download: Future) -> tuple[list[dict], Exception | None]:
+        # a legislature that fails its checks must not keep the others from being posted
+        try:
+            new_votes = collect_new_votes(legislature, entering.result(), store, force, download.result(), backfill)
+        except Exception as e:
+            return [], e
+        if new_votes:
+            start_latest_post_lookup()
+        return new_votes, None
+
+    latest_post = None
+    latest_post_lock = threading.Lock()
+
+    def start_latest_post_lookup() -> Future:
+        # the Mastodon client is only loaded once a legislature has votes to post, and looks the account up while the
+        # other legislatures are still being collected
+        nonlocal latest_post
+        with latest_post_lock:
+            if latest_post is None:
+                latest_post = pool.submit(preflight_latest_post, entering, last_post_id_reads)
+            return latest_post
+
+    def preflight_latest_post(entering: list[Future], last_post_id_reads: list[Future]) -> tuple[list[str], "MastodonClient | None", str | None]:
+        stored_last_post_ids = [post_id for post_id in (read.result() for read in last_post_id_reads) if post_id is not None]
+        account_id = next((state.account_id for state in (entered.result() for entered in entering) if state.account_id), None)
+        return stored_last_post_ids, *fetch_latest_post_id(stored_last_post_ids, account_id)
+
+    store = None
+    if vote_store_path:
+        from votacoes_assembleia_da_republica.vote_store import VoteStore
+
+        store = VoteStore(vote_store_path).__enter__()
+    with ThreadPoolExecutor(max_workers=max(max_workers, 3 * len(states) + 1)) as pool:
+        # none of the requests made before posting depend on each other, so the state reads, the dump downloads and the
+        # stored last post ids are all in flight at once, and so is the account's latest post once there is something to
+        # post. Tasks are submitted after the ones they wait on, which are then already running, so a waiting task never
+        # holds up the pool.
+        print(f"fetching votes for {', '.join(legislatures)}")
+        entering = [pool.submit(state.__enter__) for state in states]
+        downloads = [pool.submit(fetch_initiatives_for_legislature, legislature) for legislature in legislatures]
+        last_post_id_reads = [pool.submit(state.read_last_post_id) for state in states]
+        collecting = [pool.submit(collect, legislature, entered, download) for legislature, entered, download in zip(legislatures, entering, downloads)]
+
+        entered_states = [entered.result() for entered in entering]
+        try:
+            collected = [future.result() for future in collecting]
+            publish_collected(legislatures, entered_states, collected, lambda: start_latest_post_lookup().result(), mirrors=mirrors)
+        finally:
+            list(pool.map(lambda state: state.__exit__(None, None, None), entered_states))
+            if store is not None:
+                store.__exit__(None, None, None)
+
+
+def update(
+    legislature: str, state_file_path="state.json", use_github=False, vote_store_path: str | None = None, force=False, mirrors: list[str] = (), backfill=False
+):
+    update_legislatures({legislature: state_file_path}, use_github=use_github, vote_store_path=vote_store_path, force=force, mirrors=mirrors, backfill=backfill)
+
+
+def poll_interval(now: datetime.datetime, last_change: datetime.datetime | None, min_interval=60, max_interval=900, quiet_interval=3600) -> float:
+    # votes are published after plenary sessions, on weekdays during the day in Lisbon. A dump that just changed tends to
+    # change again soon, so the interval grows with the time since its last change.
+    local_now = now.astimezone(ZoneInfo(PARLIAMENT_TIMEZONE))
+    if local_now.weekday() >= 5 or not 8 <= local_now.hour < 22:
+        return quiet_interval
+    if last_change is None:
+        return max_interval
+    return min(max(min_interval, (now - last_change).total_seconds() / 4), max_interval)
+
+
+def poll_legislatures(
+    state_file_paths: dict[str, str],
+    use_github=False,
+    vote_store_path: str | None = None,
+    mirrors: list[str] = (),
+    min_interval=60,
+    max_interval=900,
+    quiet_interval=3600,
+    stop: threading.Event | None = None,
+    max_workers=4,
+    backfill=False,
+):
+    # the states, the vote store, the Mastodon client and the HTTP connections are kept between polls, so a poll whose
+    # dumps didn't change is one conditional request per legislature, and state is only saved when it changed
+    legislatures = list(state_file_paths)
+    states = [StateStorage(legislature, file_path=state_file_paths[legislature], use_github=use_github) for legislature in legislatures]
+    stop = stop or threading.Event()
+
+    store = None
+    if vote_store_path:
+        from votacoes_assembleia_da_republica.vote_store import VoteStore
+
+        store = VoteStore(vote_store_path).__enter__()
+
+    def collect(legislature: str, state: StateStorage) -> tuple[list[dict], Exception | None]:
+        try:
+            return collect_new_votes(legislature, state, store, backfill=backfill), None
+        except Exception as e:
+            return [], e
+
+    def preflight() -> tuple[list[str], "MastodonClient | None", str | None]:
+        # read again before every post, another run may have posted since the states were loaded
+        stored_last_post_ids = [post_id for post_id in pool.map(StateStorage.read_last_post_id, entered_states) if post_id is not None]
+        return stored_last_post_ids, *fetch_latest_post_id(stored_last_post_ids, next((state.account_id for state in entered_states if state.account_id), None))
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, len(states))) as pool:
+        entered_states = list(pool.map(StateStorage.__enter__, states))
+        try:
+            fingerprints = {state.legislature: state.dump_fingerprint for state in entered_states}
+            last_change = None
+            m = None
+            while not stop.is_set():
                 try:
-                    post = m.post_vote(render_vote(new_vote_for_result), reply_to=result_thread, idempotency_key=vote_id)
-                    state.mark_vote_published(vote_id)
-                    if post is not None:
-                        last_post_id = str(post["id"])
-                except MastodonError as e:
-                    print(f"error posting vote {vote_id}: {e}")
-                    state.mark_vote_errored(vote_id)
-
-        if last_post_id is not None:
-            state.set_last_post_id(last_post_id)
+                    with metrics.span("poll"):
+                        collected = list(pool.map(collect, legislatures, entered_states))
+                        if any(state.fetched_dump_fingerprint != fingerprints[state.legislature] for state in entered_states):
+                            last_change = datetime.datetime.now(datetime.timezone.utc)
+                            fingerprints = {state.legislature: state.fetched_dump_fingerprint for state in entered_states}
+                        m = publish_collected(legislatures, entered_states, collected, preflight, m, mirrors)
+                except AssertionError:
+                    # the state can't be trusted anymore, posting again would risk duplicates
+                    raise
+                except Exception as e:
+                    print(f"poll failed, trying again in the next one: {e}")
+                finally:
+                    for state in entered_states:
+                        if state.has_unsaved_changes():
+                            state.save()
+
+                interval = poll_interval(datetime.datetime.now(datetime.timezone.utc), last_change, min_interval, max_interval, quiet_interval)
+                print(f"next poll in {interval:.0f}s")
+                stop.wait(interval)
+        finally:
+            list(pool.map(lambda state: state.__exit__(None, None, None), entered_states))
+            if store is not None:
+                store.__exit__(None, None, None)
+
+
+def count_new_votes(state_file_paths: dict[str, str], use_github=False, max_workers=4) -> dict[str, int]:
+    # fetch and diff against the state only: nothing is parsed beyond the vote ids, posted or saved
+    legislatures = list(state_file_paths)
+    states = [StateStorage(legislature, file_path=state_file_paths[legislature], use_github=use_github) for legislature in legislatures]
+
+    def count(legislature: str, state: StateStorage) -> int:
+        with metrics.span("count_new_votes", legislature=legislature):
+            return sum(1 for _ in fetch_votes_for_legislature(legislature, state.__enter__()))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(legislatures, pool.map(count, legislatures, states)))
+
+
+def state_file_paths_for(legislatures: list[str]) -> dict[str, str]:
+    # state.json is XVII's, the only legislature updated before the others were added, so existing local state keeps working
+    return {legislature: "state.json" if legislature == LEGACY_STATE_LEGISLATURE else f"state_{legislature}.json" for legislature in legislatures}
+
+
+def flush_journals(state_file_paths: dict[str, str], use_github=False) -> None:
+    # saves what a run that was killed while posting left in its journals, without fetching or posting anything
+    for legislature, state_file_path in state_file_paths.items():
+        state = StateStorage(legislature, file_path=state_file_path, use_github=use_github)
+        if state.has_journal():
+            with state:
+                print(f"flushed the state journal for {legislature}")
 
 
 if __name__ == "__main__":
     import argparse
 
+    from votacoes_assembleia_da_republica.backfill import describe_estimate, estimate_backfill
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--github-state", action="store_true", help="Read/write state from GitHub variable instead of local state.json")
+    parser.add_argument("--legislatures", nargs="+", default=list(JSON_URIS), choices=list(JSON_URIS), help="Legislatures to update, all of them by default")
+    parser.add_argument("--vote-store", metavar="PATH", help="Keep every parsed vote in a SQLite database at PATH and find new votes with it")
+    parser.add_argument("--metrics", metavar="PATH", help="Write per-stage timings and HTTP request metrics as JSON to PATH")
+    parser.add_argument("--force", action="store_true", help="Parse the dumps even if they are the same as in the last run")
+    parser.add_argument("--check", action="store_true", help="Only report how many new votes there are, without posting or saving state")
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        default=[],
+        metavar="[NAME=]KIND[:ARG]",
+        help="Also publish the new votes to jsonl:PATH or NAME=mastodon (MASTODON_API_BASE_URL_<NAME>, MASTODON_ACCESS_TOKEN_<NAME>), can be repeated",
+    )
+    parser.add_argument("--backfill", action="store_true", help="Post more than 100 new votes in batches sized to the posting budget, over several runs")
+    parser.add_argument("--run-interval", type=float, default=1440, help="Minutes between runs, for the backfill estimate of --check")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and poll the dumps, posting new votes as soon as they show up")
+    parser.add_argument("--min-interval", type=float, default=60, help="Seconds between polls right after a dump changed, with --daemon")
+    parser.add_argument("--max-interval", type=float, default=900, help="Most seconds between polls on weekdays during the day, with --daemon")
+    parser.add_argument("--quiet-interval", type=float, default=3600, help="Seconds between polls at night and on weekends, with --daemon")
+    parser.add_argument("--flush-journal", action="store_true", help="Only save the state changes journaled by a run that didn't finish")
     args = parser.parse_args()
-    update("XVII", use_github=args.github_state)
+    state_file_paths = state_file_paths_for(args.legislatures)
+
+    if args.metrics:
+        metrics.enable()
+    try:
+        if args.flush_journal:
+            flush_journals(state_file_paths, use_github=args.github_state)
+        elif args.check:
+            with metrics.span("check"):
+                for legislature, new_vote_count in count_new_votes(state_file_paths, use_github=args.github_state).items():
+                    print(f"{legislature}: {new_vote_count} new votes")
+                    if new_vote_count > MAX_NEW_VOTES:
+                        runs, duration = estimate_backfill(new_vote_count, datetime.timedelta(minutes=args.run_interval))
+                        print(f"{legislature}: {describe_estimate(new_vote_count, runs, duration)}")
+        elif args.daemon:
+            import signal
+
+            stop = threading.Event()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                # the poll in progress finishes and the states are saved before exiting
+                signal.signal(signal_number, lambda *_: stop.set())
+            poll_legislatures(
+                state_file_paths,
+                use_github=args.github_state,
+                vote_store_path=args.vote_store,
+                mirrors=args.mirror,
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                quiet_interval=args.quiet_interval,
+                stop=stop,
+                backfill=args.backfill,
+            )
+        else:
+            with metrics.span("update"):
+                update_legislatures(
+                    state_file_paths,
+                    use_github=args.github_state,
+                    vote_store_path=args.vote_store,
+                    force=args.force,
+                    mirrors=args.mirror,
+                    backfill=args.backfill,
+                )
+    finally:
+        # failed runs are the ones worth looking at
+        if args.metrics:
+            metrics.write(args.metrics)
     print("done")
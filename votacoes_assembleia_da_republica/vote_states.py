@@ -0,0 +1,327 @@
+import base64
+import zlib
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, MutableMapping
+from typing import Callable, Iterable, Iterator
+
+FORMAT_PREFIX = "v2:"
+POST_IDS_FORMAT_PREFIX = "p2:"
+POST_IDS_FORMAT_PREFIXES = ("p1:", POST_IDS_FORMAT_PREFIX)
+STATUSES = ("published", "errored", "skipped")
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+def _numeric_vote_id(vote_id: str) -> int | None:
+    # only ids that survive a round trip through int can live in the id array
+    if vote_id.isascii() and vote_id.isdigit() and (vote_id == "0" or vote_id[0] != "0"):
+        return int(vote_id)
+    return None
+
+
+class VoteStates(MutableMapping):
+    # vote_id -> status, kept as a sorted array of integer ids plus one status code per id, so lookups are a bisect
+    # instead of a hash of strings. Ids or statuses that don't fit that shape are kept in a plain dict on the side.
+
+    def __init__(self, states: dict | None = None):
+        self._ids = array("q")
+        self._statuses = bytearray()
+        self._other = {}
+        if states:
+            entries = []
+            for vote_id, status in states.items():
+                numeric_id = _numeric_vote_id(vote_id)
+                if numeric_id is None or status not in STATUS_CODES:
+                    self._other[vote_id] = status
+                else:
+                    entries.append((numeric_id, STATUS_CODES[status]))
+            entries.sort()
+            self._ids.extend(numeric_id for numeric_id, _ in entries)
+            self._statuses.extend(code for _, code in entries)
+
+    @classmethod
+    def from_arrays(cls, ids: Iterable[int], statuses: bytes) -> "VoteStates":
+        vote_states = cls()
+        vote_states._ids.extend(ids)
+        vote_states._statuses.extend(statuses)
+        return vote_states
+
+    def _index(self, numeric_id: int) -> int | None:
+        i = bisect_left(self._ids, numeric_id)
+        if i < len(self._ids) and self._ids[i] == numeric_id:
+            return i
+        return None
+
+    def __contains__(self, vote_id) -> bool:
+        numeric_id = _numeric_vote_id(vote_id) if isinstance(vote_id, str) else None
+        if numeric_id is not None and self._index(numeric_id) is not None:
+            return True
+        return bool(self._other) and vote_id in self._other
+
+    def __getitem__(self, vote_id: str) -> str:
+        numeric_id = _numeric_vote_id(vote_id)
+        i = None if numeric_id is None else self._index(numeric_id)
+        if i is None:
+            return self._other[vote_id]
+        return STATUSES[self._statuses[i]]
+
+    def __setitem__(self, vote_id: str, status: str) -> None:
+        numeric_id = _numeric_vote_id(vote_id)
+        if numeric_id is None or status not in STATUS_CODES:
+            if numeric_id is not None and self._index(numeric_id) is not None:
+                del self[vote_id]
+            self._other[vote_id] = status
+            return
+
+        self._other.pop(vote_id, None)
+        i = bisect_left(self._ids, numeric_id)
+        if i < len(self._ids) and self._ids[i] == numeric_id:
+            self._statuses[i] = STATUS_CODES[status]
+        else:
+            self._ids.insert(i, numeric_id)
+            self._statuses.insert(i, STATUS_CODES[status])
+
+    def __delitem__(self, vote_id: str) -> None:
+        numeric_id = _numeric_vote_id(vote_id)
+        i = None if numeric_id is None else self._index(numeric_id)
+        if i is None:
+            del self._other[vote_id]
+            return
+        del self._ids[i]
+        del self._statuses[i]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from map(str, self._ids)
+        yield from self._other
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._other)
+
+    def __repr__(self) -> str:
+        return f"VoteStates({dict(self)!r})"
+
+    def max_vote_id(self) -> int | None:
+        return self._ids[-1] if self._ids else None
+
+    def is_compact(self) -> bool:
+        return not self._other
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_vote_states(vote_states: VoteStates) -> str:
+    # v2 layout, zlib compressed: varint count, varint deltas between the sorted ids, then the statuses packed 4 per byte
+    payload = bytearray()
+    _write_varint(payload, len(vote_states._ids))
+    previous = 0
+    for numeric_id in vote_states._ids:
+        _write_varint(payload, numeric_id - previous)
+        previous = numeric_id
+
+    packed = bytearray((len(vote_states._statuses) + 3) // 4)
+    for i, code in enumerate(vote_states._statuses):
+        packed[i >> 2] |= code << ((i & 3) * 2)
+    payload += packed
+
+    return FORMAT_PREFIX + base64.b64encode(zlib.compress(bytes(payload), 9)).decode()
+
+
+# each packed status byte unpacked into its 4 status codes
+_UNPACKED_STATUSES = [bytes((packed >> shift) & 3 for shift in (0, 2, 4, 6)) for packed in range(256)]
+
+
+def decode_vote_states(value: str) -> VoteStates:
+    payload = zlib.decompress(base64.b64decode(value.removeprefix(FORMAT_PREFIX), validate=True))
+    count, position = _read_varint(payload, 0)
+
+    ids = array("q")
+    previous = 0
+    delta = 0
+    shift = 0
+    for byte in memoryview(payload)[position:]:
+        if len(ids) == count:
+            break
+        position += 1
+        delta |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            previous += delta
+            ids.append(previous)
+            delta = 0
+            shift = 0
+        else:
+            shift += 7
+
+    statuses = b"".join(_UNPACKED_STATUSES[packed] for packed in payload[position:])[:count]
+
+    return VoteStates.from_arrays(ids, statuses)
+
+
+class PostIds(dict):
+    # vote_id -> (status id, thread status id, content hash) of the toot a vote was posted as, the thread it replied to
+    # and a hash of the rendered toot. Votes that errored only have the thread, so it can still be cleaned up.
+
+    def max_vote_id(self) -> int | None:
+        return max((numeric_id for numeric_id in map(_numeric_vote_id, self) if numeric_id is not None), default=None)
+
+    def is_compact(self) -> bool:
+        return all(_numeric_vote_id(vote_id) is not None for vote_id in self)
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def encode_post_ids(post_ids: PostIds) -> str:
+    # p2 layout, zlib compressed: varint count, then per vote sorted by id the varint id delta, the zigzag deltas of the
+    # status and thread ids (0 for none) and the 4 byte content hash (0 for none). Status ids are snowflakes posted
+    # seconds apart and replies share their thread, so the deltas are small.
+    payload = bytearray()
+    _write_varint(payload, len(post_ids))
+    previous = (0, 0, 0)
+    for numeric_id, vote_id in sorted((int(vote_id), vote_id) for vote_id in post_ids):
+        status_id, thread_id, content_hash = post_ids[vote_id]
+        current = (numeric_id, status_id or 0, thread_id or 0)
+        _write_varint(payload, current[0] - previous[0])
+        _write_varint(payload, _zigzag(current[1] - previous[1]))
+        _write_varint(payload, _zigzag(current[2] - previous[2]))
+        payload += (content_hash or 0).to_bytes(4, "little")
+        previous = current
+
+    return POST_IDS_FORMAT_PREFIX + base64.b64encode(zlib.compress(bytes(payload), 9)).decode()
+
+
+def decode_post_ids(value: str) -> PostIds:
+    # p1, written before content hashes were kept, is p2 without them
+    with_hashes = not value.startswith("p1:")
+    payload = zlib.decompress(base64.b64decode(value[len(POST_IDS_FORMAT_PREFIX) :], validate=True))
+    count, position = _read_varint(payload, 0)
+
+    post_ids = PostIds()
+    numeric_id = status_id = thread_id = 0
+    for _ in range(count):
+        delta, position = _read_varint(payload, position)
+        numeric_id += delta
+        delta, position = _read_varint(payload, position)
+        status_id += _unzigzag(delta)
+        delta, position = _read_varint(payload, position)
+        thread_id += _unzigzag(delta)
+        content_hash = 0
+        if with_hashes:
+            content_hash = int.from_bytes(payload[position : position + 4], "little")
+            position += 4
+        post_ids[str(numeric_id)] = (status_id or None, thread_id or None, content_hash or None)
+    return post_ids
+
+
+SHARD_SIZE = 10_000
+NON_NUMERIC_SHARD = "x"
+
+
+def shard_key(vote_id: str) -> str:
+    numeric_id = _numeric_vote_id(vote_id)
+    return NON_NUMERIC_SHARD if numeric_id is None else str(numeric_id // SHARD_SIZE)
+
+
+class ShardedVoteStates(MutableMapping):
+    # vote states split into shards by vote id range. Shards are only loaded (through load_shard) the first time one of
+    # their ids is looked up, and only the shards that were modified are reported as dirty.
+
+    shard_type = VoteStates
+
+    def __init__(self, known_shards: Iterable[str] = (), load_shard: Callable[[str], VoteStates] | None = None):
+        self.known_shards = set(known_shards)
+        self.shards = {}
+        self.dirty_shards = set()
+        self._load_shard = load_shard
+
+    @classmethod
+    def from_vote_states(cls, vote_states: Mapping) -> "ShardedVoteStates":
+        states_by_shard = {}
+        for vote_id, status in vote_states.items():
+            states_by_shard.setdefault(shard_key(vote_id), {})[vote_id] = status
+
+        sharded = cls(known_shards=states_by_shard)
+        sharded.shards = {key: cls.shard_type(states) for key, states in states_by_shard.items()}
+        return sharded
+
+    def shard(self, key: str) -> VoteStates:
+        if key not in self.shards:
+            if key in self.known_shards and self._load_shard is not None:
+                self.shards[key] = self._load_shard(key)
+            else:
+                self.shards[key] = self.shard_type()
+        return self.shards[key]
+
+    def load_all(self) -> None:
+        for key in self.known_shards:
+            self.shard(key)
+
+    def mark_all_dirty(self) -> None:
+        self.dirty_shards.update(key for key, shard in self.shards.items() if shard)
+
+    def __contains__(self, vote_id) -> bool:
+        return isinstance(vote_id, str) and vote_id in self.shard(shard_key(vote_id))
+
+    def __getitem__(self, vote_id: str) -> str:
+        return self.shard(shard_key(vote_id))[vote_id]
+
+    def __setitem__(self, vote_id: str, status: str) -> None:
+        key = shard_key(vote_id)
+        self.shard(key)[vote_id] = status
+        self.dirty_shards.add(key)
+
+    def __delitem__(self, vote_id: str) -> None:
+        key = shard_key(vote_id)
+        del self.shard(key)[vote_id]
+        self.dirty_shards.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        # only the loaded shards, iterating must not trigger reads of every shard
+        for key in sorted(self.shards, key=lambda key: (not key.isdigit(), int(key) if key.isdigit() else 0)):
+            yield from self.shards[key]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards.values())
+
+    def __repr__(self) -> str:
+        return f"ShardedVoteStates({dict(self)!r})"
+
+    def vote_ids_between(self, low: int, high: int) -> Iterator[str]:
+        # loads the shards covering [low, high] and the non numeric one, the ids they hold may fall outside the range
+        for key in [str(key) for key in range(low // SHARD_SIZE, high // SHARD_SIZE + 1)] + [NON_NUMERIC_SHARD]:
+            if key in self.known_shards or key in self.shards:
+                yield from self.shard(key)
+
+    def max_vote_id(self) -> int | None:
+        numeric_shards = [key for key in self.known_shards | set(self.shards) if key.isdigit()]
+        for key in sorted(numeric_shards, key=int, reverse=True):
+            max_vote_id = self.shard(key).max_vote_id()
+            if max_vote_id is not None:
+                return max_vote_id
+        return None
+
+
+class ShardedPostIds(ShardedVoteStates):
+    # the post ids of a legislature, sharded like its vote states
+    shard_type = PostIds
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator
+
+from votacoes_assembleia_da_republica.vote_states import _numeric_vote_id
+
+POSITIONS = ("in_favour", "against", "abstained", "absent")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS votes (
+    vote_id TEXT PRIMARY KEY,
+    numeric_id INTEGER,
+    legislature TEXT NOT NULL,
+    result TEXT,
+    date TEXT,
+    initiative_type TEXT,
+    title TEXT,
+    phase TEXT,
+    initiative_uri TEXT,
+    detail TEXT -- unanime, prejudicado or sem detalhes, NULL when the breakdown is in vote_positions
+);
+CREATE INDEX IF NOT EXISTS votes_legislature ON votes (legislature, numeric_id);
+CREATE INDEX IF NOT EXISTS votes_date ON votes (date);
+CREATE INDEX IF NOT EXISTS votes_result ON votes (result, date);
+CREATE INDEX IF NOT EXISTS votes_initiative_type ON votes (initiative_type, date);
+
+CREATE TABLE IF NOT EXISTS vote_authors (
+    vote_id TEXT NOT NULL REFERENCES votes (vote_id) ON DELETE CASCADE,
+    ord INTEGER NOT NULL,
+    party TEXT NOT NULL,
+    PRIMARY KEY (vote_id, ord)
+);
+CREATE INDEX IF NOT EXISTS vote_authors_party ON vote_authors (party, vote_id);
+
+CREATE TABLE IF NOT EXISTS vote_positions (
+    vote_id TEXT NOT NULL REFERENCES votes (vote_id) ON DELETE CASCADE,
+    position TEXT NOT NULL,
+    ord INTEGER NOT NULL,
+    party TEXT NOT NULL,
+    PRIMARY KEY (vote_id, position, ord)
+);
+CREATE INDEX IF NOT EXISTS vote_positions_party ON vote_positions (party, position, vote_id);
+"""
+
+VOTE_COLUMNS = ("vote_id", "legislature", "result", "date", "initiative_type", "title", "phase", "initiative_uri", "detail")
+
+
+def default_path() -> str:
+    return os.getenv("VOTE_STORE_PATH", ".cache/votes.sqlite3")
+
+
+class VoteStore:
+    # every vote parse_vote has ever produced, kept in SQLite so it can be queried without re-parsing the dumps.
+    # Connections are shared by the legislature worker threads, a lock keeps their statements apart.
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_path()
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def __enter__(self):
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        return self
+
+    def __exit__(self, *args):
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
+
+    def upsert_votes(self, legislature: str, votes: Iterable[dict]) -> int:
+        count = 0
+        with self.lock, self.connection:
+            for vote in votes:
+                detail = vote["vote_detail"] if isinstance(vote["vote_detail"], str) else None
+                self.connection.execute(
+                    """
+                    INSERT INTO votes (vote_id, numeric_id, legislature, result, date, initiative_type, title, phase, initiative_uri, detail)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (vote_id) DO UPDATE SET
+                        legislature = excluded.legislature, result = excluded.result, date = excluded.date,
+                        initiative_type = excluded.initiative_type, title = excluded.title, phase = excluded.phase,
+                        initiative_uri = excluded.initiative_uri, detail = excluded.detail
+                    """,
+                    (
+                        vote["vote_id"],
+                        _numeric_vote_id(vote["vote_id"]),
+                        legislature,
+                        vote["result"],
+                        vote["date"],
+                        vote["initiative_type"],
+                        vote["title"],
+                        vote["phase"],
+                        vote["initiative_uri"],
+                        detail,
+                    ),
+                )
+                self.connection.execute("DELETE FROM vote_authors WHERE vote_id = ?", (vote["vote_id"],))
+                self.connection.execute("DELETE FROM vote_positions WHERE vote_id = ?", (vote["vote_id"],))
+                self.connection.executemany(
+                    "INSERT INTO vote_authors (vote_id, ord, party) VALUES (?, ?, ?)", [(vote["vote_id"], i, party) for i, party in enumerate(vote["authors"])]
+                )
+                if detail is None:
+                    self.connection.executemany(
+                        "INSERT INTO vote_positions (vote_id, position, ord, party) VALUES (?, ?, ?, ?)",
+                        [(vote["vote_id"], position, i, party) for position in POSITIONS for i, party in enumerate(vote["vote_detail"][position])],
+                    )
+                count += 1
+        return count
+
+    def __contains__(self, vote_id: str) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM votes WHERE vote_id = ?", (vote_id,)).fetchone() is not None
+
+    def max_vote_id(self, legislature: str) -> int | None:
+        return self.vote_id_range(legislature)[1]
+
+    def vote_id_range(self, legislature: str) -> tuple[int | None, int | None]:
+        with self.lock:
+            row = self.connection.execute("SELECT min(numeric_id), max(numeric_id) FROM votes WHERE legislature = ?", (legislature,)).fetchone()
+        return row[0], row[1]
+
+    def new_votes(self, legislature: str, known_vote_ids: Iterable[str]) -> list[dict]:
+        # anti-join of the stored votes against the ids the caller already knows about, e.g. the ones in the state
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS known_votes (vote_id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM known_votes")
+            self.connection.executemany("INSERT OR IGNORE INTO known_votes (vote_id) VALUES (?)", ((vote_id,) for vote_id in known_vote_ids))
+            rows = self.connection.execute(
+                f"""
+                SELECT {", ".join(f"votes.{column}" for column in VOTE_COLUMNS)} FROM votes
+                LEFT JOIN known_votes ON known_votes.vote_id = votes.vote_id
+                WHERE votes.legislature = ? AND known_votes.vote_id IS NULL
+                ORDER BY votes.numeric_id, votes.vote_id
+                """,
+                (legislature,),
+            ).fetchall()
+            return list(self._votes_from_rows(rows))
+
+    def query(
+        self,
+        legislature: str | None = None,
+        result: str | None = None,
+        initiative_type: str | None = None,
+        author: str | None = None,
+        party: str | None = None,
+        position: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+    ) -> list[dict]:
+        # e.g. query(result="Rejeitado", author="PS", date_from="2025-03-01", date_to="2025-03-31"), dates are inclusive
+        if position is not None and position not in POSITIONS:
+            raise ValueError(f"position must be one of {', '.join(POSITIONS)}")
+
+        conditions = []
+        parameters = []
+        for column, value in (("legislature", legislature), ("result", result), ("initiative_type", initiative_type)):
+            if value is not None:
+                conditions.append(f"votes.{column} = ?")
+                parameters.append(value)
+        if date_from is not None:
+            conditions.append("votes.date >= ?")
+            parameters.append(date_from)
+        if date_to is not None:
+            conditions.append("votes.date <= ?")
+            parameters.append(date_to)
+        if author is not None:
+            conditions.append("votes.vote_id IN (SELECT vote_id FROM vote_authors WHERE party = ?)")
+            parameters.append(author)
+        if party is not None:
+            if position is None:
+                conditions.append("votes.vote_id IN (SELECT vote_id FROM vote_positions WHERE party = ?)")
+                parameters.append(party)
+            else:
+                conditions.append("votes.vote_id IN (SELECT vote_id FROM vote_positions WHERE party = ? AND position = ?)")
+                parameters.extend((party, position))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(f'votes.{column}' for column in VOTE_COLUMNS)} FROM votes {where} ORDER BY votes.date, votes.numeric_id", parameters
+            ).fetchall()
+            return list(self._votes_from_rows(rows))
+
+    def _votes_from_rows(self, rows: list[sqlite3.Row]) -> Iterator[dict]:
+        # rebuilds the dicts parse_vote returns, so stored votes can be rendered like freshly parsed ones
+        for row in rows:
+            vote_id = row["vote_id"]
+            authors = [party for (party,) in self.connection.execute("SELECT party FROM vote_authors WHERE vote_id = ? ORDER BY ord", (vote_id,))]
+            vote_detail = row["detail"]
+            if vote_detail is None:
+                vote_detail = {position: [] for position in POSITIONS}
+                for position, party in self.connection.execute(
+                    "SELECT position, party FROM vote_positions WHERE vote_id = ? ORDER BY position, ord", (vote_id,)
+                ):
+                    vote_detail[position].append(party)
+
+            yield {
+                "vote_id": vote_id,
+                "result": row["result"],
+                "vote_detail": vote_detail,
+                "date": row["date"],
+                "authors": authors,
+                "initiative_type": row["initiative_type"],
+                "title": row["title"],
+                "phase": row["phase"],
+                "initiative_uri": row["initiative_uri"],
+            }